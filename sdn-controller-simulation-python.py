@@ -1,43 +1,2862 @@
 #SDN Controller Simulation
 
 
+import argparse
+import asyncio
+import bisect
+import datetime
+import functools
+import gc
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import pickle
+import platform
 import random
+import socket
+import struct
+import sys
+import threading
 import time
-from collections import defaultdict
+import tracemalloc
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from operator import attrgetter, itemgetter
 import matplotlib.pyplot as plt
 import numpy as np
 
+# All console output goes through this logger; main() shows INFO and above by default.
+# Per-switch and per-link topology messages are DEBUG so large topologies stay quiet
+logger = logging.getLogger("sdn_controller")
+
+
+# Fields that can match a CIDR prefix such as '10.0.0.0/24' instead of a single address,
+# and fields that can match an inclusive (low, high) range instead of a single port
+IP_FIELDS = ('src_ip', 'dst_ip')
+PORT_FIELDS = ('src_port', 'dst_port')
+WILDCARD_FIELDS = IP_FIELDS + PORT_FIELDS
+
+# Kinds of wildcard match values: (PREFIX_MATCH, network, length) or (RANGE_MATCH, low, high)
+PREFIX_MATCH = 0
+RANGE_MATCH = 1
+
+# Netmask of every IPv4 prefix length
+PREFIX_MASKS = [(0xffffffff << (32 - length)) & 0xffffffff for length in range(33)]
+
+_prefix_specs = {}  # CIDR string -> parsed prefix
+_packet_addresses = {}  # dotted address seen in a packet -> integer
+
+
+# Function to convert a dotted IPv4 address to an integer and back
+def ip_to_int(address):
+    return struct.unpack('!I', socket.inet_aton(address))[0]
+
+
+def int_to_ip(address):
+    return socket.inet_ntoa(struct.pack('!I', address))
+
+
+# Function to get the integer address of a packet field (None if it is not an IPv4 address)
+# Conversions are memoized since the same hosts keep sending
+def packet_address(value):
+    if value.__class__ is not str:
+        return None
+    address = _packet_addresses.get(value)
+    if address is None:
+        try:
+            address = ip_to_int(value)
+        except OSError:
+            return None
+        if len(_packet_addresses) >= 65536:
+            _packet_addresses.clear()
+        _packet_addresses[value] = address
+    return address
+
+
+# Function to parse a CIDR string into (PREFIX_MATCH, network, length); None if malformed
+def _parse_prefix(value):
+    address, _, length = value.partition('/')
+    if not length.isdigit() or int(length) > 32:
+        return None
+    length = int(length)
+    try:
+        network = ip_to_int(address)
+    except OSError:
+        return None
+    if network & ~PREFIX_MASKS[length] & 0xffffffff:
+        return None
+    return (PREFIX_MATCH, network, length)
+
+
+# Function to parse the wildcard in a rule's match value
+# Returns None for an exact value; a malformed prefix or range is compared as an exact value
+def match_spec(field, value):
+    if field in IP_FIELDS:
+        if value.__class__ is not str or '/' not in value:
+            return None
+        if value not in _prefix_specs:
+            _prefix_specs[value] = _parse_prefix(value)
+        return _prefix_specs[value]
+    if field in PORT_FIELDS and isinstance(value, (tuple, list)) and len(value) == 2 and \
+            all(isinstance(port, int) for port in value) and value[0] <= value[1]:
+        return (RANGE_MATCH, value[0], value[1])
+    return None
+
+
+# Function to reject match values written as a prefix or a range that cannot be parsed
+def validate_match(match):
+    for field in WILDCARD_FIELDS:
+        value = match.get(field)
+        if field in IP_FIELDS and isinstance(value, str) and '/' in value and \
+                match_spec(field, value) is None:
+            raise ValueError(f"invalid prefix {value!r} for {field}")
+        if field in PORT_FIELDS and isinstance(value, (tuple, list)) and \
+                match_spec(field, value) is None:
+            raise ValueError(f"invalid port range {value!r} for {field}")
+
+
+# Function to check whether some packet value can satisfy two match values of one field
+def values_overlap(field, first, second):
+    first_spec, second_spec = match_spec(field, first), match_spec(field, second)
+    if first_spec is None and second_spec is None:
+        return first == second
+    if field in IP_FIELDS:
+        prefixes = []
+        for value, spec in ((first, first_spec), (second, second_spec)):
+            if spec is None:
+                address = packet_address(value)
+                if address is None:
+                    return False
+                spec = (PREFIX_MATCH, address, 32)
+            prefixes.append(spec)
+        (_, first_network, first_length), (_, second_network, second_length) = prefixes
+        mask = PREFIX_MASKS[min(first_length, second_length)]
+        return first_network & mask == second_network & mask
+    ranges = []
+    for value, spec in ((first, first_spec), (second, second_spec)):
+        if spec is None:
+            if not isinstance(value, (int, np.integer)):
+                return False
+            spec = (RANGE_MATCH, value, value)
+        ranges.append(spec)
+    (_, first_low, first_high), (_, second_low, second_high) = ranges
+    return first_low <= second_high and second_low <= first_high
+
+
+# Function to check whether a packet can match both of two rule matches
+def matches_overlap(first, second):
+    return all(values_overlap(field, value, second[field])
+               for field, value in first.items() if field in second)
+
+
+# Function to check whether every packet value satisfying the specific match value of a field
+# satisfies the general one as well
+# An exact value only covers the same exact value, never a prefix or a range
+def value_covers(field, general, specific):
+    general_spec = match_spec(field, general)
+    specific_spec = match_spec(field, specific)
+    if general_spec is None:
+        return specific_spec is None and general == specific
+    kind, low, high = general_spec
+    if kind == PREFIX_MATCH:
+        if specific_spec is None:
+            return spec_contains(general_spec, specific)
+        return specific_spec[2] >= high and specific_spec[1] & PREFIX_MASKS[high] == low
+    if specific_spec is None:
+        return isinstance(specific, (int, np.integer)) and low <= specific <= high
+    return low <= specific_spec[1] and specific_spec[2] <= high
+
+
+# Function to check whether every packet matching the specific match also matches the general
+# one (fields missing from the general match are wildcards)
+def match_covers(general, specific):
+    return all(field in specific and value_covers(field, value, specific[field])
+               for field, value in general.items())
+
+
+# Function to check whether a packet value falls inside a parsed wildcard
+def spec_contains(spec, value):
+    kind, low, high = spec
+    if kind == PREFIX_MATCH:
+        address = packet_address(value)
+        return address is not None and address & PREFIX_MASKS[high] == low
+    return isinstance(value, (int, np.integer)) and low <= value <= high
+
+
+# Function to list the fields of a match that hold a prefix or a range
+def wildcard_fields(match):
+    fields = ()
+    for field in WILDCARD_FIELDS:
+        if field in match and match_spec(field, match[field]) is not None:
+            fields += (field,)
+    return fields
+
+
+# Function to check quickly whether a column of match values may hold wildcards
+# It can answer True for exact values (the rules are then checked one by one), never False
+# for a column that holds a wildcard
+def _may_hold_wildcards(field, values):
+    if field in IP_FIELDS:
+        try:
+            return '/' in ''.join(values)
+        except TypeError:
+            return True
+    if field in PORT_FIELDS:
+        return not set(map(type, values)) <= {int}
+    return False
+
+
+# Function to check whether a packet satisfies every field of a rule's match criteria
+def rule_matches(match, packet):
+    for key, value in match.items():
+        if key not in packet:
+            return False
+        if packet[key] != value:
+            spec = match_spec(key, value)
+            if spec is None or not spec_contains(spec, packet[key]):
+                return False
+    return True
+
+
+# Function used as the key getter for rules with an empty match (they match every packet)
+def _empty_key(packet):
+    return ()
+
+
+# Class mapping IPv4 prefixes to (sequence, rule) entries for longest-prefix matching
+# Each level of the binary trie that holds prefixes is kept as a hash table keyed by the
+# masked address, so a lookup probes only the prefix lengths in use, longest first, instead
+# of walking the address one bit at a time
+class PrefixTrie:
+
+    def __init__(self):
+        self.levels = {}  # prefix length -> {network: entries in installation order}
+        self.lengths = []  # prefix lengths in use, longest first
+        self.size = 0
+
+    def insert(self, network, length, entry):
+        level = self.levels.get(length)
+        if level is None:
+            level = self.levels[length] = {}
+            self.lengths = sorted(self.levels, reverse=True)
+        level.setdefault(network, []).append(entry)
+        self.size += 1
+
+    # Returns the sequence number of the removed entry, or None if the rule was not there
+    def remove(self, network, length, rule):
+        level = self.levels.get(length, {})
+        bucket = level.get(network)
+        if not bucket:
+            return None
+        for i, (seq, existing) in enumerate(bucket):
+            if existing is rule:
+                del bucket[i]
+                break
+        else:
+            return None
+        if not bucket:
+            del level[network]
+            if not level:
+                del self.levels[length]
+                self.lengths.remove(length)
+        self.size -= 1
+        return seq
+
+    # Returns the entry lists of every prefix holding the address, longest prefix first
+    def matches(self, address):
+        levels = self.levels
+        found = []
+        for length in self.lengths:
+            bucket = levels[length].get(address & PREFIX_MASKS[length])
+            if bucket:
+                found.append(bucket)
+        return found
+
+    def longest_match(self, address):
+        found = self.matches(address)
+        return found[0] if found else None
+
+    def entries(self):
+        for level in self.levels.values():
+            for bucket in level.values():
+                yield from bucket
+
+
+# Class indexing inclusive port ranges for stabbing queries
+# The range ends split the port space into elementary intervals, each listing the
+# (sequence, rule) entries of the ranges covering it, so a lookup is one binary search.
+# The intervals are rebuilt lazily after the ranges change
+class PortRangeIndex:
+
+    def __init__(self):
+        self.ranges = []  # (low, high, entry) in installation order
+        self.bounds = None  # start of every elementary interval
+        self.segments = None  # entries covering each elementary interval
+        self.size = 0
+
+    def insert(self, low, high, entry):
+        self.ranges.append((low, high, entry))
+        self.bounds = None
+        self.size += 1
+
+    def remove(self, low, high, rule):
+        for i, (_, _, (seq, existing)) in enumerate(self.ranges):
+            if existing is rule:
+                del self.ranges[i]
+                self.bounds = None
+                self.size -= 1
+                return seq
+        return None
+
+    def _build(self):
+        bounds = sorted({low for low, _, _ in self.ranges} |
+                        {high + 1 for _, high, _ in self.ranges})
+        segments = [[] for _ in bounds]
+        for low, high, entry in self.ranges:
+            for i in range(bisect.bisect_left(bounds, low), bisect.bisect_left(bounds, high + 1)):
+                segments[i].append(entry)
+        self.bounds = bounds
+        self.segments = segments
+
+    # Returns the entries of every range holding the port, in installation order
+    def matches(self, port):
+        if self.bounds is None:
+            self._build()
+        i = bisect.bisect_right(self.bounds, port) - 1
+        return [self.segments[i]] if i >= 0 and self.segments[i] else []
+
+    def entries(self):
+        for _, _, entry in self.ranges:
+            yield entry
+
+
+# Class that finds the first matching rule by scanning the rules in installation order
+class LinearClassifier:
+
+    def __init__(self):
+        self.rules = []
+
+    def insert(self, rule):
+        self.rules.append(rule)
+
+    def insert_many(self, rules):
+        self.rules.extend(rules)
+
+    def remove(self, rule):
+        for i, existing in enumerate(self.rules):
+            if existing is rule:
+                del self.rules[i]
+                return True
+        return False
+
+    def lookup(self, packet):
+        for rule in self.rules:
+            if rule_matches(rule.match, packet):
+                return rule
+        return None
+
+    def __len__(self):
+        return len(self.rules)
+
+
+# Class holding all rules that match on the same set of fields, hashed by their values
+class _RuleTuple:
+
+    def __init__(self, fields):
+        self.fields = fields
+        if not fields:
+            self.key_of = _empty_key
+        else:
+            # itemgetter returns a bare value for one field and a tuple for several
+            self.key_of = itemgetter(*fields)
+        self.entries = {}  # field values -> [(sequence, rule), ...] in installation order
+        self.first_seq = None
+        self.size = 0
+
+    def insert(self, key, seq, rule):
+        self.entries.setdefault(key, []).append((seq, rule))
+        if self.first_seq is None:
+            self.first_seq = seq
+        self.size += 1
+
+    def remove(self, key, rule):
+        bucket = self.entries.get(key)
+        if not bucket:
+            return False
+        for i, (seq, existing) in enumerate(bucket):
+            if existing is rule:
+                del bucket[i]
+                break
+        else:
+            return False
+        if not bucket:
+            del self.entries[key]
+        self.size -= 1
+        if self.size == 0:
+            self.first_seq = None
+        elif seq == self.first_seq:
+            self.first_seq = min(entries[0][0] for entries in self.entries.values())
+        return True
+
+
+# Class holding the rules that match on the same set of fields with prefixes or ranges in
+# the same wildcard fields. Exact fields are hashed as in _RuleTuple; each hash bucket indexes
+# its rules by one wildcard field (a prefix trie for addresses, an interval index for ports)
+# and the candidates found there are checked against any other wildcard fields
+class _WildcardTuple:
+
+    def __init__(self, fields, wildcards):
+        self.fields = fields
+        self.wildcards = wildcards
+        exact_fields = tuple(field for field in fields if field not in wildcards)
+        self.key_of = itemgetter(*exact_fields) if exact_fields else _empty_key
+        self.exact_fields = exact_fields
+        # Addresses are indexed in preference to ports, as prefixes are usually more selective
+        self.index_field = wildcards[0]
+        self.index_type = PrefixTrie if self.index_field in IP_FIELDS else PortRangeIndex
+        self.verify = len(wildcards) > 1
+        self.entries = {}  # exact field values -> PrefixTrie or PortRangeIndex
+        self.first_seq = None
+        self.size = 0
+
+    def insert(self, key, seq, rule):
+        index = self.entries.get(key)
+        if index is None:
+            index = self.entries[key] = self.index_type()
+        _, low, high = match_spec(self.index_field, rule.match[self.index_field])
+        index.insert(low, high, (seq, rule))
+        if self.first_seq is None:
+            self.first_seq = seq
+        self.size += 1
+
+    def remove(self, key, rule):
+        index = self.entries.get(key)
+        if index is None:
+            return False
+        _, low, high = match_spec(self.index_field, rule.match[self.index_field])
+        seq = index.remove(low, high, rule)
+        if seq is None:
+            return False
+        if not index.size:
+            del self.entries[key]
+        self.size -= 1
+        if self.size == 0:
+            self.first_seq = None
+        elif seq == self.first_seq:
+            self.first_seq = min(seq for seq, _ in self.all_entries())
+        return True
+
+    def all_entries(self):
+        for index in self.entries.values():
+            yield from index.entries()
+
+# Function to build every port range index now rather than on its first lookup
+    def prepare(self):
+        for index in self.entries.values():
+            if isinstance(index, PortRangeIndex) and index.bounds is None:
+                index._build()
+
+    # Returns the earliest (sequence, rule) matching the packet that precedes best_seq
+    def lookup(self, packet, best_seq=None):
+        try:
+            index = self.entries.get(self.key_of(packet))
+        except (KeyError, TypeError):
+            return None
+        if index is None:
+            return None
+        value = packet.get(self.index_field)
+        if self.index_type is PrefixTrie:
+            value = packet_address(value)
+            if value is None:
+                return None
+        try:
+            buckets = index.matches(value)
+        except TypeError:
+            return None
+
+        found = None
+        for bucket in buckets:
+            for seq, rule in bucket:
+                if best_seq is not None and seq >= best_seq:
+                    break
+                if not self.verify or rule_matches(rule.match, packet):
+                    found, best_seq = (seq, rule), seq
+                    break
+        return found
+
+
+# Class implementing tuple-space search: one hash table per distinct set of match fields
+# Lookup cost grows with the number of field sets, not with the number of rules
+# Rules with CIDR prefixes or port ranges go to wildcard tuples, searched after the exact ones
+class TupleSpaceClassifier:
+
+    def __init__(self):
+        self.tuples = {}  # sorted field names -> _RuleTuple
+        self.ordered_tuples = []  # tuples sorted by the earliest rule they hold
+        self.wildcard_tuples = {}  # (sorted field names, wildcard fields) -> _WildcardTuple
+        self.ordered_wildcard_tuples = []
+        self.unhashable = []  # (sequence, rule) pairs whose match values cannot be hashed
+        self.sequence = {}  # id(rule) -> installation sequence number
+        self.next_seq = 0
+
+    def insert(self, rule):
+        seq = self.next_seq
+        self.next_seq += 1
+        self.sequence[id(rule)] = seq
+
+        fields = tuple(sorted(rule.match))
+        wildcards = wildcard_fields(rule.match)
+        if wildcards:
+            self._insert_wildcard(fields, wildcards, seq, rule)
+            return
+        key = tuple(rule.match[field] for field in fields)
+        if len(fields) == 1:
+            key = key[0]
+        try:
+            hash(key)
+        except TypeError:
+            self.unhashable.append((seq, rule))
+            return
+
+        rule_tuple = self.tuples.get(fields)
+        if rule_tuple is None:
+            rule_tuple = _RuleTuple(fields)
+            self.tuples[fields] = rule_tuple
+        was_empty = rule_tuple.size == 0
+        rule_tuple.insert(key, seq, rule)
+        if was_empty:
+            # A fresh tuple always holds the newest rule, so it belongs at the end
+            self.ordered_tuples.append(rule_tuple)
+
+# Function to add a rule with prefixes or ranges to the wildcard tuple of its layout
+    def _insert_wildcard(self, fields, wildcards, seq, rule):
+        key = tuple(rule.match[field] for field in fields if field not in wildcards)
+        if len(key) == 1:
+            key = key[0]
+        try:
+            hash(key)
+        except TypeError:
+            self.unhashable.append((seq, rule))
+            return
+        wildcard_tuple = self.wildcard_tuples.get((fields, wildcards))
+        if wildcard_tuple is None:
+            wildcard_tuple = self.wildcard_tuples[fields, wildcards] = _WildcardTuple(fields,
+                                                                                     wildcards)
+        was_empty = wildcard_tuple.size == 0
+        wildcard_tuple.insert(key, seq, rule)
+        if was_empty:
+            self.ordered_wildcard_tuples.append(wildcard_tuple)
+
+    # Same as calling insert for every rule, with the per-rule field sorting done once per
+    # distinct match layout; used to rebuild large tables such as restored snapshots
+    def insert_many(self, rules):
+        if self._insert_new_tuple(rules):
+            return
+        layouts = {}  # match field order -> (rule tuple, key getter, may hold wildcards)
+        for rule in rules:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.sequence[id(rule)] = seq
+
+            match = rule.match
+            layout = layouts.get(tuple(match))
+            if layout is None:
+                fields = tuple(sorted(match))
+                rule_tuple = self.tuples.get(fields)
+                if rule_tuple is None:
+                    rule_tuple = self.tuples[fields] = _RuleTuple(fields)
+                layout = layouts[tuple(match)] = (rule_tuple, rule_tuple.key_of,
+                                                  any(field in match for field in WILDCARD_FIELDS))
+            rule_tuple, key_of, may_hold_wildcards = layout
+
+            if may_hold_wildcards:
+                wildcards = wildcard_fields(match)
+                if wildcards:
+                    self._insert_wildcard(rule_tuple.fields, wildcards, seq, rule)
+                    continue
+            key = key_of(match)
+            try:
+                bucket = rule_tuple.entries.get(key)
+            except TypeError:
+                self.unhashable.append((seq, rule))
+                continue
+            if bucket is None:
+                bucket = rule_tuple.entries[key] = []
+            bucket.append((seq, rule))
+            if rule_tuple.size == 0:
+                rule_tuple.first_seq = seq
+                self.ordered_tuples.append(rule_tuple)
+            rule_tuple.size += 1
+
+    # Fast path of insert_many for rules that all match on the same fields, with distinct
+    # values, going into an empty tuple: the whole hash table is built in one pass
+    def _insert_new_tuple(self, rules):
+        if not rules:
+            return True
+        matches = list(map(attrgetter('match'), rules))
+        layouts = set(map(tuple, matches))
+        if len(layouts) != 1:
+            return False
+        fields = tuple(sorted(layouts.pop()))
+        if fields in self.tuples:
+            return False
+        if any(_may_hold_wildcards(field, list(map(itemgetter(field), matches)))
+               for field in fields):
+            return False
+
+        rule_tuple = _RuleTuple(fields)
+        start = self.next_seq
+        sequences = range(start, start + len(rules))
+        try:
+            entries = dict(zip(map(rule_tuple.key_of, matches),
+                               [[pair] for pair in zip(sequences, rules)]))
+        except TypeError:
+            return False
+        if len(entries) != len(rules):
+            return False
+
+        rule_tuple.entries = entries
+        rule_tuple.first_seq = start
+        rule_tuple.size = len(rules)
+        self.tuples[fields] = rule_tuple
+        self.ordered_tuples.append(rule_tuple)
+        self.sequence.update(zip(map(id, rules), sequences))
+        self.next_seq += len(rules)
+        return True
+
+    def remove(self, rule):
+        seq = self.sequence.pop(id(rule), None)
+        if seq is None:
+            return False
+
+        for i, (unhashable_seq, existing) in enumerate(self.unhashable):
+            if existing is rule:
+                del self.unhashable[i]
+                return True
+
+        fields = tuple(sorted(rule.match))
+        wildcards = wildcard_fields(rule.match)
+        if wildcards:
+            key = tuple(rule.match[field] for field in fields if field not in wildcards)
+            if len(key) == 1:
+                key = key[0]
+            wildcard_tuple = self.wildcard_tuples[fields, wildcards]
+            wildcard_tuple.remove(key, rule)
+            if wildcard_tuple.size == 0:
+                del self.wildcard_tuples[fields, wildcards]
+                self.ordered_wildcard_tuples.remove(wildcard_tuple)
+            else:
+                self.ordered_wildcard_tuples.sort(key=lambda t: t.first_seq)
+            return True
+        key = tuple(rule.match[field] for field in fields)
+        if len(fields) == 1:
+            key = key[0]
+        rule_tuple = self.tuples[fields]
+        rule_tuple.remove(key, rule)
+        if rule_tuple.size == 0:
+            del self.tuples[fields]
+            self.ordered_tuples.remove(rule_tuple)
+        else:
+            self.ordered_tuples.sort(key=lambda t: t.first_seq)
+        return True
+
+    def lookup(self, packet):
+        best_seq = None
+        best_rule = None
+
+        for seq, rule in self.unhashable:
+            if rule_matches(rule.match, packet):
+                best_seq, best_rule = seq, rule
+                break
+
+        for rule_tuple in self.ordered_tuples:
+            # Tuples are ordered by their earliest rule, so nothing later can win
+            if best_seq is not None and rule_tuple.first_seq > best_seq:
+                break
+            try:
+                bucket = rule_tuple.entries.get(rule_tuple.key_of(packet))
+            except (KeyError, TypeError):
+                continue
+            if bucket:
+                seq, rule = bucket[0]
+                if best_seq is None or seq < best_seq:
+                    best_seq, best_rule = seq, rule
+
+        for wildcard_tuple in self.ordered_wildcard_tuples:
+            if best_seq is not None and wildcard_tuple.first_seq > best_seq:
+                break
+            found = wildcard_tuple.lookup(packet, best_seq)
+            if found is not None:
+                best_seq, best_rule = found
+
+        return best_rule
+
+    def __len__(self):
+        return len(self.sequence)
+
+    # Sequence numbers are keyed by object id, so they are rebuilt after unpickling
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['sequence']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sequence = {}
+        for seq, rule in self.unhashable:
+            self.sequence[id(rule)] = seq
+        for rule_tuple in self.tuples.values():
+            for bucket in rule_tuple.entries.values():
+                for seq, rule in bucket:
+                    self.sequence[id(rule)] = seq
+        for wildcard_tuple in self.wildcard_tuples.values():
+            for seq, rule in wildcard_tuple.all_entries():
+                self.sequence[id(rule)] = seq
+
+
+# Largest tuple whose rules are compiled into inline comparisons rather than one hash lookup
+INLINE_TUPLE_SIZE = 4
+
+# Value of a field the packet does not have in compiled lookups; it equals no rule value
+_MISSING = object()
+_NO_MATCH = sys.maxsize
+
+
+# Function to generate the source of a lookup function specialized to a tuple-space index
+# Packet fields are read once into locals. Tuples with many rules become one dict lookup on
+# a key built from those locals; the rules of small tuples become if statements with their
+# constants inlined, the most selective fields compared first, and a comparison shared by
+# consecutive rules emitted once around all of them. Rules are visited in the tuples' order
+# of earliest rule, returning as soon as nothing later can beat the best match found
+# Returns (source, namespace the source refers to)
+def generate_lookup_source(index):
+    items = []  # (first sequence, kind, data) in priority order
+    for rule_tuple in index.ordered_tuples:
+        if rule_tuple.size > INLINE_TUPLE_SIZE:
+            table = {key: bucket[0] for key, bucket in rule_tuple.entries.items()}
+            items.append((rule_tuple.first_seq, 'hash', (rule_tuple.fields, table)))
+        else:
+            items.extend((seq, 'rule', rule)
+                         for bucket in rule_tuple.entries.values() for seq, rule in bucket)
+    for wildcard_tuple in index.ordered_wildcard_tuples:
+        entries = sorted(wildcard_tuple.all_entries(), key=itemgetter(0))
+        if wildcard_tuple.size > INLINE_TUPLE_SIZE:
+            # A private copy, so later changes to the index cannot leak into the function
+            copy = _WildcardTuple(wildcard_tuple.fields, wildcard_tuple.wildcards)
+            for seq, rule in entries:
+                copy.insert(wildcard_tuple.key_of(rule.match), seq, rule)
+            copy.prepare()
+            items.append((copy.first_seq, 'wildcard', copy))
+        else:
+            items.extend((seq, 'rule', rule) for seq, rule in entries)
+    items.extend((seq, 'generic', rule) for seq, rule in index.unhashable)
+    items.sort(key=itemgetter(0))
+
+    # Fields with more distinct values among the rules reject more packets, so they go first
+    distinct = defaultdict(set)
+    for _, kind, data in items:
+        if kind == 'rule':
+            for field, value in data.match.items():
+                distinct[field].add(repr(value))
+
+    namespace = {'_MISSING': _MISSING, '_NO_MATCH': _NO_MATCH, '_packet_address': packet_address,
+                 '_rule_matches': rule_matches, '_INTEGER_TYPES': (int, np.integer)}
+    field_names = {}  # packet field -> local variable
+    address_names = {}  # packet field -> local variable holding its integer address
+    lines = []
+
+    def constant(value):
+        if type(value) in (int, str):
+            return repr(value)
+        name = f"C{len(namespace)}"
+        namespace[name] = value
+        return name
+
+    def local(field):
+        if field not in field_names:
+            field_names[field] = f"f{len(field_names)}"
+        return field_names[field]
+
+    # Conditions of a rule as (source text, rank) pairs, cheapest and most selective first
+    def conditions(seq, kind, rule):
+        if kind == 'generic':
+            return [(f"_rule_matches({constant(rule)}.match, packet)", (3, seq))]
+        found = []
+        for field, value in rule.match.items():
+            spec = match_spec(field, value)
+            name = local(field)
+            if spec is None:
+                found.append((f"{name} == {constant(value)}", (0, -len(distinct[field]))))
+            elif spec[0] == PREFIX_MATCH:
+                address = address_names.setdefault(field, f"a{len(address_names)}")
+                found.append((f"({address} is not None and "
+                              f"{address} & {PREFIX_MASKS[spec[2]]} == {spec[1]})", (1, 0)))
+            else:
+                found.append((f"(isinstance({name}, _INTEGER_TYPES) and "
+                              f"{spec[1]} <= {name} <= {spec[2]})", (2, 0)))
+        return sorted(found, key=itemgetter(1))
+
+    # Emits consecutive inline rules, nesting those that share their first untested condition
+    # A match that comes after the best dict match so far returns that one instead
+    def emit_rules(rules, tested, indent, have_best):
+        i = 0
+        while i < len(rules):
+            seq, rule, rule_conditions = rules[i]
+            pending = [condition for condition in rule_conditions if condition not in tested]
+            shared, end = None, i + 1
+            for condition in pending:
+                j = i + 1
+                while j < len(rules) and condition in rules[j][2]:
+                    j += 1
+                if j > end:
+                    shared, end = condition, j
+            if shared is not None:
+                lines.append(f"{indent}if {shared[0]}:")
+                emit_rules(rules[i:end], tested | {shared}, indent + "    ", have_best)
+                i = end
+                continue
+            result = f"{rule} if best > {seq} else best_rule" if have_best else rule
+            if not pending:
+                lines.append(f"{indent}return {result}")
+                return
+            lines.append(f"{indent}if {' and '.join(text for text, _ in pending)}:")
+            lines.append(f"{indent}    return {result}")
+            i += 1
+
+    have_best = False
+    position = 0
+    while position < len(items):
+        seq, kind, data = items[position]
+        if have_best:
+            lines.append(f"    if best < {seq}:")
+            lines.append("        return best_rule")
+        if kind == 'hash':
+            fields, table = data
+            name = f"T{len(namespace)}"
+            namespace[name] = table
+            key = ', '.join(local(field) for field in fields)
+            if len(fields) != 1:
+                key = f"({key})"
+            lines.append(f"    entry = {name}.get({key})")
+            lines.append(f"    if entry is not None{' and entry[0] < best' if have_best else ''}:")
+            lines.append("        best, best_rule = entry")
+            have_best = True
+            position += 1
+        elif kind == 'wildcard':
+            name = f"W{len(namespace)}"
+            namespace[name] = data
+            lines.append(f"    entry = {name}.lookup(packet, best)")
+            lines.append("    if entry is not None:")
+            lines.append("        best, best_rule = entry")
+            have_best = True
+            position += 1
+        else:
+            run = []
+            while position < len(items) and items[position][1] in ('rule', 'generic'):
+                seq, kind, rule = items[position]
+                run.append((seq, constant(rule), conditions(seq, kind, rule)))
+                position += 1
+            emit_rules(run, frozenset(), "    ", have_best)
+
+    header = ["def lookup(packet):", "    get = packet.get"]
+    for field, name in field_names.items():
+        header.append(f"    {name} = get({constant(field)}, _MISSING)")
+    for field, name in address_names.items():
+        header.append(f"    {name} = _packet_address({field_names[field]})")
+    if not have_best:
+        # Only inline rules: nothing to track between them
+        return "\n".join(header + lines + ["    return None", ""]), namespace
+    header += ["    best = _NO_MATCH", "    best_rule = None"]
+    return "\n".join(header + lines + ["    return best_rule", ""]), namespace
+
+
+# Class that compiles a flow table into one generated Python lookup function
+# A tuple-space index is kept up to date as the interpreted path. Rules added after the last
+# compilation have the lowest priority, so they are searched in a small tail index only when
+# the compiled function finds nothing; a removed rule, or a tail grown past a quarter of the
+# table, sends lookups back to the interpreted path until enough of them have run to pay for
+# compiling again
+class CompiledClassifier:
+
+    def __init__(self):
+        self.index = TupleSpaceClassifier()
+        self.compiled = None
+        self.source = None
+        self.tail = None  # TupleSpaceClassifier of the rules added since compiling
+        self.compiled_size = 0
+        self.interpreted_lookups = 0
+        self.compilations = 0
+
+    def insert(self, rule):
+        self.index.insert(rule)
+        if self.compiled is not None:
+            self.tail.insert(rule)
+            if len(self.tail) > max(32, self.compiled_size // 4):
+                self.invalidate()
+
+    def insert_many(self, rules):
+        self.index.insert_many(rules)
+        self.invalidate()
+
+    def remove(self, rule):
+        if not self.index.remove(rule):
+            return False
+        if self.compiled is not None and not self.tail.remove(rule):
+            self.invalidate()
+        return True
+
+    def invalidate(self):
+        self.compiled = None
+        self.source = None
+        self.tail = None
+        self.interpreted_lookups = 0
+
+    def compile(self):
+        self.source, namespace = generate_lookup_source(self.index)
+        exec(compile(self.source, f"<compiled flow table {id(self):#x}>", 'exec'), namespace)
+        self.compiled = namespace['lookup']
+        self.tail = TupleSpaceClassifier()
+        self.compiled_size = len(self.index)
+        self.compilations += 1
+
+    def lookup(self, packet):
+        compiled = self.compiled
+        if compiled is None:
+            self.interpreted_lookups += 1
+            if self.interpreted_lookups < max(32, len(self.index) // 8):
+                return self.index.lookup(packet)
+            self.compile()
+            compiled = self.compiled
+        try:
+            rule = compiled(packet)
+        except TypeError:
+            # Unhashable packet values are left to the interpreted path
+            return self.index.lookup(packet)
+        if rule is None and len(self.tail):
+            rule = self.tail.lookup(packet)
+        return rule
+
+    def __len__(self):
+        return len(self.index)
+
+    # Generated functions cannot be pickled; the table is compiled again after unpickling
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(compiled=None, source=None, tail=None, interpreted_lookups=0)
+        return state
+
+
+# Available flow table classifiers, selectable by name when creating a controller
+CLASSIFIERS = {
+    'linear': LinearClassifier,
+    'tuple_space': TupleSpaceClassifier,
+    'compiled': CompiledClassifier,
+}
+
+
+# Function to build a classifier of the given type over rules in installation order
+def build_classifier(classifier_type, rules):
+    classifier = classifier_type()
+    if hasattr(classifier, 'insert_many'):
+        classifier.insert_many(rules)
+    else:
+        for rule in rules:
+            classifier.insert(rule)
+    return classifier
+
+
+# Function to do a classifier's deferred work now (compiling, building range indexes), so
+# that lookups never change it afterwards and any number of threads can share it
+def freeze_classifier(classifier):
+    index = classifier
+    if isinstance(classifier, CompiledClassifier):
+        classifier.compile()
+        index = classifier.index
+    if isinstance(index, TupleSpaceClassifier):
+        for wildcard_tuple in index.wildcard_tuples.values():
+            wildcard_tuple.prepare()
+    return classifier
+
+
+# Class holding one flow rule. Controllers keep millions of rules, so a rule has fixed
+# slots instead of a dict, and its counters live in a row (slot) of the controller's
+# FlowStatsTable; slot is None while the rule is not installed
+class FlowRule:
+    __slots__ = ('match', 'action', 'priority', 'cookie', 'idle_timeout', 'hard_timeout',
+                 'stats', 'slot')
+
+    def __init__(self, match, action, priority=0, cookie=0, idle_timeout=0, hard_timeout=0,
+                 stats=None, slot=None):
+        self.match = match
+        self.action = action
+        self.priority = priority
+        self.cookie = cookie
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.stats = stats
+        self.slot = slot
+
+    @property
+    def counter(self):
+        return self.stats.packet_view[self.slot] if self.stats is not None else 0
+
+    @property
+    def byte_count(self):
+        return self.stats.byte_view[self.slot] if self.stats is not None else 0
+
+    @property
+    def created_at(self):
+        return float(self.stats.created_at[self.slot]) if self.stats is not None else 0.0
+
+    @property
+    def last_hit(self):
+        return self.stats.last_hit_view[self.slot] if self.stats is not None else 0.0
+
+    def __repr__(self):
+        return (f"FlowRule({self.match!r}, {self.action!r}, priority={self.priority}, "
+                f"cookie={self.cookie})")
+
+    # A rule is pickled without its row; an unpickled FlowStatsTable links its rules again
+    def __getstate__(self):
+        return (self.match, self.action, self.priority, self.cookie, self.idle_timeout,
+                self.hard_timeout)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+# Columns of a FlowStatsTable as (name, dtype, value of a free row)
+FLOW_STATS_COLUMNS = (
+    ('rules', object, None),
+    ('switch_indexes', np.int32, -1),
+    ('cookies', np.int64, 0),
+    ('packet_counts', np.int64, 0),
+    ('byte_counts', np.int64, 0),
+    ('created_at', np.float64, 0.0),
+    ('last_hits', np.float64, 0.0),
+)
+
+# Counters handed over with rules that move between tables (snapshots, switch hand-over)
+FLOW_COUNTER_COLUMNS = ('packet_counts', 'byte_counts', 'created_at', 'last_hits')
+
+
+# Class keeping the counters of every installed rule of a controller in NumPy columns, one
+# row per rule. Rows of removed rules are reused and the columns double when full. The
+# packet path updates single rows through memoryviews, about as cheap as a dict update,
+# while statistics queries work on whole columns
+class FlowStatsTable:
+
+    def __init__(self, capacity=1024):
+        self.size = 0  # rows handed out so far, installed or free
+        self.free_slots = []
+        self.switch_ids = []  # switch index -> switch_id
+        self.switch_numbers = {}  # switch_id -> switch index
+        self._resize(capacity)
+
+    def _resize(self, capacity):
+        for name, dtype, fill in FLOW_STATS_COLUMNS:
+            column = np.full(capacity, fill, dtype=dtype)
+            if self.size:
+                column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self._make_views()
+
+    def _make_views(self):
+        self.packet_view = memoryview(self.packet_counts)
+        self.byte_view = memoryview(self.byte_counts)
+        self.last_hit_view = memoryview(self.last_hits)
+
+    def switch_number(self, switch_id):
+        number = self.switch_numbers.get(switch_id)
+        if number is None:
+            number = self.switch_numbers[switch_id] = len(self.switch_ids)
+            self.switch_ids.append(switch_id)
+        return number
+
+    # Returns n free rows, reusing those of removed rules first
+    def _take_slots(self, n):
+        reused = self.free_slots[-n:] if n else []
+        del self.free_slots[len(self.free_slots) - len(reused):]
+        new = n - len(reused)
+        if self.size + new > len(self.rules):
+            self._resize(max(2 * len(self.rules), self.size + new))
+        slots = np.array(reused + list(range(self.size, self.size + new)), dtype=np.int64)
+        self.size += new
+        return slots
+
+    def add(self, switch_id, rule, now):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            if self.size == len(self.rules):
+                self._resize(2 * self.size)
+            slot = self.size
+            self.size += 1
+        self.rules[slot] = rule
+        self.switch_indexes[slot] = self.switch_number(switch_id)
+        self.cookies[slot] = rule.cookie
+        self.created_at[slot] = now
+        self.last_hit_view[slot] = now
+        rule.stats = self
+        rule.slot = slot
+
+# Function to install the rows of many rules at once; counters maps FLOW_COUNTER_COLUMNS
+# to arrays in the order of rules (missing columns start at zero)
+# slots are rows already taken with _take_slots for rules created pointing at them
+    def add_many(self, switch_id, rules, counters=None, slots=None):
+        bound = slots is not None
+        if not bound:
+            slots = self._take_slots(len(rules))
+        self.rules[slots] = rules
+        self.switch_indexes[slots] = self.switch_number(switch_id)
+        self.cookies[slots] = np.fromiter(map(attrgetter('cookie'), rules), dtype=np.int64,
+                                          count=len(rules))
+        for name in FLOW_COUNTER_COLUMNS:
+            getattr(self, name)[slots] = (counters or {}).get(name, 0)
+        if not bound:
+            for rule, slot in zip(rules, slots.tolist()):
+                rule.stats = self
+                rule.slot = slot
+        return slots
+
+# Function to count one packet of byte_count bytes hitting a rule at time now
+    def record_hit(self, rule, now, byte_count=0):
+        slot = rule.slot
+        self.packet_view[slot] += 1
+        self.byte_view[slot] += byte_count
+        self.last_hit_view[slot] = now
+
+    def remove(self, rule):
+        slot = rule.slot
+        if slot is None:
+            return
+        for name, dtype, fill in FLOW_STATS_COLUMNS:
+            getattr(self, name)[slot] = fill
+        self.free_slots.append(slot)
+        rule.stats = rule.slot = None
+
+# Function to free the rows of many rules, returning their counters like add_many takes them
+    def remove_many(self, rules):
+        counters = self.counters(rules)
+        slots = self.slots(rules)
+        for name, dtype, fill in FLOW_STATS_COLUMNS:
+            getattr(self, name)[slots] = fill
+        self.free_slots.extend(slots.tolist())
+        for rule in rules:
+            rule.stats = rule.slot = None
+        return counters
+
+    def slots(self, rules):
+        return np.fromiter(map(attrgetter('slot'), rules), dtype=np.int64, count=len(rules))
+
+    def counters(self, rules):
+        slots = self.slots(rules)
+        return {name: getattr(self, name)[slots] for name in FLOW_COUNTER_COLUMNS}
+
+# Function to find the rows of installed rules passing every given filter
+# cookie and cookie_mask select rules whose cookie agrees with cookie on the mask's bits, as
+# in OpenFlow flow stats requests; idle_for keeps rules not hit for at least that many seconds
+    def select(self, switch_id=None, cookie=0, cookie_mask=0, min_packets=0, min_bytes=0,
+               idle_for=None, now=None):
+        switch_indexes = self.switch_indexes[:self.size]
+        if switch_id is None:
+            keep = switch_indexes >= 0
+        else:
+            keep = switch_indexes == self.switch_numbers.get(switch_id, -1)
+        if cookie_mask:
+            keep &= (self.cookies[:self.size] & cookie_mask) == (cookie & cookie_mask)
+        if min_packets:
+            keep &= self.packet_counts[:self.size] >= min_packets
+        if min_bytes:
+            keep &= self.byte_counts[:self.size] >= min_bytes
+        if idle_for is not None:
+            keep &= self.last_hits[:self.size] <= now - idle_for
+        slots = np.flatnonzero(keep)
+        # Rows are reused, so put the rules back in installation order
+        return slots[np.argsort(self.cookies[slots], kind='stable')]
+
+# Function to read the statistics of the given rows as columns
+    def rows(self, slots, now):
+        switch_ids = np.empty(len(self.switch_ids), dtype=object)
+        switch_ids[:] = self.switch_ids
+        return {
+            'switch': switch_ids[self.switch_indexes[slots]],
+            'cookie': self.cookies[slots],
+            'packet_count': self.packet_counts[slots],
+            'byte_count': self.byte_counts[slots],
+            'duration': now - self.created_at[slots],
+            'idle_time': now - self.last_hits[slots],
+            'rule': self.rules[slots]
+        }
+
+    def __len__(self):
+        return self.size - len(self.free_slots)
+
+    # Memoryviews cannot be pickled; they are made again for the unpickled columns
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('packet_view', 'byte_view', 'last_hit_view'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_views()
+        for slot in np.flatnonzero(self.switch_indexes[:self.size] >= 0).tolist():
+            rule = self.rules[slot]
+            rule.stats = self
+            rule.slot = slot
+
+
+# Function to get the layout of a match from the match_spec of each of its fields: its exact,
+# prefix and range fields
+def _overlap_layout(specs):
+    if not any(specs.values()):
+        return tuple(sorted(specs)), (), ()
+    exact, prefixes, ranges = [], [], []
+    for field in sorted(specs):
+        spec = specs[field]
+        if spec is None:
+            exact.append(field)
+        elif spec[0] == PREFIX_MATCH:
+            prefixes.append(field)
+        else:
+            ranges.append(field)
+    return tuple(exact), tuple(prefixes), tuple(ranges)
+
+
+# Class holding the live rules of one layout, keyed by their exact values followed by the
+# (network, length) of each prefix; rules differing only in their ranges share a key
+# A key held by a single rule, as most are, maps to the rule itself rather than a list
+class _OverlapLayout:
+
+    def __init__(self, layout):
+        self.exact, self.prefixes, self.ranges = layout
+        self.fields = frozenset(self.exact + self.prefixes + self.ranges)
+        self.lengths = [{} for _ in self.prefixes]  # per prefix field: length -> rules
+        self.entries = {}
+        self.size = 0
+
+    def key(self, match, specs):
+        key = tuple([match[field] for field in self.exact])
+        if self.prefixes:
+            key += tuple([specs[field][1:] for field in self.prefixes])
+        return key
+
+    def rules_at(self, key):
+        rules = self.entries.get(key)
+        if rules is None:
+            return ()
+        return rules if rules.__class__ is list else (rules,)
+
+    def insert(self, key, rule):
+        rules = self.entries.get(key)
+        if rules is None:
+            self.entries[key] = rule
+        elif rules.__class__ is list:
+            rules.append(rule)
+        else:
+            self.entries[key] = [rules, rule]
+        if self.prefixes:
+            for lengths, (_, length) in zip(self.lengths, key[len(self.exact):]):
+                lengths[length] = lengths.get(length, 0) + 1
+        self.size += 1
+
+    def remove(self, key, rule):
+        rules = self.entries[key]
+        if rules.__class__ is not list:
+            del self.entries[key]
+        else:
+            rules.remove(rule)
+            if len(rules) == 1:
+                self.entries[key] = rules[0]
+        for lengths, (_, length) in zip(self.lengths, key[len(self.exact):]):
+            lengths[length] -= 1
+            if not lengths[length]:
+                del lengths[length]
+        self.size -= 1
+
+# Function to list the keys of this layout under which a rule covering the match can sit:
+# the match's exact values, then its addresses cut to every prefix length in use
+# Returns None when no rule of this layout can cover the match
+    def candidate_keys(self, match, specs):
+        exact = []
+        for field in self.exact:
+            if specs[field] is not None:
+                return None
+            exact.append(match[field])
+        exact = tuple(exact)
+        if not self.prefixes:
+            return (exact,)
+        choices = []
+        for field, lengths in zip(self.prefixes, self.lengths):
+            spec = specs[field]
+            if spec is None:
+                network, length = packet_address(match[field]), 32
+                if network is None:
+                    return None
+            else:
+                _, network, length = spec
+            choices.append([(network & PREFIX_MASKS[prefix_length], prefix_length)
+                            for prefix_length in lengths if prefix_length <= length])
+        return (exact + prefixes for prefixes in itertools.product(*choices))
+
+
+# What add_flow_rule does with an exact duplicate, a rule with the match and action of an
+# installed rule that stays at least as long: report it installed, as the installed rule
+# already handles its packets, or refuse it. Both keep an overlap index up to date on every
+# install and count duplicate, shadowed and redundant rules. DUPLICATE_KEEP opts out of the
+# checks: rules are installed as given, at a little over half the cost, and get_dead_rules
+# and compact index the table when they are called
+DUPLICATE_MERGE = 'merge'
+DUPLICATE_REJECT = 'reject'
+DUPLICATE_KEEP = 'keep'
+
+
+# Class finding the earlier rules of a flow table that match every packet a rule matches
+# Rules are appended below every installed rule, so a rule covered by an earlier one never
+# matches: it is shadowed when the two actions differ and redundant when they agree. Only
+# live rules are indexed, grouped by layout like the tuple space classifier, so a rule is
+# checked against the keys it could fall under rather than the whole table. A dead rule is
+# recorded against the live rule covering it and indexed again when that rule goes away;
+# covering is transitive, so whatever a dead rule covers is covered by a live rule as well
+class RuleOverlapIndex:
+
+    def __init__(self):
+        self.layouts = {}  # (exact, prefix, range fields) -> _OverlapLayout
+        self.unhashable = []  # live rules whose match values cannot be hashed
+        self.covered_by = {}  # dead rule -> live rule installed before it that covers it
+        self.dependents = defaultdict(dict)  # live rule -> dead rules it covers
+        # Layout and key of the last match looked up, as the rule is usually added next
+        self.last_lookup = (None, None, None, None)
+
+    def __len__(self):
+        return sum(layout.size for layout in self.layouts.values()) + len(self.unhashable) + \
+            len(self.covered_by)
+
+# Function to find a live rule covering a match among those whose cookie is below before (all
+# of them when before is None); None if the match is not covered
+# A live rule with exactly this match is looked up first, in O(1), so duplicates are found
+# as such
+    def find_covering(self, match, before=None):
+        specs = {field: match_spec(field, value) for field, value in match.items()}
+        layout_id = _overlap_layout(specs)
+        layout = self.layouts.get(layout_id) or _OverlapLayout(layout_id)
+        key = layout.key(match, specs)
+        self.last_lookup = (match, specs, layout_id, key)
+        try:
+            rules = layout.rules_at(key)
+        except TypeError:
+            rules = ()
+        for rule in rules:
+            if rule.match == match and (before is None or rule.cookie < before):
+                return rule
+        return next(self.covering_rules(match, before, specs), None)
+
+# Function to iterate over the live rules covering a match, among those whose cookie is
+# below before (all of them when before is None)
+    def covering_rules(self, match, before=None, specs=None):
+        if specs is None:
+            specs = {field: match_spec(field, value) for field, value in match.items()}
+        fields = match.keys()
+        for layout in self.layouts.values():
+            if not layout.fields <= fields:
+                continue
+            keys = layout.candidate_keys(match, specs)
+            if keys is None:
+                continue
+            for key in keys:
+                try:
+                    rules = layout.rules_at(key)
+                except TypeError:
+                    break
+                for rule in rules:
+                    if (before is None or rule.cookie < before) and \
+                            all(value_covers(field, rule.match[field], match[field])
+                                for field in layout.ranges):
+                        yield rule
+        for rule in self.unhashable:
+            if (before is None or rule.cookie < before) and match_covers(rule.match, match):
+                yield rule
+
+# Function to add a rule installed after every indexed rule, with the rule covering it as
+# found by find_covering (None if the rule is live)
+    def add(self, rule, covering):
+        if covering is not None:
+            self.covered_by[rule] = covering
+            self.dependents[covering][rule] = None
+            return
+
+        match, specs, layout_id, key = self.last_lookup
+        if match is not rule.match:
+            specs = {field: match_spec(field, value) for field, value in rule.match.items()}
+            layout_id = _overlap_layout(specs)
+            key = None
+        layout = self.layouts.get(layout_id) or _OverlapLayout(layout_id)
+        if key is None:
+            key = layout.key(rule.match, specs)
+        try:
+            hash(key)
+        except TypeError:
+            self.unhashable.append(rule)
+            return
+        self.layouts[layout_id] = layout
+        layout.insert(key, rule)
+
+# Function to add a rule installed after every indexed rule
+# Returns the earlier rule covering it, None if the rule is live
+    def insert(self, rule):
+        covering = self.find_covering(rule.match, rule.cookie)
+        self.add(rule, covering)
+        return covering
+
+# Function to drop a rule; the rules it covered are checked again in installation order,
+# so each one either finds another live rule covering it or becomes live itself
+    def remove(self, rule):
+        covering = self.covered_by.pop(rule, None)
+        if covering is not None:
+            dependents = self.dependents[covering]
+            del dependents[rule]
+            if not dependents:
+                del self.dependents[covering]
+            return
+
+        if rule in self.unhashable:
+            self.unhashable.remove(rule)
+        else:
+            specs = {field: match_spec(field, value) for field, value in rule.match.items()}
+            layout_id = _overlap_layout(specs)
+            layout = self.layouts[layout_id]
+            layout.remove(layout.key(rule.match, specs), rule)
+            if not layout.size:
+                del self.layouts[layout_id]
+        for dependent in sorted(self.dependents.pop(rule, ()), key=attrgetter('cookie')):
+            del self.covered_by[dependent]
+            self.insert(dependent)
+
+
+# Kinds of flow rule timeouts kept in the controller's expiry heap
+HARD_TIMEOUT = 0
+IDLE_TIMEOUT = 1
+
+# Packet fields that identify a microflow
+FIVE_TUPLE_FIELDS = ('src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol')
+
+
+# Function to build the microflow cache key of a packet (missing fields become None)
+def flow_key(packet):
+    return (packet.get('src_ip'), packet.get('dst_ip'), packet.get('src_port'),
+            packet.get('dst_port'), packet.get('protocol'))
+
+
+# Function to hash a key (such as a flow key) to a 64-bit integer
+# Unlike hash(), the value is the same in every process and every run
+def stable_hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+
+# Class implementing an exact-match microflow cache that maps a 5-tuple to its matched rule
+# Only hits are cached: a newly appended rule has the lowest priority, so it can never
+# change the rule an already cached 5-tuple resolves to
+class MicroflowCache:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()  # 5-tuple -> rule, least recently used first
+        self.keys_by_rule = defaultdict(set)  # id(rule) -> cached 5-tuples resolving to it
+        # Rules matching on fields outside the 5-tuple make the key ambiguous
+        self.uncacheable_rules = 0
+
+    def get(self, key):
+        rule = self.entries.get(key)
+        if rule is not None:
+            self.entries.move_to_end(key)
+        return rule
+
+    # Returns True when an entry had to be evicted to make room
+    def put(self, key, rule):
+        self.entries[key] = rule
+        self.keys_by_rule[id(rule)].add(key)
+        if len(self.entries) > self.capacity:
+            old_key, old_rule = self.entries.popitem(last=False)
+            keys = self.keys_by_rule[id(old_rule)]
+            keys.discard(old_key)
+            if not keys:
+                del self.keys_by_rule[id(old_rule)]
+            return True
+        return False
+
+    # Removing a rule only changes the result of the 5-tuples that resolved to it
+    def invalidate_rule(self, rule):
+        for key in self.keys_by_rule.pop(id(rule), ()):
+            del self.entries[key]
+
+    def invalidate(self):
+        self.entries.clear()
+        self.keys_by_rule.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # The reverse index is keyed by object id, so it is rebuilt after unpickling
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['keys_by_rule']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.keys_by_rule = defaultdict(set)
+        for key, rule in self.entries.items():
+            self.keys_by_rule[id(rule)].add(key)
+
+
+# Percentiles shown in reports and charts
+REPORTED_PERCENTILES = (50, 90, 99, 99.9)
+
+
+# Class implementing a log-bucketed (HDR style) latency histogram with fixed memory
+# Values are recorded in nanoseconds; values below 2**(precision_bits + 1) are exact and
+# larger ones keep a relative error below 1 / 2**precision_bits
+class LatencyHistogram:
+
+    def __init__(self, precision_bits=7, max_exponent=44):
+        self.precision_bits = precision_bits
+        self.max_exponent = max_exponent  # values from 2**44 ns (about 4.9 hours) are clamped
+        self.sub_buckets = 1 << precision_bits
+        self.linear_limit = 1 << (precision_bits + 1)
+        self.counts = [0] * (self._bucket_index((1 << max_exponent) - 1) + 1)
+        self.total_count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _bucket_index(self, value):
+        if value < self.linear_limit:
+            return value
+        shift = value.bit_length() - self.precision_bits - 1
+        return (self.linear_limit + (shift - 1) * self.sub_buckets +
+                (value >> shift) - self.sub_buckets)
+
+    def _bucket_range(self, index):
+        if index < self.linear_limit:
+            return index, index
+        offset = index - self.linear_limit
+        shift = offset // self.sub_buckets + 1
+        mantissa = offset % self.sub_buckets + self.sub_buckets
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        value = max(int(value), 0)
+        index = min(self._bucket_index(value), len(self.counts) - 1)
+        self.counts[index] += count
+        self.total_count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if (other.precision_bits, other.max_exponent) != (self.precision_bits, self.max_exponent):
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total_count += other.total_count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.total_count if self.total_count else 0
+
+    # Returns the highest value that falls in the bucket holding the given percentile
+    def percentile(self, percent):
+        if not self.total_count:
+            return 0
+        target = max(1, -(-self.total_count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._bucket_range(index)[1], self.max)
+        return self.max
+
+    # Returns mean, percentiles and max converted from nanoseconds to milliseconds
+    def summary(self):
+        summary = {'avg_processing_time': self.mean() / 1e6}
+        for percent in REPORTED_PERCENTILES:
+            summary[f"p{str(percent).replace('.', '')}_processing_time"] = self.percentile(percent) / 1e6
+        summary['max_processing_time'] = self.max / 1e6
+        return summary
+
+    def __len__(self):
+        return self.total_count
+
+
+# Fewest rules a published flow table snapshot keeps outside its base index; larger tables
+# allow about sqrt(rules), which balances copying the recent rules on every install against
+# rebuilding the base
+CONCURRENT_RECENT_RULES = 64
+
+# Performance metrics that packet threads count on their own in the concurrent datapath
+THREAD_METRICS = ('flow_table_hits', 'flow_table_misses', 'packet_processing_time')
+
+
+# Class holding a published, immutable version of a switch's flow table for the concurrent
+# datapath. base indexes the table as of its last rebuild and recent the rules installed
+# since, all later than the rules in base, so a match in base always wins
+class FlowTableSnapshot:
+
+    def __init__(self, base, recent_rules=()):
+        self.base = base
+        self.recent = None
+        if recent_rules:
+            self.recent = freeze_classifier(build_classifier(TupleSpaceClassifier, recent_rules))
+        self.size = len(base) + len(recent_rules)
+
+    def lookup(self, packet):
+        rule = self.base.lookup(packet)
+        if rule is None and self.recent is not None:
+            rule = self.recent.lookup(packet)
+        return rule
+
+    def __len__(self):
+        return self.size
+
+
+# Class holding the counters of one packet processing thread in the concurrent datapath
+# Only its own thread writes them; SDNController.merge_thread_stats reads and adds them up
+class _ThreadStats:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.processing_time = LatencyHistogram()  # nanoseconds per packet
+        self.rule_hits = defaultdict(int)  # cookie -> hits
+        self.rule_bytes = defaultdict(int)  # cookie -> bytes
+        self.rule_last_hits = {}  # cookie -> time of the thread's latest hit
+        self.rules = {}  # cookie -> rule
+        self.switch_packets = defaultdict(int)  # switch_id -> packets
+        # Counts already added to the rules and switches, kept by the merging thread
+        self.merged_rule_hits = {}
+        self.merged_rule_bytes = {}
+        self.merged_switch_packets = {}
+
+
+# Function to wrap a controller method that changes flow tables so it holds the write lock
+# in concurrent mode; the tables it changed are published when the outermost call returns
+def _write_locked(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        if not self.concurrent:
+            return method(self, *args, **kwargs)
+        with self.write_lock:
+            self.write_depth += 1
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.write_depth -= 1
+                if not self.write_depth and self.changed_tables:
+                    self.publish_flow_tables()
+    return locked
+
+
+# Class collecting named timing spans from the packet processing hot path
+# Only sampled packets are timed (sample_rate=0.01 times one packet in a hundred), so the
+# cost for the others is a counter decrement. Each span's own time, its duration minus that
+# of the spans it contains, is added to the collapsed stack of its call path and to the
+# per-span, per-switch and per-rule counters; the first max_events spans are also kept as
+# Chrome trace events
+class Profiler:
+
+    def __init__(self, sample_rate=1.0, max_events=100000):
+        self.sample_interval = max(1, round(1 / sample_rate))
+        self.countdown = 1
+        self.max_events = max_events
+        self.stack = []  # [name, start ns, time spent in child spans] of the open spans
+        self.collapsed = defaultdict(int)  # "outer;inner" call path -> own time in ns
+        self.span_stats = {}  # span name -> [count, own time ns]
+        self.switch_stats = {}  # (switch_id, span name) -> [count, own time ns]
+        self.rule_stats = {}  # rule cookie -> [count, own time ns, match]
+        self.events = []
+        self.sampled_packets = 0
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+# Function called once per packet (or batch); True when it should be timed
+    def sample(self):
+        self.countdown -= 1
+        if self.countdown:
+            return False
+        self.countdown = self.sample_interval
+        self.sampled_packets += 1
+        return True
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter_ns(), 0])
+
+# Function to close the innermost open span; rule attributes an action span to its rule
+    def exit(self, switch_id=None, rule=None):
+        end = time.perf_counter_ns()
+        name, start, children = self.stack.pop()
+        duration = end - start
+        own_time = duration - children
+        if self.stack:
+            self.stack[-1][2] += duration
+            path = ';'.join([frame[0] for frame in self.stack] + [name])
+        else:
+            path = name
+        self.collapsed[path] += own_time
+
+        stats = self.span_stats.setdefault(name, [0, 0])
+        stats[0] += 1
+        stats[1] += own_time
+        if switch_id is not None:
+            stats = self.switch_stats.setdefault((switch_id, name), [0, 0])
+            stats[0] += 1
+            stats[1] += own_time
+        if rule is not None:
+            stats = self.rule_stats.setdefault(rule.cookie, [0, 0, rule.match])
+            stats[0] += 1
+            stats[1] += own_time
+
+        if len(self.events) < self.max_events:
+            self.events.append({'name': name, 'ph': 'X', 'pid': self.pid, 'tid': 0,
+                                'ts': (start - self.origin) / 1000, 'dur': duration / 1000,
+                                'args': {} if switch_id is None else {'switch': str(switch_id)}})
+
+# Function to write the collapsed stacks ("outer;inner nanoseconds" per line) read by
+# flamegraph.pl, speedscope and similar flame graph tools
+    def write_collapsed(self, path):
+        with open(path, 'w') as collapsed_file:
+            for stack, own_time in sorted(self.collapsed.items()):
+                collapsed_file.write(f"{stack} {own_time}\n")
+
+# Function to write the recorded spans as a Chrome trace (chrome://tracing, Perfetto)
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ns'}, trace_file)
+
+    def get_report(self, top=5):
+        lines = [f"Profile ({self.sampled_packets} sampled, 1 in {self.sample_interval}):"]
+        for name, (count, own_time) in sorted(self.span_stats.items(),
+                                              key=lambda item: -item[1][1]):
+            lines.append(f"  {name:<20} {count:>9} spans {own_time / 1e6:10.3f} ms "
+                         f"{own_time / count / 1000:9.3f} us/span")
+        switches = defaultdict(int)
+        for (switch_id, _), (_, own_time) in self.switch_stats.items():
+            switches[switch_id] += own_time
+        for switch_id, own_time in sorted(switches.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"  switch {switch_id}: {own_time / 1e6:.3f} ms")
+        for cookie, (count, own_time, match) in sorted(self.rule_stats.items(),
+                                                       key=lambda item: -item[1][0])[:top]:
+            lines.append(f"  rule {cookie} {match}: {count} hits, {own_time / 1e6:.3f} ms")
+        return "\n".join(lines)
+
+
+# Function to convert a list of packet dicts into a columnar batch (dict of NumPy arrays)
+# Fields missing from some packets become object columns holding None for those packets
+def packets_to_batch(packets):
+    fields = []
+    for packet in packets:
+        for field in packet:
+            if field not in fields:
+                fields.append(field)
+
+    batch = {}
+    for field in fields:
+        values = [packet.get(field) for packet in packets]
+        # NumPy would turn mixed values like [1, 'a'] into strings, so keep them as objects
+        if len({type(value) for value in values}) != 1:
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+        else:
+            column = np.array(values)
+        batch[field] = column
+    return batch
+
+
+# Function to get the columns of a batch given as a dict of arrays or a NumPy structured array
+def batch_columns(batch):
+    if isinstance(batch, np.ndarray):
+        return {field: batch[field] for field in batch.dtype.names}
+    return {field: np.asarray(column) for field, column in batch.items()}
+
+
+# Function to rebuild packet dicts for selected rows of a columnar batch
+def batch_to_packets(columns, rows=None):
+    if rows is None:
+        rows = np.arange(len(next(iter(columns.values())))) if columns else []
+    fields = list(columns)
+    packets = [dict(zip(fields, values))
+               for values in zip(*(columns[field][rows].tolist() for field in fields))]
+    # None marks a field the original packet did not have
+    if any(columns[field].dtype == object for field in fields):
+        for packet in packets:
+            for field in fields:
+                if packet[field] is None:
+                    del packet[field]
+    return packets
+
+
+# Function to get the size in bytes of every packet of a batch (0 for packets without one)
+def _batch_sizes(columns):
+    sizes = columns['size']
+    if sizes.dtype == object:
+        sizes = np.where(np.equal(sizes, None), 0, sizes)
+    return sizes.astype(np.int64)
+
+
+# Function to check whether rule values can be compared with a batch column as arrays
+# (mismatched kinds such as a string column and integer values can never be equal)
+def _comparable_kinds(column, values):
+    numeric = 'biuf'
+    if column.dtype.kind in numeric and values.dtype.kind in numeric:
+        return True
+    return column.dtype.kind in 'US' and values.dtype.kind == column.dtype.kind
+
+
+# Function to hash every string of a NumPy unicode array into a 64-bit integer
+# Characters are folded from the end so that zero padding never changes the hash
+def _string_hashes(strings):
+    width = strings.dtype.itemsize // 4
+    chars = np.ascontiguousarray(strings).view(np.uint32).reshape(len(strings), width)
+    hashes = np.zeros(len(strings), dtype=np.uint64)
+    for k in range(width - 1, -1, -1):
+        hashes = hashes * np.uint64(1000003) + chars[:, k]
+    return hashes
+
+
+# Function to number the distinct values of a batch column
+# Returns (sorted distinct keys, code of every packet, distinct value for every key, hashed)
+# Small non-negative integers such as ports are numbered through a lookup table and strings
+# through their hashes, both much cheaper than sorting the column itself
+def _factorize_column(column):
+    if column.dtype.kind in 'iu' and len(column) and column.min() >= 0 and \
+            column.max() < max(1 << 12, 4 * len(column)):
+        present = np.zeros(int(column.max()) + 1, dtype=bool)
+        present[column] = True
+        distinct = np.flatnonzero(present).astype(column.dtype)
+        codes = (np.cumsum(present) - 1)[column]
+        return distinct, codes, distinct, False
+
+    if column.dtype.kind == 'U' and column.dtype.itemsize:
+        hashes = _string_hashes(column)
+        distinct_keys = np.unique(hashes)
+        codes = np.searchsorted(distinct_keys, hashes)
+        representative = np.empty(len(distinct_keys), dtype=np.int64)
+        representative[codes] = np.arange(len(column))
+        distinct = column[representative]
+        # Fall back to sorting the strings themselves if two of them share a hash
+        if np.array_equal(distinct[codes], column):
+            return distinct_keys, codes, distinct, True
+
+    distinct = np.unique(column)
+    return distinct, np.searchsorted(distinct, column), distinct, False
+
+
+# Function to group a flow table by match field set into arrays for vectorized matching
+# Rules with prefixes are grouped by prefix length as well: a group's prefixes are then
+# matched as exact values against the batch's addresses masked to that length, while port
+# ranges are left to the rule-by-rule masks
+def _build_batch_rule_groups(rules):
+    grouped = OrderedDict()
+    for position, rule in enumerate(rules):
+        match = rule.match
+        shape = (tuple(sorted(match)), (), False)
+        if any(field in match for field in WILDCARD_FIELDS):
+            specs = [(field, match_spec(field, match[field])) for field in wildcard_fields(match)]
+            shape = (shape[0], tuple((field, spec[2]) for field, spec in specs
+                                     if spec[0] == PREFIX_MATCH),
+                     any(spec[0] == RANGE_MATCH for _, spec in specs))
+        grouped.setdefault(shape, []).append(position)
+
+    groups = []
+    for (fields, prefixes, has_ranges), positions in grouped.items():
+        prefixes = dict(prefixes)
+        values = {}
+        vectorizable = not has_ranges
+        for field in fields:
+            if not vectorizable:
+                break
+            field_values = [rules[position].match[field] for position in positions]
+            if field in prefixes:
+                field_values = [match_spec(field, value)[1] for value in field_values]
+            # NumPy would silently turn mixed values like [80, 'a'] into strings
+            if len({type(value) for value in field_values}) != 1 or \
+                    not isinstance(field_values[0], (int, float, str)):
+                vectorizable = False
+                break
+            values[field] = np.array(field_values)
+        groups.append({
+            'fields': fields,
+            'prefixes': prefixes,  # field -> prefix length shared by the group's rules
+            'positions': np.array(positions, dtype=np.int64),
+            'values': values,
+            'vectorizable': vectorizable
+        })
+    return groups
+
+
+# Function to compare a batch column with one rule value, element by element
+def _column_equals(column, value):
+    if isinstance(value, (int, float, str)):
+        equal = column == value
+        if isinstance(equal, np.ndarray):
+            return equal
+        return np.zeros(len(column), dtype=bool)
+    return np.fromiter((item == value for item in column), dtype=bool, count=len(column))
+
+
+# Function to test a batch column against one rule value, which may be a prefix or a range
+# derived caches the integer addresses of the batch's address columns
+def _column_matches(columns, field, value, derived):
+    spec = match_spec(field, value)
+    if spec is None:
+        return _column_equals(columns[field], value)
+    kind, low, high = spec
+    if kind == PREFIX_MATCH:
+        return _masked_addresses(columns, field, high, derived) == low
+    column = columns[field]
+    if column.dtype.kind in 'iuf':
+        return (column >= low) & (column <= high)
+    return np.fromiter((spec_contains(spec, item) for item in column), dtype=bool,
+                       count=len(column))
+
+
+# Function to get a batch address column as integers masked to a prefix length (-1 where
+# the packet has no valid IPv4 address), converting every distinct address only once
+def _masked_addresses(columns, field, length, derived):
+    addresses = derived.get(('address', field))
+    if addresses is None:
+        column = columns[field]
+        if column.dtype.kind == 'U':
+            _, codes, distinct, _ = _factorize_column(column)
+            converted = [packet_address(value) for value in distinct.tolist()]
+            addresses = np.array([-1 if address is None else address for address in converted],
+                                 dtype=np.int64)[codes]
+        else:
+            addresses = np.fromiter((-1 if address is None else address
+                                     for address in map(packet_address, column.tolist())),
+                                    dtype=np.int64, count=len(column))
+        derived['address', field] = addresses
+    masked = derived.get(('masked', field, length))
+    if masked is None:
+        masked = np.where(addresses >= 0, addresses & PREFIX_MASKS[length], -1)
+        derived['masked', field, length] = masked
+    return masked
+
+
+# Function to write a value into selected rows of a batch column, widening its dtype if needed
+def _assign_column(columns, field, rows, value, num_packets):
+    column = columns.get(field)
+    if column is None:
+        column = np.empty(num_packets, dtype=object)
+    elif column.dtype.kind == 'U' and isinstance(value, str):
+        if len(value) > column.dtype.itemsize // 4:
+            column = column.astype(f'<U{len(value)}')
+    elif column.dtype != object and not (column.dtype.kind in 'biuf' and
+                                         isinstance(value, (int, float))):
+        column = column.astype(object)
+    column[rows] = value
+    columns[field] = column
+
+# Compact binary trace format: a header followed by fixed-width little-endian records
+# Timestamps are nanoseconds from the start of the trace and IPv4 addresses are stored as
+# integers; flags tell whether the packet had ports and a size. Sizes take 32 bits, as the
+# backup traffic's transfers do not fit in 16
+TRACE_MAGIC = b'SDNTRACE'
+TRACE_VERSION = 2
+TRACE_HEADER = struct.Struct('<8sII')  # magic, version, record size
+TRACE_RECORD = np.dtype([('timestamp', '<u8'), ('src_ip', '<u4'), ('dst_ip', '<u4'),
+                         ('src_port', '<u2'), ('dst_port', '<u2'), ('protocol', 'u1'),
+                         ('flags', 'u1'), ('size', '<u4')])
+TRACE_HAS_PORTS = 1
+TRACE_HAS_SIZE = 2
+
+# Classic pcap file and record headers (the byte order comes from the magic number)
+PCAP_HEADER = struct.Struct('IHHiIII')
+PCAP_RECORD = struct.Struct('IIII')
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAP_LINKTYPE_ETHERNET = 1
+PCAP_LINKTYPE_RAW = (101, 228)
+PCAP_LINKTYPE_LINUX_SLL = 113
+
+PROTOCOL_NUMBERS = {'ICMP': 1, 'TCP': 6, 'UDP': 17}
+PROTOCOL_NAMES = {number: name for name, number in PROTOCOL_NUMBERS.items()}
+
+
+# Function to convert an array of integer IPv4 addresses to dotted strings
+# Traces repeat the same addresses a lot, so each distinct address is formatted once
+def _ip_strings(addresses):
+    distinct, inverse = np.unique(addresses, return_inverse=True)
+    names = np.array([socket.inet_ntoa(address.to_bytes(4, 'big'))
+                      for address in distinct.tolist()])
+    return names[inverse]
+
+
+# Function to keep an optional field's values only for the records that have it
+def _optional_column(values, present):
+    if present.all():
+        return values
+    column = values.astype(object)
+    column[~present] = None
+    return column
+
+
+# Function to decode binary trace records into the columns of a packet batch
+def _trace_columns(records):
+    flags = records['flags']
+    has_ports = (flags & TRACE_HAS_PORTS) != 0
+    has_size = (flags & TRACE_HAS_SIZE) != 0
+
+    columns = {'src_ip': _ip_strings(records['src_ip']),
+               'dst_ip': _ip_strings(records['dst_ip'])}
+    if has_ports.any():
+        columns['src_port'] = _optional_column(records['src_port'].astype(np.int64), has_ports)
+        columns['dst_port'] = _optional_column(records['dst_port'].astype(np.int64), has_ports)
+    distinct, inverse = np.unique(records['protocol'], return_inverse=True)
+    names = [PROTOCOL_NAMES.get(number, number) for number in distinct.tolist()]
+    if all(isinstance(name, str) for name in names):
+        columns['protocol'] = np.array(names)[inverse]
+    else:
+        protocols = np.empty(len(names), dtype=object)
+        protocols[:] = names
+        columns['protocol'] = protocols[inverse]
+    if has_size.any():
+        columns['size'] = _optional_column(records['size'].astype(np.int64), has_size)
+    return columns
+
+
+# Function to write packets to a binary trace file, chunk by chunk
+# timestamps is an optional iterable of packet times in seconds; returns the packet count
+def write_trace(path, packets, timestamps=None, chunk_size=65536):
+    addresses = {}
+
+    def address(ip):
+        value = addresses.get(ip)
+        if value is None:
+            try:
+                value = int.from_bytes(socket.inet_aton(ip), 'big')
+            except OSError:
+                raise ValueError(f"Cannot store non-IPv4 address {ip!r} in a trace") from None
+            addresses[ip] = value
+        return value
+
+    if timestamps is None:
+        timestamps = itertools.repeat(0.0)
+    count = 0
+    with open(path, 'wb') as trace_file:
+        trace_file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.itemsize))
+        records = []
+        for packet, timestamp in zip(packets, timestamps):
+            protocol = packet.get('protocol', 0)
+            if isinstance(protocol, str):
+                if protocol not in PROTOCOL_NUMBERS:
+                    raise ValueError(f"Cannot store protocol {protocol!r} in a trace")
+                protocol = PROTOCOL_NUMBERS[protocol]
+            flags = 0
+            if 'src_port' in packet or 'dst_port' in packet:
+                flags |= TRACE_HAS_PORTS
+            if 'size' in packet:
+                flags |= TRACE_HAS_SIZE
+            records.append((round(timestamp * 1e9), address(packet['src_ip']),
+                            address(packet['dst_ip']), packet.get('src_port', 0),
+                            packet.get('dst_port', 0), protocol, flags, packet.get('size', 0)))
+            if len(records) == chunk_size:
+                trace_file.write(np.array(records, dtype=TRACE_RECORD).tobytes())
+                count += len(records)
+                records = []
+        if records:
+            trace_file.write(np.array(records, dtype=TRACE_RECORD).tobytes())
+            count += len(records)
+    return count
+
+
+# Class streaming packets out of a pcap or binary trace file through a memory map
+# Nothing is read up front: packets and batches are decoded chunk by chunk as they are
+# iterated, so traces larger than memory replay with constant memory. Iterating again
+# starts over, so one reader can be handed to several controllers or to run_benchmark
+class TraceReader:
+
+    def __init__(self, path, chunk_size=65536):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.num_packets = None
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"Trace file {self.path} is empty") from None
+
+        if self.map[:len(TRACE_MAGIC)] == TRACE_MAGIC:
+            _, version, record_size = TRACE_HEADER.unpack_from(self.map)
+            if version != TRACE_VERSION or record_size != TRACE_RECORD.itemsize:
+                self.close()
+                raise ValueError(f"Unsupported trace version {version} in {self.path}")
+            self.format = 'binary'
+            count = (len(self.map) - TRACE_HEADER.size) // TRACE_RECORD.itemsize
+            self.records = np.frombuffer(self.map, dtype=TRACE_RECORD, count=count,
+                                         offset=TRACE_HEADER.size)
+            self.num_packets = count
+            return
+
+        for byte_order in '<>':
+            magic = struct.unpack_from(byte_order + 'I', self.map)[0]
+            if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                break
+        else:
+            self.close()
+            raise ValueError(f"{self.path} is neither a pcap file nor a binary trace")
+        self.format = 'pcap'
+        self.records = None
+        self.pcap_record = struct.Struct(byte_order + PCAP_RECORD.format)
+        self.pcap_resolution = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+        self.linktype = struct.unpack_from(byte_order + PCAP_HEADER.format, self.map)[6] & 0xffff
+
+    def close(self):
+        # The record view must go before the map it points into can be closed
+        self.records = None
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Readers are handed to worker processes by path and reopened there
+    def __getstate__(self):
+        return {'path': self.path, 'chunk_size': self.chunk_size, 'num_packets': self.num_packets}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        # pcap records have variable length, so they are counted once on demand
+        if self.num_packets is None:
+            self.num_packets = sum(1 for _ in self._pcap_frames())
+        return self.num_packets
+
+    def __iter__(self):
+        for _, packet in self.timed_packets():
+            yield packet
+
+# Function to yield (seconds since the start of the trace, packet) pairs
+    def timed_packets(self):
+        if self.format == 'binary':
+            for start in range(0, self.num_packets, self.chunk_size):
+                records = self.records[start:start + self.chunk_size]
+                timestamps = (records['timestamp'] / 1e9).tolist()
+                yield from zip(timestamps, batch_to_packets(_trace_columns(records)))
+            return
+
+        first = None
+        for timestamp, offset, length, wire_length in self._pcap_frames():
+            if first is None:
+                first = timestamp
+            packet = self._decode_frame(offset, length, wire_length)
+            if packet is not None:
+                yield timestamp - first, packet
+
+# Function to yield columnar batches for SDNController.process_batch
+    def batches(self, batch_size=None):
+        batch_size = batch_size or self.chunk_size
+        if self.format == 'binary':
+            for start in range(0, self.num_packets, batch_size):
+                yield _trace_columns(self.records[start:start + batch_size])
+            return
+
+        packets = []
+        for packet in self:
+            packets.append(packet)
+            if len(packets) == batch_size:
+                yield packets_to_batch(packets)
+                packets = []
+        if packets:
+            yield packets_to_batch(packets)
+
+# Function to walk the pcap records, yielding (timestamp, data offset, captured and wire length)
+    def _pcap_frames(self):
+        data = self.map
+        record = self.pcap_record
+        offset = PCAP_HEADER.size
+        end = len(data)
+        while offset + record.size <= end:
+            seconds, fraction, length, wire_length = record.unpack_from(data, offset)
+            offset += record.size
+            if offset + length > end:
+                break  # Truncated final record
+            yield seconds + fraction * self.pcap_resolution, offset, length, wire_length
+            offset += length
+
+# Function to decode the IPv4 and TCP/UDP headers of a captured frame (None if not IPv4)
+    def _decode_frame(self, offset, length, wire_length):
+        data = self.map
+        end = offset + length
+        if self.linktype == PCAP_LINKTYPE_ETHERNET:
+            if length < 14:
+                return None
+            ether_type = int.from_bytes(data[offset + 12:offset + 14], 'big')
+            offset += 14
+            # Skip VLAN tags
+            while ether_type in (0x8100, 0x88a8) and offset + 4 <= end:
+                ether_type = int.from_bytes(data[offset + 2:offset + 4], 'big')
+                offset += 4
+            if ether_type != 0x0800:
+                return None
+        elif self.linktype == PCAP_LINKTYPE_LINUX_SLL:
+            if length < 16 or int.from_bytes(data[offset + 14:offset + 16], 'big') != 0x0800:
+                return None
+            offset += 16
+        elif self.linktype not in PCAP_LINKTYPE_RAW:
+            return None
+
+        if offset + 20 > end or data[offset] >> 4 != 4:
+            return None
+        header_length = (data[offset] & 0x0f) * 4
+        protocol = data[offset + 9]
+        packet = {'src_ip': socket.inet_ntoa(data[offset + 12:offset + 16]),
+                  'dst_ip': socket.inet_ntoa(data[offset + 16:offset + 20])}
+        # Only the first fragment of a datagram carries the transport header
+        first_fragment = int.from_bytes(data[offset + 6:offset + 8], 'big') & 0x1fff == 0
+        ports_at = offset + header_length
+        if protocol in (6, 17) and first_fragment and ports_at + 4 <= end:
+            packet['src_port'] = int.from_bytes(data[ports_at:ports_at + 2], 'big')
+            packet['dst_port'] = int.from_bytes(data[ports_at + 2:ports_at + 4], 'big')
+        packet['protocol'] = PROTOCOL_NAMES.get(protocol, protocol)
+        packet['size'] = wire_length
+        return packet
+
+
+# Default service mix of TrafficGenerator, with the shares of SDNBenchmark's test traffic
+# A service gives a destination port or an inclusive range of them, a protocol or a choice
+# of protocols, and the share of flows that use it
+TRAFFIC_SERVICES = [
+    {'dst_port': 80, 'protocol': 'TCP', 'share': 0.4},
+    {'dst_port': 443, 'protocol': 'TCP', 'share': 0.3},
+    {'dst_port': 53, 'protocol': 'UDP', 'share': 0.2},
+    {'dst_port': (1, 1023), 'protocol': ('TCP', 'UDP'), 'share': 0.1}
+]
+
+
+# Function to get the first host address and the number of host addresses of each network
+# networks is a CIDR prefix or a list of them; /31 and /32 networks use every address
+def _network_hosts(networks):
+    if isinstance(networks, str):
+        networks = [networks]
+    firsts, counts = [], []
+    for network in networks:
+        spec = match_spec('src_ip', network)
+        if spec is None or spec[0] != PREFIX_MATCH:
+            raise ValueError(f"Invalid network {network!r}")
+        _, base, length = spec
+        size = 1 << (32 - length)
+        if size > 2:
+            base, size = base + 1, size - 2  # Skip the network and broadcast addresses
+        firsts.append(base)
+        counts.append(size)
+    return np.array(firsts, dtype=np.int64), np.array(counts, dtype=np.int64)
+
+
+# Class generating seeded synthetic traffic with NumPy, chunk by chunk, so millions of
+# packets stream with bounded memory. Iterating yields packet dicts like TraceReader,
+# batches() columnar batches for SDNController.process_batch, and every pass starts over
+# from the seed, so all of them see exactly the same packets
+# Without flow_rate there is a fixed population of num_flows flows and every packet belongs
+# to one of them with Zipf popularity: the flow of rank k is picked with weight k**-zipf_alpha.
+# With flow_rate, flows arrive as a Poisson process, last a Pareto-distributed time with
+# mean flow_duration and send Poisson packets over their lifetime; a flow's packet count
+# follows the same Zipf law, which gives the usual mix of a few elephants and many mice
+class TrafficGenerator:
+
+    def __init__(self, num_packets=1000000, seed=None, num_flows=100000, zipf_alpha=1.1,
+                 src_networks="10.0.0.0/16", dst_networks="10.1.0.0/16", services=None,
+                 packet_rate=1e6, flow_rate=None, flow_duration=1.0, duration_shape=1.5,
+                 chunk_size=65536):
+        if packet_rate <= 0 or (flow_rate is not None and flow_rate <= 0):
+            raise ValueError("packet_rate and flow_rate must be positive")
+        if duration_shape <= 1:
+            raise ValueError("duration_shape must be above 1 for flow durations to have a mean")
+        self.num_packets = num_packets
+        # Unseeded generators take their seed from the random module
+        self.seed = random.randrange(2 ** 63) if seed is None else seed
+        self.num_flows = num_flows
+        self.zipf_alpha = zipf_alpha  # 0 makes every flow equally popular
+        self.src_hosts = _network_hosts(src_networks)
+        self.dst_hosts = _network_hosts(dst_networks)
+        self.services = services or TRAFFIC_SERVICES
+        self.packet_rate = packet_rate  # packets per second of traffic time, on average
+        self.flow_rate = flow_rate  # new flows per second, or None for a fixed population
+        self.flow_duration = flow_duration  # mean flow lifetime in seconds
+        self.duration_shape = duration_shape  # Pareto shape; the closer to 1, the heavier the tail
+        self.chunk_size = chunk_size
+        self.flows_started = 0  # flows seen by the last pass
+
+        shares = np.array([service['share'] for service in self.services], dtype=float)
+        self.service_shares = shares / shares.sum()
+        ports = [service['dst_port'] for service in self.services]
+        ports = [(port, port) if isinstance(port, int) else tuple(port) for port in ports]
+        self.port_lows = np.array([low for low, _ in ports], dtype=np.int64)
+        self.port_highs = np.array([high for _, high in ports], dtype=np.int64)
+        protocols = [service['protocol'] for service in self.services]
+        protocols = [[protocol] if isinstance(protocol, str) else list(protocol)
+                     for protocol in protocols]
+        self.protocol_names = np.array([name for names in protocols for name in names])
+        self.protocol_counts = np.array([len(names) for names in protocols], dtype=np.int64)
+        self.protocol_offsets = np.cumsum(self.protocol_counts) - self.protocol_counts
+
+        weights = np.arange(1, num_flows + 1, dtype=float) ** -zipf_alpha
+        self.popularity = weights / weights.sum()
+        self.popularity_cdf = np.cumsum(self.popularity)
+
+    def __len__(self):
+        return self.num_packets
+
+    def __iter__(self):
+        for _, packet in self.timed_packets():
+            yield packet
+
+# Function to draw the addresses of count flows from a list of networks
+    def _addresses(self, rng, hosts, count):
+        firsts, counts = hosts
+        networks = rng.choice(len(firsts), count, p=counts / counts.sum())
+        return _ip_strings(firsts[networks] + rng.integers(0, counts[networks]))
+
+# Function to draw the 5-tuples of count new flows, as columns
+    def _new_flows(self, rng, count):
+        services = rng.choice(len(self.service_shares), count, p=self.service_shares)
+        protocols = (self.protocol_offsets[services] +
+                     rng.integers(0, self.protocol_counts[services]))
+        return {
+            'src_ip': self._addresses(rng, self.src_hosts, count),
+            'dst_ip': self._addresses(rng, self.dst_hosts, count),
+            'src_port': rng.integers(1024, 65536, count),
+            'dst_port': rng.integers(self.port_lows[services], self.port_highs[services] + 1),
+            'protocol': self.protocol_names[protocols]
+        }
+
+# Function to yield (timestamps, columns) chunks; chunks of flow arrival traffic vary in size
+    def timed_batches(self):
+        rng = np.random.default_rng(self.seed)
+        if self.flow_rate is None:
+            return self._population_chunks(rng)
+        return self._arrival_chunks(rng)
+
+    def _population_chunks(self, rng):
+        flows = self._new_flows(rng, self.num_flows)
+        self.flows_started = self.num_flows
+        now = 0.0
+        for start in range(0, self.num_packets, self.chunk_size):
+            count = min(self.chunk_size, self.num_packets - start)
+            ids = np.searchsorted(self.popularity_cdf, rng.random(count), side='right')
+            np.minimum(ids, self.num_flows - 1, out=ids)  # Rounding can leave the cdf below 1
+            timestamps = now + np.cumsum(rng.exponential(1 / self.packet_rate, count))
+            now = timestamps[-1]
+            yield timestamps, {field: column[ids] for field, column in flows.items()}
+
+# Function to start the flows arriving between two times: start and end times, packet rates
+# and 5-tuples. A flow's mean packet count scales with its Zipf weight so that all flows
+# together send packet_rate packets per second
+    def _arrivals(self, rng, since, until):
+        count = rng.poisson(self.flow_rate * (until - since))
+        shape = self.duration_shape
+        starts = rng.uniform(since, until, count)
+        ends = starts + self.flow_duration * (shape - 1) / shape * (1 + rng.pareto(shape, count))
+        ranks = rng.integers(0, self.num_flows, count)
+        sizes = self.packet_rate / self.flow_rate * self.popularity[ranks] * self.num_flows
+        self.flows_started += count
+        return starts, ends, sizes / (ends - starts), self._new_flows(rng, count)
+
+    def _arrival_chunks(self, rng):
+        self.flows_started = 0
+        # Flows that started before time 0 and are still running make the start look steady
+        starts, ends, rates, flows = self._arrivals(rng, -10 * self.flow_duration, 0.0)
+        running = ends > 0
+        starts, ends, rates = starts[running], ends[running], rates[running]
+        flows = {field: column[running] for field, column in flows.items()}
+
+        window = self.chunk_size / self.packet_rate
+        now = 0.0
+        remaining = self.num_packets
+        while remaining > 0:
+            new_starts, new_ends, new_rates, new_flows = self._arrivals(rng, now, now + window)
+            starts = np.concatenate((starts, new_starts))
+            ends = np.concatenate((ends, new_ends))
+            rates = np.concatenate((rates, new_rates))
+            flows = {field: np.concatenate((column, new_flows[field]))
+                     for field, column in flows.items()}
+
+            # Each flow sends a Poisson number of packets over its part of the window
+            active_from = np.maximum(starts, now)
+            overlap = np.clip(np.minimum(ends, now + window) - active_from, 0, None)
+            ids = np.repeat(np.arange(len(starts)), rng.poisson(rates * overlap))
+            timestamps = active_from[ids] + rng.random(len(ids)) * overlap[ids]
+            order = np.argsort(timestamps, kind='stable')[:remaining]
+            ids = ids[order]
+            if len(ids):
+                yield timestamps[order], {field: column[ids] for field, column in flows.items()}
+            remaining -= len(ids)
+
+            now += window
+            running = ends > now
+            starts, ends, rates = starts[running], ends[running], rates[running]
+            flows = {field: column[running] for field, column in flows.items()}
+
+# Function to yield columnar batches of batch_size packets for SDNController.process_batch
+    def batches(self, batch_size=None):
+        batch_size = batch_size or self.chunk_size
+        pending, pending_count = [], 0
+        for _, columns in self.timed_batches():
+            pending.append(columns)
+            pending_count += len(columns['src_ip'])
+            if pending_count < batch_size:
+                continue
+            columns = {field: np.concatenate([chunk[field] for chunk in pending])
+                       for field in columns}
+            full = pending_count - pending_count % batch_size
+            for start in range(0, full, batch_size):
+                yield {field: column[start:start + batch_size] for field, column in columns.items()}
+            pending = [{field: column[full:] for field, column in columns.items()}]
+            pending_count -= full
+        if pending_count:
+            yield {field: np.concatenate([chunk[field] for chunk in pending])
+                   for field in pending[0]}
+
+# Function to yield (seconds since the start of the traffic, packet) pairs
+    def timed_packets(self):
+        for timestamps, columns in self.timed_batches():
+            yield from zip(timestamps.tolist(), batch_to_packets(columns))
+
+
+# Class caching shortest paths over the directed topology, one tree per destination switch
+# A tree holds every node's hop distance to the destination and its equal-cost next hops
+# (the ECMP set). Trees are built on first use and patched in place when links change, so
+# a link event only touches the nodes whose distance or next hops it actually changes
+class ShortestPaths:
+
+    def __init__(self, successors):
+        self.successors = successors  # node -> {neighbour: None}, shared with the controller
+        self.predecessors = defaultdict(dict)
+        self.trees = {}  # destination -> (distances, next hops)
+        self.stats = {'trees_built': 0, 'link_updates': 0, 'nodes_updated': 0}
+
+    def tree(self, destination):
+        tree = self.trees.get(destination)
+        if tree is None:
+            tree = self._build(destination)
+            self.trees[destination] = tree
+        return tree
+
+# Breadth-first search backwards from the destination
+    def _build(self, destination):
+        distances = {destination: 0}
+        next_hops = {destination: []}
+        frontier = [destination]
+        while frontier:
+            next_frontier = []
+            for node in frontier:
+                distance = distances[node] + 1
+                for previous in self.predecessors.get(node, ()):
+                    known = distances.get(previous)
+                    if known is None:
+                        distances[previous] = distance
+                        next_hops[previous] = [node]
+                        next_frontier.append(previous)
+                    elif known == distance:
+                        next_hops[previous].append(node)
+            frontier = next_frontier
+        self.stats['trees_built'] += 1
+        return distances, next_hops
+
+    def precompute(self, destinations):
+        for destination in destinations:
+            self.tree(destination)
+
+# A new link can only shorten paths: spread the improvement backwards from its source
+    def link_added(self, source, target):
+        self.predecessors[target][source] = None
+        self.stats['link_updates'] += 1
+        for distances, next_hops in self.trees.values():
+            if target not in distances:
+                continue
+            distance = distances[target] + 1
+            known = distances.get(source)
+            if known is not None and known < distance:
+                continue
+            if known == distance:
+                next_hops[source].append(target)
+                continue
+
+            distances[source] = distance
+            next_hops[source] = [target]
+            frontier = [source]
+            while frontier:
+                self.stats['nodes_updated'] += len(frontier)
+                next_frontier = []
+                for node in frontier:
+                    distance = distances[node] + 1
+                    for previous in self.predecessors.get(node, ()):
+                        known = distances.get(previous)
+                        if known is None or known > distance:
+                            distances[previous] = distance
+                            next_hops[previous] = [node]
+                            next_frontier.append(previous)
+                        elif known == distance and node not in next_hops[previous]:
+                            next_hops[previous].append(node)
+                frontier = next_frontier
+
+# A removed link only matters to trees that used it as a next hop. Nodes left without any
+# equal-cost next hop are detached and re-attached nearest first from their neighbours
+    def link_removed(self, source, target):
+        self.predecessors[target].pop(source, None)
+        self.stats['link_updates'] += 1
+        for distances, next_hops in self.trees.values():
+            hops = next_hops.get(source)
+            if not hops or target not in hops:
+                continue
+            hops.remove(target)
+            if hops:
+                continue
+
+            # Every node whose shortest paths all ran through the source gets further away
+            affected = {source}
+            stack = [source]
+            while stack:
+                node = stack.pop()
+                for previous in self.predecessors.get(node, ()):
+                    previous_hops = next_hops.get(previous)
+                    if previous in affected or not previous_hops or node not in previous_hops:
+                        continue
+                    previous_hops.remove(node)
+                    if not previous_hops:
+                        affected.add(previous)
+                        stack.append(previous)
+            self.stats['nodes_updated'] += len(affected)
+
+            for node in affected:
+                del distances[node]
+                del next_hops[node]
+            pending = []
+            for node in affected:
+                candidates = [distances[successor] for successor in self.successors.get(node, ())
+                              if successor in distances]
+                if candidates:
+                    heapq.heappush(pending, (min(candidates) + 1, node))
+            while pending:
+                distance, node = heapq.heappop(pending)
+                if node in distances:
+                    continue
+                distances[node] = distance
+                next_hops[node] = [successor for successor in self.successors.get(node, ())
+                                   if distances.get(successor) == distance - 1]
+                for previous in self.predecessors.get(node, ()):
+                    if previous in affected and previous not in distances:
+                        heapq.heappush(pending, (distance + 1, previous))
+
+# Function to pick the next hop from a node towards a destination (None when unreachable)
+# key identifies the flow, so all packets of a flow take the same equal-cost path, in every
+# run and every process
+    def next_hop(self, node, destination, key=None):
+        hops = self.tree(destination)[1].get(node)
+        if not hops:
+            return None
+        if key is None or len(hops) == 1:
+            return hops[0]
+        return hops[stable_hash((key, node)) % len(hops)]
+
+    def path(self, source, destination, key=None):
+        if source not in self.tree(destination)[0]:
+            return None
+        path = [source]
+        while path[-1] != destination:
+            path.append(self.next_hop(path[-1], destination, key))
+        return path
+
+# Granularities at which a miss policy entry installs rules for the packets it handles
+INSTALL_EXACT = 'exact'  # the packet's source and its values of the entry's fields
+INSTALL_PORT = 'port'  # the entry's own match, whatever the source
+INSTALL_SUBNET = 'subnet'  # the entry's match, limited to the source's prefix
+INSTALL_NONE = 'none'  # apply the action without installing a rule
+INSTALL_GRANULARITIES = (INSTALL_EXACT, INSTALL_PORT, INSTALL_SUBNET, INSTALL_NONE)
+
+# Keys of the actions execute_action carries out
+ACTION_KEYS = ('forward_port', 'drop', 'modify')
+
+
+# Function to reject an action execute_action would not understand
+def validate_action(action):
+    if not isinstance(action, dict) or not action:
+        raise ValueError(f"action {action!r} must be a dict holding one of {ACTION_KEYS}")
+    unknown = [key for key in action if key not in ACTION_KEYS]
+    if unknown:
+        raise ValueError(f"unknown action key {unknown[0]!r} in {action!r}, "
+                         f"expected one of {ACTION_KEYS}")
+    if 'modify' in action and not isinstance(action['modify'], dict):
+        raise ValueError(f"'modify' must map packet fields to new values in {action!r}")
+
+# The hardcoded policy the controller always had: learn HTTP, HTTPS and DNS flows per source
+DEFAULT_MISS_POLICY = {
+    'default_action': {'drop': True},
+    'rules': [
+        {'match': {'dst_port': 80}, 'action': {'forward_port': 2}, 'install': INSTALL_EXACT},
+        {'match': {'dst_port': 443}, 'action': {'forward_port': 2}, 'install': INSTALL_EXACT},
+        {'match': {'dst_port': 53}, 'action': {'forward_port': 3}, 'install': INSTALL_EXACT}
+    ]
+}
+
+
+# Class holding one entry of a miss policy; classifiers index entries by match like rules
+class PolicyEntry:
+    __slots__ = ('position', 'match', 'action', 'install', 'prefix_length', 'idle_timeout',
+                 'hard_timeout', 'hits', 'conflicts')
+
+    def __init__(self, position, match, action, install=INSTALL_EXACT, prefix_length=24,
+                 idle_timeout=0, hard_timeout=0):
+        self.position = position
+        self.match = match
+        self.action = action
+        self.install = install
+        self.prefix_length = prefix_length
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.hits = 0
+        self.conflicts = []  # earlier entries that this one's rules must not overlap
+
+
+# Class deciding what the controller does with a packet that missed the flow table
+# Entries are tried in order, like flow rules, and looked up through a compiled classifier.
+# An entry may install a coarser rule than the packet's own flow only if that rule cannot
+# catch packets an earlier entry with another action should get; otherwise the rule is
+# narrowed to the packet's values of every field those entries test
+class MissPolicy:
+
+    def __init__(self, rules=(), default_action=None):
+        self.default_action = {'drop': True} if default_action is None else default_action
+        validate_action(self.default_action)
+        self.entries = []
+        self.index = CompiledClassifier()
+        for position, rule in enumerate(rules):
+            install = rule.get('install', INSTALL_EXACT)
+            if install not in INSTALL_GRANULARITIES:
+                raise ValueError(f"unknown install granularity {install!r}")
+            validate_match(rule['match'])
+            validate_action(rule['action'])
+            entry = PolicyEntry(position, rule['match'], rule['action'], install,
+                                rule.get('prefix_length', 24), rule.get('idle_timeout', 0),
+                                rule.get('hard_timeout', 0))
+            entry.conflicts = [earlier for earlier in self.entries
+                               if (earlier.action, earlier.install) != (entry.action, install)
+                               and matches_overlap(earlier.match, entry.match)]
+            self.entries.append(entry)
+            self.index.insert(entry)
+        # A policy does not change once loaded, so its compiled function is called directly
+        self.index.compile()
+        self.compiled = self.index.compiled
+
+    def lookup(self, packet):
+        try:
+            entry = self.compiled(packet)
+        except TypeError:
+            entry = self.index.lookup(packet)
+        if entry is not None:
+            entry.hits += 1
+        return entry
+
+# Function to build the match of the rule an entry installs for a packet (None: no rule)
+# source_prefix_length turns exact rules into per-subnet rules of that prefix length
+    def install_match(self, entry, packet, source_prefix_length=None):
+        install = entry.install
+        length = entry.prefix_length
+        if install == INSTALL_NONE:
+            return None
+        if install == INSTALL_EXACT and source_prefix_length is not None:
+            install, length = INSTALL_SUBNET, source_prefix_length
+
+        match = dict(entry.match)
+        if install == INSTALL_SUBNET:
+            address = packet_address(packet.get('src_ip'))
+            source = entry.match.get('src_ip')
+            source_spec = match_spec('src_ip', source) if source is not None else None
+            if address is None:
+                # Sources that are not IPv4 addresses are learned one by one
+                install = INSTALL_EXACT
+            elif source is None or (source_spec is not None and source_spec[2] < length):
+                # Never wider than a source the entry itself already narrows down
+                match['src_ip'] = f"{int_to_ip(address & PREFIX_MASKS[length])}/{length}"
+        if install == INSTALL_EXACT:
+            fields = ['src_ip'] + [field for field in entry.match if field != 'src_ip']
+            if any(field not in packet for field in fields):
+                return None
+            match = {field: packet[field] for field in fields}
+
+        if any(matches_overlap(match, conflict.match) for conflict in entry.conflicts):
+            fields = list(match)
+            for conflict in entry.conflicts:
+                fields += [field for field in conflict.match if field not in fields]
+            if any(field not in packet for field in fields):
+                return None
+            match = {field: packet[field] for field in fields}
+        return match
+
+# Function to list the entries installed up front in proactive mode, in policy order
+# Entries that install nothing, and those overlapping one of them, stay reactive
+    def proactive_entries(self):
+        reactive = []
+        for entry in self.entries:
+            if entry.install == INSTALL_NONE or \
+                    any(matches_overlap(entry.match, other.match) for other in reactive):
+                reactive.append(entry)
+            else:
+                yield entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['compiled']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index.compile()
+        self.compiled = self.index.compiled
+
+
+# Function to load a miss policy from a JSON file shaped like DEFAULT_MISS_POLICY
+# Port ranges are written as two-element lists, e.g. "dst_port": [1024, 65535]
+def load_miss_policy(path):
+    with open(path) as policy_file:
+        config = json.load(policy_file)
+    return MissPolicy(config.get('rules', []), config.get('default_action'))
+
+
 #Simulates a basic SDN Controller that manages network devices and flow rules
 class SDNController:
     
-    def __init__(self, name, controller_type="OpenFlow"):
+    def __init__(self, name, controller_type="OpenFlow", classifier="tuple_space",
+                 microflow_cache_size=0, reactive_prefix_length=None, miss_policy=None,
+                 proactive=False, duplicate_rules=DUPLICATE_MERGE):
+        if duplicate_rules not in (DUPLICATE_MERGE, DUPLICATE_REJECT, DUPLICATE_KEEP):
+            raise ValueError(f"unknown duplicate rule handling {duplicate_rules!r}")
         self.name = name
         self.controller_type = controller_type
         self.switches = {}  # Stores switch objects
-        self.topology = defaultdict(list)  # Network topology
+        self.topology = defaultdict(dict)  # Network topology: node -> {neighbour: None}
+        self.paths = ShortestPaths(self.topology)  # Cached shortest paths over the topology
+        self.host_locations = {}  # Host IP address -> switch it is attached to
         self.flow_tables = defaultdict(list)  # Flow rules for each switch
+        self.flow_stats = FlowStatsTable()  # Packet, byte and last-hit counters of every rule
+        # Classifier used to look up rules, given by name or as a class
+        self.classifier_type = CLASSIFIERS.get(classifier, classifier)
+        self.classifiers = {}  # Lookup index over each switch's flow table
+        # Rules covering one another on each switch, kept up to date on install unless
+        # duplicate_rules is DUPLICATE_KEEP (RuleOverlapIndex)
+        self.overlap_indexes = {}
+        self.duplicate_rules = duplicate_rules
+        # Per-switch exact-match cache in front of the classifier (0 disables it)
+        self.microflow_cache_size = microflow_cache_size
+        self.microflow_caches = {}
+        # Reactive rules match the source's enclosing prefix of this length (None: the address)
+        self.reactive_prefix_length = reactive_prefix_length
+        # What to do on a table miss: a MissPolicy, the path of a JSON policy file, or None
+        # for DEFAULT_MISS_POLICY. Proactive controllers install the policy's rules up front
+        if miss_policy is None:
+            miss_policy = MissPolicy(DEFAULT_MISS_POLICY['rules'],
+                                     DEFAULT_MISS_POLICY['default_action'])
+        elif isinstance(miss_policy, str):
+            miss_policy = load_miss_policy(miss_policy)
+        self.miss_policy = miss_policy
+        self.proactive = proactive
+        self.proactive_switches = set()  # Switches that already have the policy's rules
+        # Bumped on every flow table change so derived batch lookup arrays can be reused
+        self.table_versions = defaultdict(int)
+        self.batch_rule_groups = {}
+        # Clock used for rule timestamps and timeouts (a simulation can substitute its own)
+        self.clock = time.time
+        self.next_cookie = 1  # Unique id given to every installed rule
+        self.live_cookies = set()
+        self.expiry_heap = []  # (deadline, cookie, timeout kind, switch_id, rule)
+        self.lru_heaps = defaultdict(list)  # switch_id -> [(last_hit, counter, cookie, rule)]
+        self.profiler = None  # Profiler timing the packet path when profiling is enabled
+        # Concurrent datapath (enable_concurrency): packet threads read published flow table
+        # snapshots, writers take the lock, and every thread keeps its own counters
+        self.concurrent = False
+        self.write_lock = threading.RLock()
+        self.write_depth = 0  # nesting of write-locked calls in the thread holding the lock
+        self.snapshots = {}  # switch_id -> FlowTableSnapshot read by packet threads
+        self.snapshot_bases = {}  # switch_id -> (base index, first cookie not in it)
+        self.changed_tables = set()  # switches to publish when the write lock is released
+        self.thread_local = None
+        self.thread_stats = []  # _ThreadStats of every packet thread
+        self.base_metrics = None  # THREAD_METRICS before the threads' counts
         self.active = False
+        self.reset_performance_metrics()
+        logger.debug("SDN Controller '%s' (%s) initialized", name, controller_type)
+
+# Function to clear all collected performance metrics
+    def reset_performance_metrics(self):
         self.performance_metrics = {
-            'packet_processing_time': [],
+            'packet_processing_time': LatencyHistogram(),  # nanoseconds per packet
             'flow_table_hits': 0,
             'flow_table_misses': 0,
-            'controller_requests': 0
+            'controller_requests': 0,
+            'microflow_cache_hits': 0,
+            'microflow_cache_misses': 0,
+            'microflow_cache_evictions': 0,
+            'flow_evictions': 0,
+            'flow_expirations': 0,
+            'flow_rules_installed': 0,
+            'duplicate_rules': 0,  # installs of a match already in the table, merged or rejected
+            'shadowed_rules': 0,  # rules installed under an earlier rule with another action
+            'redundant_rules': 0  # rules installed under an earlier rule with the same action
         }
-        print(f"SDN Controller '{name}' ({controller_type}) initialized")
+        if self.concurrent:
+            self._reset_thread_stats()
+    
+# Function to add metrics counted elsewhere, such as by a copy of the controller in a worker
+# process, to the controller's own
+    def add_performance_metrics(self, metrics):
+        self.performance_metrics = merge_performance_metrics(
+            [self.merge_thread_stats(), metrics])
+        if self.concurrent:
+            # Merging the threads' counts again starts from the base, so it must include them
+            self.base_metrics = merge_performance_metrics(
+                [self.base_metrics, {name: metrics[name] for name in THREAD_METRICS}])
     
 # Function to start the controller
     def start(self):
         self.active = True
-        print(f"Controller '{self.name}' is now active")
+        if self.proactive:
+            for switch_id in self.switches:
+                self.install_policy_rules(switch_id)
+        logger.debug("Controller '%s' is now active", self.name)
 # Function to sto the controller
     def stop(self):
         self.active = False
-        print(f"Controller '{self.name}' has been stopped")
+        logger.debug("Controller '%s' has been stopped", self.name)
 # Function to add a new switch with the controller
-    def add_switch(self, switch_id, num_ports):
+# table_capacity limits the number of rules, like the TCAM of a hardware switch
+    @_write_locked
+    def add_switch(self, switch_id, num_ports, table_capacity=None):
 
         if not self.active:
-            print("Cannot add switch: Controller is not active")
+            logger.warning("Cannot add switch: Controller is not active")
             return False
             
         self.switches[switch_id] = {
@@ -45,105 +2864,836 @@ class SDNController:
             'ports': num_ports,
             'status': 'active',
             'connected_hosts': [],
-            'packet_count': 0
+            'packet_count': 0,
+            'table_capacity': table_capacity
         }
-        print(f"Switch {switch_id} with {num_ports} ports added to the network")
+        if switch_id not in self.classifiers:
+            self.classifiers[switch_id] = self.classifier_type()
+        if self.microflow_cache_size and switch_id not in self.microflow_caches:
+            self.microflow_caches[switch_id] = MicroflowCache(self.microflow_cache_size)
+        if self.concurrent:
+            self.changed_tables.add(switch_id)
+        logger.debug("Switch %s with %s ports added to the network", switch_id, num_ports)
+        if self.proactive:
+            self.install_policy_rules(switch_id)
         return True
 # Function to add a new connection between two points in the existing network
     def add_connection(self, source, target):
 
-        if source not in self.topology:
-            self.topology[source] = []
         if target not in self.topology[source]:
-            self.topology[source].append(target)
-            print(f"Connection added from {source} to {target}")
+            self.topology[source][target] = None
+            self.paths.link_added(source, target)
+            logger.debug("Connection added from %s to %s", source, target)
+# Function to remove a connection, e.g. to simulate a link failure
+    def remove_connection(self, source, target):
+
+        if target not in self.topology.get(source, ()):
+            return False
+        del self.topology[source][target]
+        self.paths.link_removed(source, target)
+        logger.debug("Connection removed from %s to %s", source, target)
+        return True
+# Function to attach a host to a switch so packets can be routed to its address
+    def add_host(self, switch_id, host_ip):
+
+        if switch_id not in self.switches:
+            logger.error("Switch %s does not exist", switch_id)
+            return False
+        self.switches[switch_id]['connected_hosts'].append(host_ip)
+        self.host_locations[host_ip] = switch_id
+        return True
 # Function to add a flow rule to a switch
-    def add_flow_rule(self, switch_id, match_criteria, action):
+# idle_timeout and hard_timeout are in seconds, 0 means the rule never expires
+    @_write_locked
+    def add_flow_rule(self, switch_id, match_criteria, action, idle_timeout=0, hard_timeout=0):
 
         if switch_id not in self.switches:
-            print(f"Error: Switch {switch_id} does not exist")
+            logger.error("Switch %s does not exist", switch_id)
+            return False
+        try:
+            validate_match(match_criteria)
+        except ValueError as error:
+            logger.error("Invalid match %s: %s", match_criteria, error)
             return False
+
+        # Rule installs are timed with the packet whose miss caused them, or sampled on their own
+        profiler = self.profiler
+        timed = profiler is not None and (profiler.stack or profiler.sample())
+        if timed:
+            profiler.enter('add_flow_rule')
+        now = self.clock()
+        self.expire_flows(now)
+        # An installed rule with the same match is found first among the rules covering it
+        if self.duplicate_rules == DUPLICATE_KEEP:
+            overlap_index = covering = None
+        else:
+            overlap_index = self._overlap_index(switch_id)
+            covering = overlap_index.find_covering(match_criteria)
+        if covering is not None and covering.match == match_criteria and \
+                covering.action == action and \
+                self._outlives(covering, idle_timeout, hard_timeout, now, now):
+            self.performance_metrics['duplicate_rules'] += 1
+            if timed:
+                profiler.exit(switch_id)
+            if self.duplicate_rules == DUPLICATE_REJECT:
+                logger.debug("Duplicate flow rule %s rejected on switch %s", match_criteria,
+                             switch_id)
+                return False
+            return True
+        capacity = self.switches[switch_id].get('table_capacity')
+        if capacity is not None and len(self.flow_tables[switch_id]) >= capacity:
+            evicted = self.evict_flow_rule(switch_id)
+            # The evicted rule may be the one covering the new rule
+            if covering is not None and evicted is covering:
+                covering = overlap_index.find_covering(match_criteria)
 # The higher the number, the higher the priority
-        rule = {
-            'priority': len(self.flow_tables[switch_id]) + 1, 
-            'match': match_criteria,
-            'action': action,
-            'counter': 0,
-            'created_at': time.time()
-        }
+        cookie = self.next_cookie
+        self.next_cookie += 1
+        rule = FlowRule(match_criteria, action, len(self.flow_tables[switch_id]) + 1, cookie,
+                        idle_timeout, hard_timeout)
+        self.flow_stats.add(switch_id, rule, now)
         
         self.flow_tables[switch_id].append(rule)
-        #print(f"Flow rule added to switch {switch_id}: {match_criteria} -> {action}")
+        self.classifiers[switch_id].insert(rule)
+        if overlap_index is not None:
+            overlap_index.add(rule, covering)
+        if covering is not None:
+            kind = 'redundant' if covering.action == action else 'shadowed'
+            self.performance_metrics[f'{kind}_rules'] += 1
+            logger.debug("Flow rule %s on switch %s is %s by %s", match_criteria, switch_id,
+                         'made redundant' if kind == 'redundant' else kind, covering.match)
+        self.table_versions[switch_id] += 1
+        self.live_cookies.add(cookie)
+        self.performance_metrics['flow_rules_installed'] += 1
+        if self.concurrent:
+            self.changed_tables.add(switch_id)
+
+        if hard_timeout:
+            heapq.heappush(self.expiry_heap, (now + hard_timeout, cookie, HARD_TIMEOUT, switch_id, rule))
+        if idle_timeout:
+            heapq.heappush(self.expiry_heap, (now + idle_timeout, cookie, IDLE_TIMEOUT, switch_id, rule))
+        if capacity is not None:
+            heapq.heappush(self.lru_heaps[switch_id], (now, 0, cookie, rule))
+
+        cache = self.microflow_caches.get(switch_id)
+        if cache is not None and not set(match_criteria).issubset(FIVE_TUPLE_FIELDS):
+            cache.uncacheable_rules += 1
+            cache.invalidate()
+        if timed:
+            profiler.exit(switch_id)
+        return True
+
+# Function to get the overlap index of a switch's flow table, indexing the table on first use
+# The index is only kept when installs maintain it; otherwise a new one is built each call
+    def _overlap_index(self, switch_id):
+        overlap_index = self.overlap_indexes.get(switch_id)
+        if overlap_index is None:
+            overlap_index = RuleOverlapIndex()
+            for rule in self.flow_tables[switch_id]:
+                overlap_index.insert(rule)
+            if self.duplicate_rules != DUPLICATE_KEEP:
+                self.overlap_indexes[switch_id] = overlap_index
+        return overlap_index
+
+# Function to start timing sampled packets through the processing stages
+    def enable_profiling(self, sample_rate=0.01, max_events=100000):
+        self.profiler = Profiler(sample_rate, max_events)
+        return self.profiler
+
+# Function to stop profiling; returns the profiler with everything it collected
+    def disable_profiling(self):
+        profiler, self.profiler = self.profiler, None
+        return profiler
+
+# Function to switch to the concurrent datapath, where process_packet may be called from
+# any number of threads. Lookups read a published snapshot of the switch's flow table
+# without locking; rule changes take the write lock and publish new snapshots (read-copy-
+# update), and packet counters are kept per thread until merge_thread_stats adds them up.
+# The microflow cache and the profiler are not used by the concurrent datapath
+    def enable_concurrency(self):
+        if self.concurrent:
+            return
+        with self.write_lock:
+            self.changed_tables.update(self.switches)
+            self.publish_flow_tables()
+            self._reset_thread_stats()
+            self.concurrent = True
+        logger.debug("Controller '%s' switched to the concurrent datapath", self.name)
+
+# Function to return to the single-threaded datapath once no packet threads are running
+    def disable_concurrency(self):
+        if not self.concurrent:
+            return
+        self.merge_thread_stats()
+        with self.write_lock:
+            self.concurrent = False
+            self.snapshots = {}
+            self.snapshot_bases = {}
+            self.thread_local = None
+            self.thread_stats = []
+
+    def _reset_thread_stats(self):
+        self.thread_local = threading.local()
+        self.thread_stats = []
+        self.base_metrics = {name: self.performance_metrics[name] for name in THREAD_METRICS}
+
+# Function to publish a new snapshot of every flow table changed since the last publication
+# The base index is rebuilt when rules were removed from it or too many rules are recent;
+# otherwise only the recent rules are indexed again
+    def publish_flow_tables(self):
+        changed, self.changed_tables = self.changed_tables, set()
+        for switch_id in changed:
+            if switch_id not in self.switches:
+                continue
+            rules = self.flow_tables[switch_id]
+            base, next_cookie = self.snapshot_bases.get(switch_id, (None, None))
+            recent = rules if base is None else self.rules_installed_since(switch_id, next_cookie)
+            if (base is None or len(base) + len(recent) != len(rules) or
+                    len(recent) > max(CONCURRENT_RECENT_RULES, int(len(rules) ** 0.5))):
+                base = freeze_classifier(build_classifier(self.classifier_type, rules))
+                self.snapshot_bases[switch_id] = (base, self.next_cookie)
+                recent = ()
+            self.snapshots[switch_id] = FlowTableSnapshot(base, recent)
+
+# Function to get the calling thread's counters, registering them on first use
+    def _thread_stats(self):
+        try:
+            return self.thread_local.stats
+        except AttributeError:
+            stats = self.thread_local.stats = _ThreadStats()
+            with self.write_lock:
+                self.thread_stats.append(stats)
+            return stats
+
+# Function to add the per-thread counters up into the performance metrics, rule counters and
+# switch packet counts; packet threads can keep running meanwhile
+    def merge_thread_stats(self):
+        if not self.concurrent:
+            return self.performance_metrics
+        with self.write_lock:
+            flow_stats = self.flow_stats
+            hits = self.base_metrics['flow_table_hits']
+            misses = self.base_metrics['flow_table_misses']
+            processing_time = LatencyHistogram().merge(self.base_metrics['packet_processing_time'])
+            for stats in self.thread_stats:
+                hits += stats.hits
+                misses += stats.misses
+                processing_time.merge(stats.processing_time)
+                # A thread records a rule before its first hit, so copy the hits first
+                rule_hits = stats.rule_hits.copy()
+                rule_bytes = stats.rule_bytes.copy()
+                rules = stats.rules.copy()
+                for cookie, count in rule_hits.items():
+                    rule = rules[cookie]
+                    byte_count = rule_bytes.get(cookie, 0)
+                    # Counts of rules removed since are dropped with the rule
+                    if rule.slot is not None:
+                        flow_stats.packet_view[rule.slot] += \
+                            count - stats.merged_rule_hits.get(cookie, 0)
+                        flow_stats.byte_view[rule.slot] += \
+                            byte_count - stats.merged_rule_bytes.get(cookie, 0)
+                        flow_stats.last_hit_view[rule.slot] = max(
+                            flow_stats.last_hit_view[rule.slot],
+                            stats.rule_last_hits.get(cookie, 0.0))
+                    stats.merged_rule_hits[cookie] = count
+                    stats.merged_rule_bytes[cookie] = byte_count
+                for switch_id, count in stats.switch_packets.copy().items():
+                    switch = self.switches.get(switch_id)
+                    if switch is not None:
+                        switch['packet_count'] += count - stats.merged_switch_packets.get(switch_id, 0)
+                    stats.merged_switch_packets[switch_id] = count
+            self.performance_metrics.update(flow_table_hits=hits, flow_table_misses=misses,
+                                            packet_processing_time=processing_time)
+        return self.performance_metrics
+
+# Function to get the time a rule was last hit, including hits not merged from packet threads
+    def _rule_last_hit(self, rule):
+        last_hit = rule.last_hit
+        if self.concurrent:
+            for stats in self.thread_stats:
+                last_hit = max(last_hit, stats.rule_last_hits.get(rule.cookie, last_hit))
+        return last_hit
+
+# Function to process a packet on the concurrent datapath; safe to call from many threads
+# A hit only reads the published snapshot. A miss takes the write lock and looks again, as
+# another thread may have installed a matching rule meanwhile, before asking the miss policy
+    def _process_packet_concurrent(self, switch_id, packet):
+        start_time = time.perf_counter_ns()
+        snapshot = self.snapshots.get(switch_id)
+        if snapshot is None:
+            logger.error("Switch %s does not exist", switch_id)
+            return
+        stats = self._thread_stats()
+        stats.switch_packets[switch_id] += 1
+        now = self.clock()
+        due = self.expiry_heap[:1]
+        if due and due[0][0] <= now:
+            self.expire_flows(now)
+            snapshot = self.snapshots[switch_id]
+
+        matched_rule = snapshot.lookup(packet)
+        if matched_rule is None:
+            with self.write_lock:
+                matched_rule = self.snapshots[switch_id].lookup(packet)
+                if matched_rule is None:
+                    stats.misses += 1
+                    self.performance_metrics['controller_requests'] += 1
+                    result = self.handle_unknown_flow(switch_id, packet)
+        if matched_rule is not None:
+            cookie = matched_rule.cookie
+            if cookie not in stats.rules:
+                stats.rules[cookie] = matched_rule
+            stats.rule_hits[cookie] += 1
+            stats.rule_bytes[cookie] += packet.get('size', 0)
+            stats.rule_last_hits[cookie] = now
+            stats.hits += 1
+            result = self.execute_action(switch_id, packet, matched_rule.action)
+
+        stats.processing_time.record(time.perf_counter_ns() - start_time)
+        return result
+
+# Locks and per-thread state cannot be pickled; a copy of a concurrent controller publishes
+# its own snapshots
+    def __getstate__(self):
+        self.merge_thread_stats()
+        state = self.__dict__.copy()
+        state.update(write_lock=None, write_depth=0, snapshots={}, snapshot_bases={},
+                     changed_tables=set(), thread_local=None, thread_stats=[], base_metrics=None,
+                     overlap_indexes={})
+        return state
+
+    def __setstate__(self, state):
+        concurrent = state['concurrent']
+        self.__dict__.update(state)
+        self.concurrent = False
+        self.write_lock = threading.RLock()
+        if concurrent:
+            self.enable_concurrency()
+
+# Function to remove a flow rule from a switch
+    @_write_locked
+    def remove_flow_rule(self, switch_id, rule):
+        rules = self.flow_tables[switch_id]
+        for i, existing in enumerate(rules):
+            if existing is rule:
+                del rules[i]
+                break
+        else:
+            return False
+
+        self.classifiers[switch_id].remove(rule)
+        overlap_index = self.overlap_indexes.get(switch_id)
+        if overlap_index is not None:
+            overlap_index.remove(rule)
+        self.flow_stats.remove(rule)
+        self.table_versions[switch_id] += 1
+        self.live_cookies.discard(rule.cookie)
+        if self.concurrent:
+            self.changed_tables.add(switch_id)
+
+        cache = self.microflow_caches.get(switch_id)
+        if cache is not None:
+            if not set(rule.match).issubset(FIVE_TUPLE_FIELDS):
+                cache.uncacheable_rules -= 1
+            cache.invalidate_rule(rule)
+        return True
+
+# Function to get the rules installed on a switch since the given cookie was handed out
+    def rules_installed_since(self, switch_id, cookie):
+        rules = self.flow_tables[switch_id]
+        start = len(rules)
+        while start > 0 and rules[start - 1].cookie >= cookie:
+            start -= 1
+        return rules[start:]
+
+# Function to remove every rule whose idle or hard timeout has passed
+# Deadlines sit in a heap, so only due rules are looked at; an idle rule that was hit since
+# its deadline was scheduled is pushed back with its new deadline instead of expiring
+    @_write_locked
+    def expire_flows(self, now=None):
+        if now is None:
+            now = self.clock()
+
+        expired = 0
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            deadline, cookie, kind, switch_id, rule = heapq.heappop(heap)
+            if cookie not in self.live_cookies:
+                continue
+            if kind == IDLE_TIMEOUT:
+                deadline = self._rule_last_hit(rule) + rule.idle_timeout
+                if deadline > now:
+                    heapq.heappush(heap, (deadline, cookie, kind, switch_id, rule))
+                    continue
+            self.remove_flow_rule(switch_id, rule)
+            self.performance_metrics['flow_expirations'] += 1
+            expired += 1
+        return expired
+
+# Function to evict the least recently used rule of a full flow table
+# Heap entries are refreshed lazily: an entry whose rule was hit since it was pushed is
+# pushed again with the rule's current last-hit time and counter
+    @_write_locked
+    def evict_flow_rule(self, switch_id):
+        heap = self.lru_heaps[switch_id]
+        while heap:
+            last_hit, counter, cookie, rule = heap[0]
+            if cookie not in self.live_cookies:
+                heapq.heappop(heap)
+                continue
+            usage = (self._rule_last_hit(rule), rule.counter)
+            if usage != (last_hit, counter):
+                heapq.heapreplace(heap, usage + (cookie, rule))
+                continue
+            heapq.heappop(heap)
+            self.remove_flow_rule(switch_id, rule)
+            self.performance_metrics['flow_evictions'] += 1
+            return rule
+        return None
+
+# Function to check whether a rule stays installed at least as long as a rule covered by it,
+# with the given timeouts, creation and last hit times
+# The covered rule is never hit, so its idle deadline is fixed, whereas the covering rule's
+# deadline only moves later
+    def _outlives(self, rule, idle_timeout, hard_timeout, created_at, last_hit):
+        if rule.hard_timeout and (not hard_timeout or rule.created_at + rule.hard_timeout <
+                                  created_at + hard_timeout):
+            return False
+        if rule.idle_timeout and (not idle_timeout or self._rule_last_hit(rule) +
+                                  rule.idle_timeout < last_hit + idle_timeout):
+            return False
         return True
+
+# Function to list the rules no packet can reach, as (switch_id, rule, covering rule)
+# Rules whose cover may expire before them are left out, as they would match again then
+    def get_dead_rules(self, switch_id=None):
+        switch_ids = list(self.flow_tables) if switch_id is None else [switch_id]
+        dead_rules = []
+        for switch_id in switch_ids:
+            overlap_index = self._overlap_index(switch_id)
+            for rule, covering in overlap_index.covered_by.items():
+                lifetime = (rule.idle_timeout, rule.hard_timeout, rule.created_at,
+                            self._rule_last_hit(rule))
+                if not self._outlives(covering, *lifetime):
+                    covering = next((other for other in overlap_index.covering_rules(
+                        rule.match, rule.cookie) if self._outlives(other, *lifetime)), None)
+                if covering is not None:
+                    dead_rules.append((switch_id, rule, covering))
+        return dead_rules
+
+# Function to remove the rules no packet can reach from a switch (every switch when switch_id
+# is None); packets are forwarded exactly as before with fewer rules to look through
+# Returns the number of rules before and after, and of shadowed and redundant rules removed
+    @_write_locked
+    def compact(self, switch_id=None):
+        self.merge_thread_stats()
+        dead_rules = defaultdict(list)
+        report = {'rules_before': 0, 'rules_after': 0, 'shadowed': 0, 'redundant': 0}
+        for dead_switch_id, rule, covering in self.get_dead_rules(switch_id):
+            dead_rules[dead_switch_id].append(rule)
+            report['redundant' if covering.action == rule.action else 'shadowed'] += 1
+
+        for switch_id in (list(self.flow_tables) if switch_id is None else [switch_id]):
+            rules = self.flow_tables[switch_id]
+            report['rules_before'] += len(rules)
+            removed = dead_rules.get(switch_id)
+            if removed:
+                # One pass over the table and a rebuilt classifier rather than a removal each
+                removed_ids = set(map(id, removed))
+                rules[:] = [rule for rule in rules if id(rule) not in removed_ids]
+                self.classifiers[switch_id] = build_classifier(self.classifier_type, rules)
+                overlap_index = self.overlap_indexes.get(switch_id)
+                if overlap_index is not None:
+                    for rule in removed:
+                        overlap_index.remove(rule)
+                self.flow_stats.remove_many(removed)
+                self.live_cookies.difference_update(map(attrgetter('cookie'), removed))
+                self.table_versions[switch_id] += 1
+                if self.concurrent:
+                    self.changed_tables.add(switch_id)
+                cache = self.microflow_caches.get(switch_id)
+                if cache is not None:
+                    cache.uncacheable_rules -= sum(
+                        1 for rule in removed if not set(rule.match).issubset(FIVE_TUPLE_FIELDS))
+                    cache.invalidate()
+                logger.debug("Removed %s unreachable rules from switch %s", len(removed),
+                             switch_id)
+            report['rules_after'] += len(rules)
+        return report
+
+# Function to drop every cached microflow of a switch after its flow table changed
+    def invalidate_flow_cache(self, switch_id):
+        cache = self.microflow_caches.get(switch_id)
+        if cache is not None:
+            cache.invalidate()
     
+# Function to find the flow rule a packet matches, trying the microflow cache first
+# key can be passed when the caller already computed the packet's flow_key
+    def lookup_rule(self, switch_id, packet, key=None):
+        cache = self.microflow_caches.get(switch_id)
+        if cache is None or cache.uncacheable_rules:
+            return self.classifiers[switch_id].lookup(packet)
+
+        if key is None:
+            key = flow_key(packet)
+        matched_rule = cache.get(key)
+        if matched_rule is not None:
+            self.performance_metrics['microflow_cache_hits'] += 1
+        else:
+            self.performance_metrics['microflow_cache_misses'] += 1
+            matched_rule = self.classifiers[switch_id].lookup(packet)
+            if matched_rule and cache.put(key, matched_rule):
+                self.performance_metrics['microflow_cache_evictions'] += 1
+        return matched_rule
+
 # Function to simulate packet processing through SDN switch
     def process_packet(self, switch_id, packet):
+        if self.concurrent:
+            return self._process_packet_concurrent(switch_id, packet)
         if switch_id not in self.switches:
-            print(f"Error: Switch {switch_id} does not exist")
+            logger.error("Switch %s does not exist", switch_id)
             return
         
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
+        profiler = self.profiler
+        timed = profiler is not None and profiler.sample()
+        if timed:
+            profiler.enter('process_packet')
+        result = self.apply_flow_table(switch_id, packet, self.clock(), timed=timed)
+        
+        # Record processing time
+        processing_time = time.perf_counter_ns() - start_time
+        self.performance_metrics['packet_processing_time'].record(processing_time)
+        if timed:
+            profiler.exit(switch_id)
+        
+        return result
+
+# Function to apply a switch's flow table to a packet at time now: count the hit and carry out
+# the matched rule's action, or hand the packet to the controller on a miss
+# Shared by process_packet and NetworkSimulator; packets without a size count default_size bytes
+    def apply_flow_table(self, switch_id, packet, now, key=None, default_size=0, timed=False):
         self.switches[switch_id]['packet_count'] += 1
+        if self.expiry_heap and self.expiry_heap[0][0] <= now:
+            self.expire_flows(now)
         
-        #print(f"Processing packet on switch {switch_id}: {packet}")
+        profiler = self.profiler
+        if timed:
+            profiler.enter('lookup')
         
         # Look for matching flow rule
-        matched_rule = None
-        for rule in self.flow_tables[switch_id]:
-            matches = True
-            for key, value in rule['match'].items():
-                if key not in packet or packet[key] != value:
-                    matches = False
-                    break
-                    
-            if matches:
-                matched_rule = rule
-                matched_rule['counter'] += 1
-                self.performance_metrics['flow_table_hits'] += 1
-                break
+        matched_rule = self.lookup_rule(switch_id, packet, key)
+        if matched_rule:
+            flow_stats = self.flow_stats
+            slot = matched_rule.slot
+            flow_stats.packet_view[slot] += 1
+            flow_stats.byte_view[slot] += packet.get('size', default_size)
+            flow_stats.last_hit_view[slot] = now
+            self.performance_metrics['flow_table_hits'] += 1
+        if timed:
+            profiler.exit(switch_id)
         
         # Apply action if rule found, otherwise send to controller
         if matched_rule:
-            result = self.execute_action(switch_id, packet, matched_rule['action'])
+            if timed:
+                profiler.enter('execute_action')
+            result = self.execute_action(switch_id, packet, matched_rule.action)
+            if timed:
+                profiler.exit(switch_id, matched_rule)
         else:
             self.performance_metrics['flow_table_misses'] += 1
             self.performance_metrics['controller_requests'] += 1
+            if timed:
+                profiler.enter('handle_unknown_flow')
             result = self.handle_unknown_flow(switch_id, packet)
-        
-        # Record processing time
-        end_time = time.time()
-        processing_time = (end_time - start_time) * 1000  # Convert to ms
-        self.performance_metrics['packet_processing_time'].append(processing_time)
-        
+            if timed:
+                profiler.exit(switch_id)
         return result
 
-# Function to handle packets that have no matching flow rule
-    def handle_unknown_flow(self, switch_id, packet):
-        # Allow HTTP traffic (port 80)
-        if packet.get('dst_port') == 80:
-            match = {'src_ip': packet['src_ip'], 'dst_port': 80}
-            action = {'forward_port': 2}
-            self.add_flow_rule(switch_id, match, action)
-            return self.execute_action(switch_id, packet, action)
-        # Allow HTTPS traffic (port 443)
-        elif packet.get('dst_port') == 443:
-            match = {'src_ip': packet['src_ip'], 'dst_port': 443}
-            action = {'forward_port': 2}
-            self.add_flow_rule(switch_id, match, action)
-            return self.execute_action(switch_id, packet, action)
-        # Allow DNS traffic (port 53)
-        elif packet.get('dst_port') == 53:
-            match = {'src_ip': packet['src_ip'], 'dst_port': 53}
-            action = {'forward_port': 3}
-            self.add_flow_rule(switch_id, match, action)
-            return self.execute_action(switch_id, packet, action)
-        # Drop all other traffic
+# Function to process a columnar batch of packets (dict of arrays or structured array)
+# Returns an object array with one result dict per packet, as process_packet would return it
+    def process_batch(self, switch_id, packets):
+        if switch_id not in self.switches:
+            logger.error("Switch %s does not exist", switch_id)
+            return
+
+        start_time = time.perf_counter_ns()
+        columns = batch_columns(packets)
+        num_packets = len(next(iter(columns.values()))) if columns else 0
+        if self.concurrent:
+            # The vectorized path updates shared counters, so batches go packet by packet
+            results = np.empty(num_packets, dtype=object)
+            results[:] = [self._process_packet_concurrent(switch_id, packet)
+                          for packet in batch_to_packets(columns)]
+            return results
+        self.switches[switch_id]['packet_count'] += num_packets
+        results = np.empty(num_packets, dtype=object)
+        if num_packets == 0:
+            return results
+
+        now = self.clock()
+        if self.expiry_heap and self.expiry_heap[0][0] <= now:
+            self.expire_flows(now)
+
+        profiler = self.profiler
+        timed = profiler is not None and profiler.sample()
+        if timed:
+            profiler.enter('process_batch')
+            profiler.enter('match_batch')
+        rules = self.flow_tables[switch_id]
+        positions = self.match_batch(switch_id, columns, num_packets)
+        if timed:
+            profiler.exit(switch_id)
+
+        # Update rule counters in bulk and apply each rule's action once to all its packets
+        hit_rows = np.flatnonzero(positions >= 0)
+        if hit_rows.size:
+            hit_positions = positions[hit_rows]
+            order = np.argsort(hit_positions, kind='stable')
+            sorted_rows = hit_rows[order]
+            sorted_positions = hit_positions[order]
+            starts = np.flatnonzero(np.diff(sorted_positions)) + 1
+            starts = np.concatenate(([0], starts)).tolist()
+            ends = starts[1:] + [len(sorted_rows)]
+            hit_rules = [rules[position] for position in sorted_positions[starts].tolist()]
+            flow_stats = self.flow_stats
+            slots = flow_stats.slots(hit_rules)
+            flow_stats.packet_counts[slots] += np.subtract(ends, starts)
+            if 'size' in columns:
+                flow_stats.byte_counts[slots] += np.add.reduceat(
+                    _batch_sizes(columns)[sorted_rows], starts)
+            flow_stats.last_hits[slots] = now
+            row_results = []
+            for rule, start, end in zip(hit_rules, starts, ends):
+                row_results += self.execute_batch_action(columns, sorted_rows[start:end],
+                                                         rule.action, num_packets)
+            hit_results = np.empty(len(row_results), dtype=object)
+            hit_results[:] = row_results
+            results[sorted_rows] = hit_results
+            self.performance_metrics['flow_table_hits'] += int(hit_rows.size)
+
+        # Send all misses to the controller as one group
+        miss_rows = np.flatnonzero(positions < 0)
+        if miss_rows.size:
+            if timed:
+                profiler.enter('handle_unknown_flows')
+            miss_packets = batch_to_packets(columns, miss_rows)
+            miss_results = self.handle_unknown_flows(switch_id, miss_packets)
+            if timed:
+                profiler.exit(switch_id)
+            for row, result in zip(miss_rows.tolist(), miss_results):
+                results[row] = result
+
+        # Columns replaced or added by modify actions are handed back to dict batches
+        if isinstance(packets, dict):
+            packets.update(columns)
+
+        # Record processing time, spread evenly over the packets of the batch
+        processing_time = (time.perf_counter_ns() - start_time) // num_packets
+        self.performance_metrics['packet_processing_time'].record(processing_time, num_packets)
+        if timed:
+            profiler.exit(switch_id)
+
+        return results
+
+# Function to find the position of the first matching rule for every packet of a batch (-1 on miss)
+    def match_batch(self, switch_id, columns, num_packets):
+        version = self.table_versions[switch_id]
+        cached = self.batch_rule_groups.get(switch_id)
+        if cached is None or cached[0] != version:
+            cached = (version, _build_batch_rule_groups(self.flow_tables[switch_id]))
+            self.batch_rule_groups[switch_id] = cached
+
+        no_match = np.iinfo(np.int64).max
+        best = np.full(num_packets, no_match, dtype=np.int64)
+        # (field, prefix length) -> (sorted distinct values, code of every packet), and the
+        # batch's integer addresses
+        field_codes = {}
+        for group in cached[1]:
+            # A rule never matches a packet that lacks one of its fields
+            if any(field not in columns for field in group['fields']):
+                continue
+            # Small groups are cheaper to test rule by rule than to encode
+            if len(group['positions']) > 8 and group['vectorizable'] and \
+                    all(columns[field].dtype != object for field in group['fields']):
+                group_columns = columns
+                if group['prefixes']:
+                    group_columns = dict(columns)
+                    for field, length in group['prefixes'].items():
+                        group_columns[field] = _masked_addresses(columns, field, length,
+                                                                 field_codes)
+                candidate = self._match_group_vectorized(group, group_columns, field_codes,
+                                                         num_packets)
+            else:
+                candidate = self._match_group_masks(switch_id, group, columns, field_codes,
+                                                    num_packets)
+            if candidate is not None:
+                np.minimum(best, candidate, out=best)
+
+        best[best == no_match] = -1
+        return best
+
+# Function to match a whole batch against one field-set group by joining encoded keys
+    def _match_group_vectorized(self, group, columns, field_codes, num_packets):
+        positions = group['positions']
+        packet_key = np.zeros(num_packets, dtype=np.int64)
+        rule_key = np.zeros(len(positions), dtype=np.int64)
+        valid = np.ones(len(positions), dtype=bool)
+        key_space = 1
+
+        for field in group['fields']:
+            column = columns[field]
+            values = group['values'][field]
+            if not _comparable_kinds(column, values):
+                return None
+            code_key = (field, group['prefixes'].get(field))
+            if code_key not in field_codes:
+                field_codes[code_key] = _factorize_column(column)
+            distinct_keys, codes, distinct, hashed = field_codes[code_key]
+
+            # Rule values that never occur in the batch cannot match anything
+            value_keys = _string_hashes(values) if hashed else values
+            value_codes = np.minimum(np.searchsorted(distinct_keys, value_keys), len(distinct) - 1)
+            valid &= distinct[value_codes] == values
+
+            size = len(distinct)
+            if key_space > (1 << 62) // size:
+                # Re-number the combined keys before they can overflow
+                joint = np.unique(np.concatenate([packet_key, rule_key]), return_inverse=True)[1]
+                packet_key, rule_key = joint[:num_packets], joint[num_packets:]
+                key_space = int(joint.max()) + 1
+            packet_key = packet_key * size + codes
+            rule_key = rule_key * size + value_codes
+            key_space *= size
+
+        if not valid.any():
+            return None
+        rule_key = rule_key[valid]
+        positions = positions[valid]
+
+        # Keep only the earliest rule for every distinct key
+        order = np.lexsort((positions, rule_key))
+        rule_key = rule_key[order]
+        positions = positions[order]
+        first = np.ones(len(rule_key), dtype=bool)
+        first[1:] = rule_key[1:] != rule_key[:-1]
+        rule_key = rule_key[first]
+        positions = positions[first]
+
+        index = np.minimum(np.searchsorted(rule_key, packet_key), len(rule_key) - 1)
+        return np.where(rule_key[index] == packet_key, positions[index], np.iinfo(np.int64).max)
+
+# Function to match a batch against one group rule by rule with boolean masks
+# Rules are applied from last to first so that the earliest matching rule wins
+    def _match_group_masks(self, switch_id, group, columns, derived, num_packets):
+        rules = self.flow_tables[switch_id]
+        candidate = np.full(num_packets, np.iinfo(np.int64).max, dtype=np.int64)
+        for position in reversed(group['positions'].tolist()):
+            mask = np.ones(num_packets, dtype=bool)
+            for key, value in rules[position].match.items():
+                mask &= _column_matches(columns, key, value, derived)
+            candidate[mask] = position
+        return candidate
+
+# Function to apply a rule's action to selected rows of a batch, mirroring execute_action
+# Returns a list with one result per row; modified rows each hold their packet as modified
+    def execute_batch_action(self, columns, rows, action, num_packets):
+        if 'forward_port' in action:
+            result = {'status': 'forwarded', 'port': action['forward_port']}
+        elif 'drop' in action:
+            result = {'status': 'dropped'}
+        elif 'modify' in action:
+            for field, value in action['modify'].items():
+                _assign_column(columns, field, rows, value, num_packets)
+            return [{'status': 'modified', 'packet': packet}
+                    for packet in batch_to_packets(columns, rows)]
         else:
-            return {'status': 'dropped'}
-        
-        # Drop all other traffic
-        
+            result = {'status': 'error', 'error': f"unknown action {action!r}"}
+        return list(map(dict.copy, itertools.repeat(result, len(rows))))
+
+# Function to handle a group of packets that missed the flow table, in arrival order
+# A packet matching a rule installed for an earlier packet of the group is a hit, as it
+# would have been had the packets arrived one at a time
+    def handle_unknown_flows(self, switch_id, packets):
+        installed = TupleSpaceClassifier()
+        results = []
+        misses = 0
+        for packet in packets:
+            rule = installed.lookup(packet) if len(installed) else None
+            # Rules installed earlier in the group may have been evicted since
+            while rule is not None and rule.cookie not in self.live_cookies:
+                installed.remove(rule)
+                rule = installed.lookup(packet) if len(installed) else None
+            if rule is not None:
+                self.flow_stats.record_hit(rule, self.clock(), packet.get('size', 0))
+                self.performance_metrics['flow_table_hits'] += 1
+                results.append(self.execute_action(switch_id, packet, rule.action))
+                continue
+
+            misses += 1
+            next_cookie = self.next_cookie
+            results.append(self.handle_unknown_flow(switch_id, packet))
+            # Only misses that installed rules hand out cookies
+            if self.next_cookie != next_cookie:
+                for new_rule in self.rules_installed_since(switch_id, next_cookie):
+                    installed.insert(new_rule)
+        self.performance_metrics['flow_table_misses'] += misses
+        self.performance_metrics['controller_requests'] += misses
+        return results
+
+# Function to handle packets that have no matching flow rule, as the miss policy says
+    def handle_unknown_flow(self, switch_id, packet):
+        return self.execute_action(switch_id, packet, self.decide_unknown_flow(switch_id, packet))
+
+# Function to get the miss policy's action for a packet with no matching flow rule
+# The rule the policy asks for is installed before the action is returned
+    def decide_unknown_flow(self, switch_id, packet):
+        entry = self.miss_policy.lookup(packet)
+        if entry is None:
+            return self.miss_policy.default_action
+        match = self.miss_policy.install_match(entry, packet, self.reactive_prefix_length)
+        if match is not None:
+            self.add_flow_rule(switch_id, match, entry.action, entry.idle_timeout,
+                               entry.hard_timeout)
+        return entry.action
+
+# Function to pre-install the rules of the miss policy's proactive entries on a switch
+    @_write_locked
+    def install_policy_rules(self, switch_id):
+        if switch_id in self.proactive_switches:
+            return 0
+        self.proactive_switches.add(switch_id)
+        installed = 0
+        for entry in self.miss_policy.proactive_entries():
+            if self.add_flow_rule(switch_id, dict(entry.match), entry.action,
+                                  entry.idle_timeout, entry.hard_timeout):
+                installed += 1
+        logger.debug("Pre-installed %s policy rules on switch %s", installed, switch_id)
+        return installed
+
 
+# Function to carry a packet from its ingress switch to the switch of its destination host
+# Every switch on the way applies its own flow table; the next hop comes from the cached
+# shortest paths, with equal-cost paths chosen per flow
+    def forward_packet(self, switch_id, packet):
+        egress = self.host_locations.get(packet.get('dst_ip'))
+        if egress is None:
+            return {'status': 'unreachable', 'path': [switch_id]}
+
+        key = flow_key(packet)
+        path = [switch_id]
+        while True:
+            result = self.process_packet(switch_id, packet)
+            if result is None or result['status'] == 'dropped':
+                return {'status': 'dropped', 'path': path}
+            if result['status'] == 'error':
+                return {'status': 'error', 'error': result['error'], 'path': path}
+            if switch_id == egress:
+                return {'status': 'delivered', 'path': path, 'hops': len(path) - 1}
+            switch_id = self.paths.next_hop(switch_id, egress, key)
+            if switch_id is None:
+                return {'status': 'unreachable', 'path': path}
+            path.append(switch_id)
 
 # Function to execute the action which is specified by a flow rule
     def execute_action(self, switch_id, packet, action):
@@ -157,47 +3707,1289 @@ class SDNController:
             for field, value in fields.items():
                 packet[field] = value
             return {'status': 'modified', 'packet': packet}
+        return {'status': 'error', 'error': f"unknown action {action!r}"}
     
 # Function to display the network topology
     def show_topology(self):
-        print("\nNetwork Topology:")
-        print("----------------")
+        logger.info("\nNetwork Topology:")
+        logger.info("----------------")
         for source, targets in self.topology.items():
-            print(f"{source} connected to: {', '.join(targets)}")
+            logger.info("%s connected to: %s", source, ', '.join(targets))
 
 # Function to show all flow tables currently in the network
     def show_flow_tables(self):
-        print("\nFlow Tables:")
-        print("-----------")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        self.merge_thread_stats()
+        logger.info("\nFlow Tables:")
+        logger.info("-----------")
         for switch_id, rules in self.flow_tables.items():
-            print(f"Switch {switch_id}:")
-            for rule in rules:
-                print(f"  Priority {rule['priority']}: {rule['match']} -> {rule['action']} (hits: {rule['counter']})")
-            print("")
+            logger.info("Switch %s:", switch_id)
+            hits = self.flow_stats.counters(rules)['packet_counts'].tolist()
+            for rule, rule_hits in zip(rules, hits):
+                logger.info("  Priority %s: %s -> %s (hits: %s)", rule.priority, rule.match,
+                            rule.action, rule_hits)
+            logger.info("")
+
+# Function to bring the flow stats table up to date for a statistics query: flow tables still
+# waiting in a snapshot are loaded and the counts of packet threads are added in
+    def _current_flow_stats(self, switch_id=None):
+        if isinstance(self.flow_tables, _LazySwitchDict):
+            if switch_id is None:
+                self.flow_tables.loader.load_all()
+            else:
+                self.flow_tables.loader.load(switch_id)
+        self.merge_thread_stats()
+        return self.flow_stats
+
+# Function to answer a flow statistics request, like an OpenFlow multipart flow stats request
+# Returns the rules passing every filter (see FlowStatsTable.select) in installation order,
+# as arrays: switch, cookie, packet_count, byte_count, duration, idle_time and rule
+    def get_flow_stats(self, switch_id=None, cookie=0, cookie_mask=0, min_packets=0,
+                       min_bytes=0, idle_for=None):
+        flow_stats = self._current_flow_stats(switch_id)
+        now = self.clock()
+        slots = flow_stats.select(switch_id, cookie, cookie_mask, min_packets, min_bytes,
+                                  idle_for, now)
+        return flow_stats.rows(slots, now)
+
+# Function to answer an aggregate statistics request: totals over the rules get_flow_stats
+# would return
+    def get_aggregate_stats(self, switch_id=None, cookie=0, cookie_mask=0, min_packets=0,
+                            min_bytes=0, idle_for=None):
+        flow_stats = self._current_flow_stats(switch_id)
+        slots = flow_stats.select(switch_id, cookie, cookie_mask, min_packets, min_bytes,
+                                  idle_for, self.clock())
+        return {
+            'packet_count': int(flow_stats.packet_counts[slots].sum()),
+            'byte_count': int(flow_stats.byte_counts[slots].sum()),
+            'flow_count': len(slots)
+        }
+
+# Function to answer a table statistics request: per switch, as arrays, the packets looked
+# up, the rules installed and the packets and bytes that matched one of them
+    def get_table_stats(self):
+        flow_stats = self._current_flow_stats()
+        switch_ids = list(self.switches)
+        numbers = [flow_stats.switch_number(switch_id) for switch_id in switch_ids]
+        switch_indexes = flow_stats.switch_indexes[:flow_stats.size]
+        installed = switch_indexes >= 0
+        switch_indexes = switch_indexes[installed]
+        num_switches = len(flow_stats.switch_ids)
+
+        def per_switch(column):
+            weights = column[:flow_stats.size][installed] if column is not None else None
+            totals = np.bincount(switch_indexes, weights, minlength=num_switches)
+            return totals.astype(np.int64)[numbers]
+
+        switches = np.empty(len(switch_ids), dtype=object)
+        switches[:] = switch_ids
+        return {
+            'switch': switches,
+            'lookup_count': np.array([self.switches[switch_id]['packet_count']
+                                      for switch_id in switch_ids], dtype=np.int64),
+            'active_count': per_switch(None),
+            'matched_count': per_switch(flow_stats.packet_counts),
+            'byte_count': per_switch(flow_stats.byte_counts)
+        }
+
+# Function to get the k rules with the most packets (or bytes, by='byte_count'), busiest
+# first, as arrays like get_flow_stats
+    def get_top_flows(self, k=10, by='packet_count', switch_id=None):
+        flow_stats = self._current_flow_stats(switch_id)
+        values = {'packet_count': flow_stats.packet_counts,
+                  'byte_count': flow_stats.byte_counts}[by]
+        slots = flow_stats.select(switch_id)
+        if 0 < k < len(slots):
+            slots = slots[np.argpartition(-values[slots], k - 1)[:k]]
+        slots = slots[np.argsort(-values[slots], kind='stable')][:max(k, 0)]
+        return flow_stats.rows(slots, self.clock())
+
+# Function to write the controller's state to a compact binary snapshot file
+# Every switch's flow table is a separate section so a restore can load it on demand
+    def save_snapshot(self, path):
+        self.merge_thread_stats()
+        sections = {}  # switch_id -> (offset, length, rules outside the microflow key)
+        with open(path, 'wb') as snapshot_file:
+            snapshot_file.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, 0, 0))
+            for switch_id, rules in self.flow_tables.items():
+                if not rules:
+                    continue
+                data = _encode_flow_table(rules, self.flow_stats.counters(rules))
+                uncacheable = sum(1 for rule in rules
+                                  if not set(rule.match).issubset(FIVE_TUPLE_FIELDS))
+                sections[switch_id] = (snapshot_file.tell(), len(data), uncacheable)
+                snapshot_file.write(data)
+
+            classifier = next((name for name, classifier_type in CLASSIFIERS.items()
+                               if classifier_type is self.classifier_type), self.classifier_type)
+            header = pickle.dumps({
+                'name': self.name,
+                'controller_type': self.controller_type,
+                'classifier_type': classifier,
+                'microflow_cache_size': self.microflow_cache_size,
+                'reactive_prefix_length': self.reactive_prefix_length,
+                'miss_policy': self.miss_policy,
+                'proactive': self.proactive,
+                'duplicate_rules': self.duplicate_rules,
+                'proactive_switches': self.proactive_switches,
+                'active': self.active,
+                'switches': self.switches,
+                'topology': self.topology,
+                'paths': self.paths,
+                'host_locations': self.host_locations,
+                'next_cookie': self.next_cookie,
+                'performance_metrics': self.performance_metrics,
+                'sections': sections
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+            header_offset = snapshot_file.tell()
+            snapshot_file.write(header)
+            snapshot_file.seek(0)
+            snapshot_file.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, header_offset, len(header)))
+
+        num_rules = sum(len(rules) for rules in self.flow_tables.values())
+        logger.info("Snapshot of '%s' saved to %s (%s rules)", self.name, path, num_rules)
+        return num_rules
+
+# Function to install a switch's flow table restored from a snapshot and rebuild its indexes
+# counters holds the rules' FLOW_COUNTER_COLUMNS as saved with them
+    def _install_restored_rules(self, switch_id, rules, counters=None, slots=None):
+        self.flow_tables[switch_id] = rules
+        slots = self.flow_stats.add_many(switch_id, rules, counters, slots)
+        self.classifiers[switch_id] = build_classifier(self.classifier_type, rules)
+        self.overlap_indexes.pop(switch_id, None)
+        self.table_versions[switch_id] += 1
+        if self.concurrent:
+            self.changed_tables.add(switch_id)
+        self.live_cookies.update(map(attrgetter('cookie'), rules))
+
+        for rule in itertools.compress(rules, map(attrgetter('hard_timeout'), rules)):
+            heapq.heappush(self.expiry_heap, (rule.created_at + rule.hard_timeout,
+                                              rule.cookie, HARD_TIMEOUT, switch_id, rule))
+        for rule in itertools.compress(rules, map(attrgetter('idle_timeout'), rules)):
+            heapq.heappush(self.expiry_heap, (rule.last_hit + rule.idle_timeout,
+                                              rule.cookie, IDLE_TIMEOUT, switch_id, rule))
+        if self.switches[switch_id].get('table_capacity') is not None:
+            heap = list(zip(self.flow_stats.last_hits[slots].tolist(),
+                            self.flow_stats.packet_counts[slots].tolist(),
+                            map(attrgetter('cookie'), rules), rules))
+            heapq.heapify(heap)
+            self.lru_heaps[switch_id] = heap
+
+# Function to hand a switch over to another controller: removes the switch with its flow
+# table, hosts and indexes, and returns them as a picklable state for import_switch
+    @_write_locked
+    def export_switch(self, switch_id):
+        if switch_id not in self.switches:
+            logger.error("Switch %s does not exist", switch_id)
+            return None
+
+        # Indexing loads the table first when it is still waiting in a snapshot
+        rules = self.flow_tables[switch_id]
+        del self.flow_tables[switch_id]
+        self.merge_thread_stats()
+        counters = self.flow_stats.remove_many(rules)
+        self.live_cookies.difference_update(map(attrgetter('cookie'), rules))
+        switch = self.switches.pop(switch_id)
+        for host_ip in switch['connected_hosts']:
+            self.host_locations.pop(host_ip, None)
+        for table in (self.classifiers, self.overlap_indexes, self.microflow_caches,
+                      self.lru_heaps, self.batch_rule_groups, self.snapshots, self.snapshot_bases):
+            table.pop(switch_id, None)
+        self.table_versions[switch_id] += 1
+        self.changed_tables.discard(switch_id)
+        state = {'switch': switch, 'rules': rules, 'counters': counters,
+                 'proactive': switch_id in self.proactive_switches}
+        self.proactive_switches.discard(switch_id)
+        logger.debug("Switch %s exported with %s rules", switch_id, len(rules))
+        return state
+
+# Function to take over a switch exported by another controller
+# Rules keep their order, counters and timeouts but get cookies from this controller
+    @_write_locked
+    def import_switch(self, state):
+        if not self.active:
+            logger.warning("Cannot import switch: Controller is not active")
+            return False
+
+        switch = state['switch']
+        switch_id = switch['id']
+        rules = state['rules']
+        for rule in rules:
+            rule.cookie = self.next_cookie
+            self.next_cookie += 1
+        self.switches[switch_id] = switch
+        for host_ip in switch['connected_hosts']:
+            self.host_locations[host_ip] = switch_id
+        self._install_restored_rules(switch_id, rules, state.get('counters'))
+        if self.microflow_cache_size:
+            cache = MicroflowCache(self.microflow_cache_size)
+            cache.uncacheable_rules = sum(1 for rule in rules
+                                          if not set(rule.match).issubset(FIVE_TUPLE_FIELDS))
+            self.microflow_caches[switch_id] = cache
+        if state['proactive']:
+            self.proactive_switches.add(switch_id)
+        elif self.proactive:
+            self.install_policy_rules(switch_id)
+        logger.debug("Switch %s imported with %s rules", switch_id, len(rules))
+        return True
+
 # Function to print a performance report for the controller
     def get_performance_report(self):
 
-        if not self.performance_metrics['packet_processing_time']:
-            return "No performance data available yet"
-            
-        avg_processing_time = sum(self.performance_metrics['packet_processing_time']) / len(self.performance_metrics['packet_processing_time'])
-        
-        hit_ratio = 0
-        if (self.performance_metrics['flow_table_hits'] + self.performance_metrics['flow_table_misses']) > 0:
-            hit_ratio = (self.performance_metrics['flow_table_hits'] / 
-                        (self.performance_metrics['flow_table_hits'] + self.performance_metrics['flow_table_misses']) * 100)
-        
+        self.merge_thread_stats()
+        if not self.performance_metrics['packet_processing_time']:
+            return "No performance data available yet"
+            
+        latency = self.performance_metrics['packet_processing_time'].summary()
+        
+        hit_ratio = 0
+        if (self.performance_metrics['flow_table_hits'] + self.performance_metrics['flow_table_misses']) > 0:
+            hit_ratio = (self.performance_metrics['flow_table_hits'] / 
+                        (self.performance_metrics['flow_table_hits'] + self.performance_metrics['flow_table_misses']) * 100)
+        
+        cache_lines = ""
+        if self.microflow_caches:
+            cache_lines = f"""
+    Microflow cache hits: {self.performance_metrics['microflow_cache_hits']}
+    Microflow cache misses: {self.performance_metrics['microflow_cache_misses']}
+    Microflow cache evictions: {self.performance_metrics['microflow_cache_evictions']}"""
+
+        report = f"""
+    Performance Report for {self.name} ({self.controller_type}):
+    --------------------------------------------------------
+    Average packet processing time: {latency['avg_processing_time']:.4f} ms
+    Processing time p50/p90/p99/p99.9: {latency['p50_processing_time']:.4f} / {latency['p90_processing_time']:.4f} / {latency['p99_processing_time']:.4f} / {latency['p999_processing_time']:.4f} ms
+    Maximum packet processing time: {latency['max_processing_time']:.4f} ms
+    Flow table hits: {self.performance_metrics['flow_table_hits']}
+    Flow table misses: {self.performance_metrics['flow_table_misses']}{cache_lines}
+    Flow rules installed: {self.performance_metrics['flow_rules_installed']}
+    Duplicate flow rules: {self.performance_metrics['duplicate_rules']}
+    Shadowed / redundant flow rules installed: {self.performance_metrics['shadowed_rules']} / {self.performance_metrics['redundant_rules']}
+    Flow rule evictions: {self.performance_metrics['flow_evictions']}
+    Flow rule expirations: {self.performance_metrics['flow_expirations']}
+    Controller requests: {self.performance_metrics['controller_requests']}
+    Hit ratio: {hit_ratio:.2f}%
+        """
+        return report
+
+# Snapshot file layout: magic, offset and length of the header, one section per switch,
+# then the pickled header holding the controller-wide state and the section index
+SNAPSHOT_MAGIC = b'SDNSNAP2'
+SNAPSHOT_PREFIX = struct.Struct('<8sQQ')
+
+# FlowRule attributes stored per rule, in the order of the FlowRule arguments after match
+# and action; counters are stored as the FLOW_COUNTER_COLUMNS arrays
+SNAPSHOT_RULE_FIELDS = ('priority', 'cookie', 'idle_timeout', 'hard_timeout')
+
+
+# Function to pack a column of values compactly: NumPy arrays for ints and floats,
+# one NUL-separated blob for strings, and a plain list for anything else
+def _pack_values(values):
+    kinds = {type(value) for value in values}
+    if kinds == {str}:
+        text = '\0'.join(values)
+        if text.count('\0') == len(values) - 1:
+            return ('text', text.encode())
+    elif kinds == {int}:
+        try:
+            return ('array', np.array(values, dtype=np.int64))
+        except OverflowError:
+            pass
+    elif kinds == {float}:
+        return ('array', np.array(values, dtype=np.float64))
+    return ('list', list(values))
+
+
+def _unpack_values(column, count):
+    kind, data = column
+    if kind == 'text':
+        return data.decode().split('\0') if count else []
+    if kind == 'array':
+        return data.tolist()
+    return data
+
+
+# Function to encode a switch's flow table column by column, with the rules' counters
+# Rules are grouped by their set of match fields; equal actions are stored once
+def _encode_flow_table(rules, counters):
+    shapes = {}  # match fields -> (shape number, positions, value lists)
+    shape_index = []
+    for position, rule in enumerate(rules):
+        fields = tuple(rule.match)
+        shape = shapes.get(fields)
+        if shape is None:
+            shape = shapes[fields] = (len(shapes), [], [[] for _ in fields])
+        shape_index.append(shape[0])
+        shape[1].append(position)
+        for values, value in zip(shape[2], rule.match.values()):
+            values.append(value)
+
+    actions = {}  # repr of action -> (action number, action)
+    action_index = []
+    for rule in rules:
+        action_key = repr(rule.action)
+        entry = actions.get(action_key)
+        if entry is None:
+            entry = actions[action_key] = (len(actions), rule.action)
+        action_index.append(entry[0])
+
+    payload = {
+        'count': len(rules),
+        'columns': {field: _pack_values(list(map(attrgetter(field), rules)))
+                    for field in SNAPSHOT_RULE_FIELDS},
+        'counters': counters,
+        'shapes': [(fields, len(positions), [_pack_values(values) for values in columns])
+                   for fields, (_, positions, columns) in shapes.items()],
+        'shape_index': np.array(shape_index, dtype=np.int32),
+        'actions': [action for _, action in actions.values()],
+        'action_index': np.array(action_index, dtype=np.int32),
+    }
+    return pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# Function to rebuild the rules of a switch and their counters from an encoded flow table
+# Rules that had equal actions share one action dict after decoding. With flow_stats, the
+# rules are created pointing at rows taken from it, returned as the third item
+def _decode_flow_table(data, flow_stats=None):
+    payload = pickle.loads(data)
+    count = payload['count']
+    shapes = payload['shapes']
+    matches = [None] * count
+    shape_index = payload['shape_index']
+    for shape, (fields, size, columns) in enumerate(shapes):
+        if fields:
+            # Each match is built from (field, value) pairs, which is faster than zipping
+            # the fields with a tuple of values per rule
+            items = [zip(itertools.repeat(field, size), _unpack_values(column, size))
+                     for field, column in zip(fields, columns)]
+            shape_matches = list(map(dict, zip(*items)))
+        else:
+            shape_matches = [{} for _ in range(size)]
+        if len(shapes) == 1:
+            matches = shape_matches
+        else:
+            for position, match in zip(np.flatnonzero(shape_index == shape).tolist(),
+                                       shape_matches):
+                matches[position] = match
+
+    actions = list(map(payload['actions'].__getitem__, payload['action_index'].tolist()))
+    columns = [_unpack_values(payload['columns'][field], count) for field in SNAPSHOT_RULE_FIELDS]
+    if flow_stats is None:
+        return list(map(FlowRule, matches, actions, *columns)), payload['counters'], None
+    slots = flow_stats._take_slots(count)
+    rules = list(map(FlowRule, matches, actions, *columns, itertools.repeat(flow_stats, count),
+                     slots.tolist()))
+    return rules, payload['counters'], slots
+
+
+# Class for the per-switch dicts of a restored controller (flow tables and classifiers)
+# A switch that is still in the snapshot is loaded the first time it is looked up;
+# iterating, measuring or pickling the dict loads every remaining switch first
+class _LazySwitchDict(dict):
+
+    def __init__(self, loader, default_factory=None):
+        super().__init__()
+        self.loader = loader
+        self.default_factory = default_factory
+
+    def __missing__(self, switch_id):
+        if self.loader.load(switch_id):
+            return dict.__getitem__(self, switch_id)
+        if self.default_factory is None:
+            raise KeyError(switch_id)
+        value = self[switch_id] = self.default_factory()
+        return value
+
+    def __contains__(self, switch_id):
+        return dict.__contains__(self, switch_id) or switch_id in self.loader.pending
+
+    def get(self, switch_id, default=None):
+        return self[switch_id] if switch_id in self else default
+
+    def __iter__(self):
+        self.loader.load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.loader.load_all()
+        return dict.__len__(self)
+
+    def keys(self):
+        self.loader.load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.loader.load_all()
+        return dict.values(self)
+
+    def items(self):
+        self.loader.load_all()
+        return dict.items(self)
+
+    # Pickled as the plain dict (or defaultdict) the controller would normally hold
+    def __reduce__(self):
+        self.loader.load_all()
+        if self.default_factory is None:
+            return (dict, (), None, None, iter(dict.items(self)))
+        return (defaultdict, (self.default_factory,), None, None, iter(dict.items(self)))
+
+
+# Class loading the flow tables of a restored controller from its snapshot, switch by switch
+class SnapshotLoader:
+
+    def __init__(self, path, controller, sections):
+        self.path = path
+        self.controller = controller
+        self.sections = sections  # switch_id -> (offset, length)
+        self.pending = set(sections)
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def load(self, switch_id):
+        if switch_id not in self.pending:
+            return False
+        self.pending.discard(switch_id)
+        offset, length = self.sections[switch_id]
+        # Millions of new dicts would otherwise trigger repeated full garbage collections
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            rules, counters, slots = _decode_flow_table(self.map[offset:offset + length],
+                                                        self.controller.flow_stats)
+            self.controller._install_restored_rules(switch_id, rules, counters, slots)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if not self.pending:
+            self.close()
+        return True
+
+    def load_all(self):
+        # Collections are held off for the whole load, not only while each switch decodes
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for switch_id in list(self.pending):
+                self.load(switch_id)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def close(self):
+        if not self.map.closed:
+            self.map.close()
+            self.file.close()
+
+
+# Function to restore a controller saved with SDNController.save_snapshot
+# Only the controller-wide state is read here; each switch's flow table and lookup index
+# are decoded the first time the switch is used
+def restore_snapshot(path):
+    with open(path, 'rb') as snapshot_file:
+        magic, header_offset, header_length = SNAPSHOT_PREFIX.unpack(
+            snapshot_file.read(SNAPSHOT_PREFIX.size))
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a controller snapshot")
+        snapshot_file.seek(header_offset)
+        header = pickle.loads(snapshot_file.read(header_length))
+
+    controller = SDNController(header['name'], header['controller_type'],
+                               classifier=header['classifier_type'],
+                               microflow_cache_size=header['microflow_cache_size'],
+                               reactive_prefix_length=header.get('reactive_prefix_length'),
+                               miss_policy=header.get('miss_policy'),
+                               proactive=header.get('proactive', False),
+                               duplicate_rules=header.get('duplicate_rules', DUPLICATE_MERGE))
+    controller.proactive_switches = header.get('proactive_switches', set())
+    for attribute in ('active', 'switches', 'topology', 'paths', 'host_locations',
+                      'next_cookie'):
+        setattr(controller, attribute, header[attribute])
+    # Metrics added since the snapshot was written start from zero
+    controller.performance_metrics.update(header['performance_metrics'])
+
+    sections = {switch_id: (offset, length)
+                for switch_id, (offset, length, _) in header['sections'].items()}
+    loader = SnapshotLoader(path, controller, sections)
+    controller.flow_tables = _LazySwitchDict(loader, list)
+    controller.classifiers = _LazySwitchDict(loader)
+    for switch_id in controller.switches:
+        if switch_id not in controller.classifiers:
+            dict.__setitem__(controller.classifiers, switch_id, controller.classifier_type())
+    # Caches start empty but must know up front whether a switch has uncacheable rules
+    if controller.microflow_cache_size:
+        for switch_id in controller.switches:
+            cache = MicroflowCache(controller.microflow_cache_size)
+            cache.uncacheable_rules = header['sections'].get(switch_id, (0, 0, 0))[2]
+            controller.microflow_caches[switch_id] = cache
+    if not sections:
+        loader.close()
+    logger.info("Controller '%s' restored from %s (%s switches, flow tables load on first use)",
+                controller.name, path, len(controller.switches))
+    return controller
+
+
+# Class simulating an asynchronous switch-to-controller channel in front of an SDNController
+# Table misses become packet-in events on a bounded queue. The controller answers them in
+# batches after a simulated round trip, and misses of a flow that is already waiting for
+# the controller are coalesced into the pending request instead of being sent again; each
+# coalesced packet then goes through the rule installed for its flow like a buffered packet
+class AsyncControlChannel:
+
+    def __init__(self, controller, rtt=0.001, queue_size=1024, batch_size=64):
+        self.controller = controller
+        self.rtt = rtt  # seconds for a packet-in to reach the controller and the flow-mods to come back
+        self.queue_size = queue_size
+        self.batch_size = batch_size  # most flow-mods sent back in one message
+        self.queue = None
+        self.worker = None
+        self.pending = {}  # (switch_id, 5-tuple) -> future resolved when the controller answers
+        self.install_time = LatencyHistogram()  # nanoseconds from packet-in to rule installed
+        self.stats = {
+            'packet_ins': 0,
+            'coalesced_misses': 0,
+            'packet_in_drops': 0,
+            'flow_mods': 0,
+            'flow_mod_batches': 0,
+            'max_queue_depth': 0,
+            'queue_depth_total': 0,
+            'queue_depth_samples': 0
+        }
+        self.started_at = None
+        self.stopped_at = None
+
+# Function to start the controller task that serves the packet-in queue
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.worker = asyncio.create_task(self._serve_packet_ins())
+        self.started_at = time.perf_counter()
+        self.stopped_at = None
+
+# Function to wait for every queued packet-in to be answered and stop the controller task
+    async def stop(self):
+        await self.queue.join()
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.stopped_at = time.perf_counter()
+
+# Function to process a packet on a switch, waiting for the controller on a table miss
+    async def process_packet(self, switch_id, packet):
+        controller = self.controller
+        if switch_id not in controller.switches:
+            logger.error("Switch %s does not exist", switch_id)
+            return
+
+        start_time = time.perf_counter_ns()
+        controller.switches[switch_id]['packet_count'] += 1
+        now = controller.clock()
+        if controller.expiry_heap and controller.expiry_heap[0][0] <= now:
+            controller.expire_flows(now)
+
+        matched_rule = controller.lookup_rule(switch_id, packet)
+        if matched_rule:
+            controller.flow_stats.record_hit(matched_rule, now, packet.get('size', 0))
+            controller.performance_metrics['flow_table_hits'] += 1
+            result = controller.execute_action(switch_id, packet, matched_rule.action)
+        else:
+            controller.performance_metrics['flow_table_misses'] += 1
+            result = await self._packet_in(switch_id, packet)
+
+        # Misses include the time spent waiting for the controller
+        processing_time = time.perf_counter_ns() - start_time
+        controller.performance_metrics['packet_processing_time'].record(processing_time)
+        return result
+
+# Function to send a packet-in for a missed packet, or join the pending one for its flow
+    async def _packet_in(self, switch_id, packet):
+        key = (switch_id, flow_key(packet))
+        future = self.pending.get(key)
+        if future is not None:
+            # The leader's packet-in answers for the whole flow, without asking again
+            self.stats['coalesced_misses'] += 1
+            action = self._answer(switch_id, packet, await future)
+            return self.controller.execute_action(switch_id, packet, action)
+
+        if self.queue.full():
+            self.stats['packet_in_drops'] += 1
+            return {'status': 'dropped'}
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        self.stats['packet_ins'] += 1
+        self.controller.performance_metrics['controller_requests'] += 1
+        self.queue.put_nowait((switch_id, packet, time.perf_counter_ns(), key))
+
+        depth = self.queue.qsize()
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], depth)
+        self.stats['queue_depth_total'] += depth
+        self.stats['queue_depth_samples'] += 1
+        return self.controller.execute_action(switch_id, packet, await future)
+
+# Function run as the controller task: answer queued packet-ins in batches
+    async def _serve_packet_ins(self):
+        controller = self.controller
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # One round trip carries the packet-ins up and the batch of flow-mods back
+            await asyncio.sleep(self.rtt)
+
+            next_cookie = controller.next_cookie
+            for switch_id, packet, enqueued_at, key in batch:
+                action = self._answer(switch_id, packet)
+                self.install_time.record(time.perf_counter_ns() - enqueued_at)
+                self.pending.pop(key).set_result(action)
+                self.queue.task_done()
+
+            self.stats['flow_mods'] += controller.next_cookie - next_cookie
+            self.stats['flow_mod_batches'] += 1
+
+# Function to get the controller's action for a missed packet
+# An earlier packet-in may already have installed a rule covering it. Otherwise the packet
+# gets the action already decided for its flow, when it joined a pending packet-in, or the
+# miss policy decides and may install a rule
+    def _answer(self, switch_id, packet, action=None):
+        controller = self.controller
+        matched_rule = controller.classifiers[switch_id].lookup(packet)
+        if matched_rule:
+            controller.flow_stats.record_hit(matched_rule, controller.clock(),
+                                             packet.get('size', 0))
+            return matched_rule.action
+        if action is None:
+            action = controller.decide_unknown_flow(switch_id, packet)
+        return action
+
+# Function to replay traffic through the channel, one task per packet
+# interval is the gap in seconds between packet arrivals (0 sends them back to back)
+    async def replay(self, switch_id, traffic, interval=0.0):
+        tasks = []
+        for packet in traffic:
+            tasks.append(asyncio.create_task(self.process_packet(switch_id, dict(packet))))
+            await asyncio.sleep(interval)
+        return await asyncio.gather(*tasks)
+
+# Function to print a report of the control channel load
+    def get_report(self):
+        end_time = self.stopped_at or time.perf_counter()
+        elapsed = end_time - self.started_at if self.started_at else 0
+        packet_in_rate = self.stats['packet_ins'] / elapsed if elapsed else 0
+        avg_depth = 0
+        if self.stats['queue_depth_samples']:
+            avg_depth = self.stats['queue_depth_total'] / self.stats['queue_depth_samples']
+        install = self.install_time.summary()
+
+        report = f"""
+    Control Channel Report for {self.controller.name} (RTT {self.rtt * 1000:.2f} ms):
+    --------------------------------------------------------
+    Packet-ins sent: {self.stats['packet_ins']}
+    Packet-in rate: {packet_in_rate:.0f} per second
+    Coalesced misses: {self.stats['coalesced_misses']}
+    Dropped packet-ins (queue full): {self.stats['packet_in_drops']}
+    Queue depth avg/max: {avg_depth:.1f} / {self.stats['max_queue_depth']} (capacity {self.queue_size})
+    Flow-mods sent: {self.stats['flow_mods']} in {self.stats['flow_mod_batches']} batches
+    Rule install time avg/p50/p99/max: {install['avg_processing_time']:.3f} / {install['p50_processing_time']:.3f} / {install['p99_processing_time']:.3f} / {install['max_processing_time']:.3f} ms
+        """
+        return report
+
+# Points every cluster worker gets on the consistent-hash ring; more points spread the
+# switches more evenly over the workers
+CLUSTER_RING_REPLICAS = 128
+
+
+# Class assigning keys (switches) to nodes (cluster workers) with consistent hashing
+# Every node owns replicas points on a ring and a key belongs to the node of the first point
+# at or after its own position, so adding or removing a node only moves the keys next to
+# that node's points: about 1/N of them instead of nearly all of them with a modulo
+class ConsistentHashRing:
+
+    def __init__(self, nodes=(), replicas=CLUSTER_RING_REPLICAS):
+        self.replicas = replicas
+        self.positions = []  # sorted positions of every node's points
+        self.owners = []  # node owning the point at the same index
+        self.nodes = set()
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        if node in self.nodes:
+            return False
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            position = stable_hash(f"{node}#{replica}")
+            index = bisect.bisect_left(self.positions, position)
+            self.positions.insert(index, position)
+            self.owners.insert(index, node)
+        return True
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            return False
+        self.nodes.discard(node)
+        kept = [(position, owner) for position, owner in zip(self.positions, self.owners)
+                if owner != node]
+        self.positions = [position for position, _ in kept]
+        self.owners = [owner for _, owner in kept]
+        return True
+
+    def node_for(self, key):
+        if not self.positions:
+            return None
+        index = bisect.bisect_left(self.positions, stable_hash(key))
+        return self.owners[index % len(self.owners)]
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+# Function to add up the performance metrics of several controllers
+def merge_performance_metrics(metrics):
+    merged = {}
+    for controller_metrics in metrics:
+        for name, value in controller_metrics.items():
+            if isinstance(value, LatencyHistogram):
+                merged.setdefault(name, LatencyHistogram()).merge(value)
+            else:
+                merged[name] = merged.get(name, 0) + value
+    return merged
+
+
+# Function run in every cluster worker process: a controller serving the cluster's commands
+# from a pipe until it is told to stop. A command names a controller method and its
+# arguments; 'process_packets' carries a whole chunk of (switch_id, packet) pairs so the IPC
+# cost is paid per chunk instead of per packet
+def _cluster_worker(connection, name, controller_type, options):
+    controller = SDNController(name, controller_type, **options)
+    controller.start()
+    while True:
+        command, args = connection.recv()
+        if command == 'stop':
+            break
+        try:
+            if command == 'process_packets':
+                result = [controller.process_packet(switch_id, packet)
+                          for switch_id, packet in args[0]]
+            elif command == 'performance_metrics':
+                result = controller.performance_metrics
+            else:
+                result = getattr(controller, command)(*args)
+        except Exception as error:
+            connection.send((False, error))
+        else:
+            connection.send((True, result))
+    connection.close()
+
+
+# Class running a sharded control plane: N worker processes, each with its own SDNController
+# Switches are assigned to workers with consistent hashing and every call about a switch is
+# sent to the worker owning it over a pipe. Adding or removing a worker moves only the
+# switches whose owner changed, flow tables included
+# Multi-hop forwarding stays with single controllers, as paths cross the shards
+class ControllerCluster:
+
+    def __init__(self, name, num_workers=2, controller_type="OpenFlow", chunk_size=1024,
+                 replicas=CLUSTER_RING_REPLICAS, **controller_options):
+        self.name = name
+        self.controller_type = controller_type
+        self.num_workers = num_workers  # workers spawned by start()
+        self.chunk_size = chunk_size  # most packets sent to a worker in one message
+        self.controller_options = controller_options  # SDNController options of every worker
+        self.ring = ConsistentHashRing(replicas=replicas)
+        self.workers = {}  # worker_id -> (process, connection)
+        self.next_worker_id = 0
+        self.switch_owners = {}  # switch_id -> worker_id
+        self.retired_metrics = []  # performance metrics of workers that were stopped
+        self.stats = {
+            'packets_routed': 0,
+            'messages': 0,
+            'rebalances': 0,
+            'switches_moved': 0
+        }
+        self.active = False
+
+# Function to start the cluster's worker processes
+    def start(self):
+        if self.active:
+            return
+        self.active = True
+        for _ in range(self.num_workers):
+            self._spawn_worker()
+        logger.debug("Cluster '%s' is now active with %s workers", self.name, len(self.workers))
+
+# Function to stop every worker; their metrics stay available for the performance report
+    def stop(self):
+        for worker_id in list(self.workers):
+            self._stop_worker(worker_id)
+        self.ring = ConsistentHashRing(replicas=self.ring.replicas)
+        self.switch_owners.clear()
+        self.active = False
+        logger.debug("Cluster '%s' has been stopped", self.name)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _spawn_worker(self):
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_cluster_worker, daemon=True,
+            args=(worker_connection, f"{self.name}-{worker_id}", self.controller_type,
+                  self.controller_options))
+        process.start()
+        worker_connection.close()
+        self.workers[worker_id] = (process, connection)
+        self.ring.add_node(worker_id)
+        return worker_id
+
+    def _stop_worker(self, worker_id):
+        self.retired_metrics.append(self._call(worker_id, 'performance_metrics'))
+        process, connection = self.workers.pop(worker_id)
+        connection.send(('stop', ()))
+        process.join()
+        connection.close()
+
+    def _send(self, worker_id, command, *args):
+        self.workers[worker_id][1].send((command, args))
+        self.stats['messages'] += 1
+
+    def _receive(self, worker_id):
+        succeeded, result = self.workers[worker_id][1].recv()
+        if not succeeded:
+            raise result
+        return result
+
+    def _call(self, worker_id, command, *args):
+        self._send(worker_id, command, *args)
+        return self._receive(worker_id)
+
+# Function to call a controller method on the worker owning a switch
+    def _call_owner(self, switch_id, command, *args):
+        worker_id = self.switch_owners.get(switch_id)
+        if worker_id is None:
+            logger.error("Switch %s does not exist", switch_id)
+            return None
+        return self._call(worker_id, command, switch_id, *args)
+
+# Function to add a worker process and move the switches it now owns to it
+    def add_worker(self):
+        if not self.active:
+            logger.warning("Cannot add worker: Cluster is not active")
+            return None
+        worker_id = self._spawn_worker()
+        moved = self.rebalance()
+        logger.info("Worker %s joined cluster '%s' (%s switches moved)", worker_id, self.name,
+                    moved)
+        return worker_id
+
+# Function to hand a worker's switches to the remaining workers and stop it
+    def remove_worker(self, worker_id):
+        if worker_id not in self.workers:
+            logger.error("Worker %s does not exist", worker_id)
+            return False
+        if len(self.workers) == 1:
+            logger.error("Cannot remove the last worker of cluster '%s'", self.name)
+            return False
+        self.ring.remove_node(worker_id)
+        moved = self.rebalance()
+        self._stop_worker(worker_id)
+        logger.info("Worker %s left cluster '%s' (%s switches moved)", worker_id, self.name, moved)
+        return True
+
+# Function to move every switch whose owner on the ring changed to its new worker
+    def rebalance(self):
+        moved = 0
+        for switch_id, worker_id in list(self.switch_owners.items()):
+            owner = self.ring.node_for(switch_id)
+            if owner == worker_id:
+                continue
+            state = self._call(worker_id, 'export_switch', switch_id)
+            self._call(owner, 'import_switch', state)
+            self.switch_owners[switch_id] = owner
+            moved += 1
+        self.stats['rebalances'] += 1
+        self.stats['switches_moved'] += moved
+        return moved
+
+# Function to get the worker owning a switch (None if the switch was never added)
+    def owner(self, switch_id):
+        return self.switch_owners.get(switch_id)
+
+# Function to add a switch on the worker that owns it
+    def add_switch(self, switch_id, num_ports, table_capacity=None):
+        if not self.active:
+            logger.warning("Cannot add switch: Cluster is not active")
+            return False
+        worker_id = self.ring.node_for(switch_id)
+        if not self._call(worker_id, 'add_switch', switch_id, num_ports, table_capacity):
+            return False
+        self.switch_owners[switch_id] = worker_id
+        return True
+
+# Function to attach a host to a switch
+    def add_host(self, switch_id, host_ip):
+        return bool(self._call_owner(switch_id, 'add_host', host_ip))
+
+# Function to add a flow rule to a switch
+    def add_flow_rule(self, switch_id, match_criteria, action, idle_timeout=0, hard_timeout=0):
+        return bool(self._call_owner(switch_id, 'add_flow_rule', match_criteria, action,
+                                     idle_timeout, hard_timeout))
+
+# Function to process one packet on the worker owning its switch (one round trip)
+    def process_packet(self, switch_id, packet):
+        if switch_id in self.switch_owners:
+            self.stats['packets_routed'] += 1
+        return self._call_owner(switch_id, 'process_packet', packet)
+
+# Function to process (switch_id, packet) pairs on the workers owning their switches
+# Every worker gets its packets in order, chunk_size at a time, with one chunk in flight on
+# each worker so they all work in parallel. Results are returned in traffic order
+    def process_packets(self, traffic):
+        traffic = list(traffic)
+        results = [None] * len(traffic)
+        positions = defaultdict(list)  # worker_id -> positions in traffic of its packets
+        for position, (switch_id, _) in enumerate(traffic):
+            worker_id = self.switch_owners.get(switch_id)
+            if worker_id is None:
+                logger.error("Switch %s does not exist", switch_id)
+                continue
+            positions[worker_id].append(position)
+
+        offsets = dict.fromkeys(positions, 0)
+        while offsets:
+            in_flight = []
+            for worker_id, offset in offsets.items():
+                chunk = positions[worker_id][offset:offset + self.chunk_size]
+                self._send(worker_id, 'process_packets', [traffic[position] for position in chunk])
+                in_flight.append((worker_id, chunk))
+            for worker_id, chunk in in_flight:
+                for position, result in zip(chunk, self._receive(worker_id)):
+                    results[position] = result
+                offsets[worker_id] += len(chunk)
+                if offsets[worker_id] == len(positions[worker_id]):
+                    del offsets[worker_id]
+        self.stats['packets_routed'] += sum(map(len, positions.values()))
+        return results
+
+# Function to get the performance metrics of every running worker
+    def worker_metrics(self):
+        return {worker_id: self._call(worker_id, 'performance_metrics')
+                for worker_id in self.workers}
+
+# Function to add up the performance metrics of the whole cluster, stopped workers included
+    def get_performance_metrics(self):
+        return merge_performance_metrics(list(self.worker_metrics().values()) +
+                                         self.retired_metrics)
+
+# Function to print a performance report for the whole cluster
+    def get_performance_report(self):
+        workers = self.worker_metrics()
+        metrics = merge_performance_metrics(list(workers.values()) + self.retired_metrics)
+        if not metrics or not metrics['packet_processing_time']:
+            return "No performance data available yet"
+
+        latency = metrics['packet_processing_time'].summary()
+        lookups = metrics['flow_table_hits'] + metrics['flow_table_misses']
+        hit_ratio = metrics['flow_table_hits'] / lookups * 100 if lookups else 0
+        switches = defaultdict(int)
+        for worker_id in self.switch_owners.values():
+            switches[worker_id] += 1
+        worker_lines = "".join(
+            f"""
+    Worker {worker_id}: {switches[worker_id]} switches, {worker['flow_table_hits'] + worker['flow_table_misses']} packets, {worker['controller_requests']} controller requests"""
+            for worker_id, worker in workers.items())
+
+        report = f"""
+    Cluster Performance Report for {self.name} ({self.controller_type}, {len(workers)} workers):
+    --------------------------------------------------------{worker_lines}
+    Average packet processing time: {latency['avg_processing_time']:.4f} ms
+    Processing time p50/p90/p99/p99.9: {latency['p50_processing_time']:.4f} / {latency['p90_processing_time']:.4f} / {latency['p99_processing_time']:.4f} / {latency['p999_processing_time']:.4f} ms
+    Maximum packet processing time: {latency['max_processing_time']:.4f} ms
+    Flow table hits: {metrics['flow_table_hits']}
+    Flow table misses: {metrics['flow_table_misses']}
+    Flow rules installed: {metrics['flow_rules_installed']}
+    Controller requests: {metrics['controller_requests']}
+    Hit ratio: {hit_ratio:.2f}%
+    Packets routed: {self.stats['packets_routed']} in {self.stats['messages']} messages
+    Switches moved: {self.stats['switches_moved']} in {self.stats['rebalances']} rebalances
+        """
+        return report
+
+# Class holding the state of one simulated directed link and the output queue feeding it
+# The queue is FIFO with a deterministic service time, so it is fully described by the
+# departure times of the packets still in it
+class SimulatedLink:
+
+    def __init__(self, latency, bandwidth, queue_size):
+        self.latency = latency  # seconds
+        self.bandwidth = bandwidth  # bits per second
+        self.queue_size = queue_size  # packets, including the one being transmitted
+        self.departures = deque()
+        self.busy_until = 0.0
+        self.packets = 0
+        self.bytes = 0
+        self.drops = 0
+        self.occupancy_total = 0
+        self.max_occupancy = 0
+
+
+# Class running a discrete-event simulation of packets crossing the controller's topology
+# Packets arrive at switches as heap-scheduled events; each switch applies its flow table
+# and hands the packet to the output queue of the link towards the destination host.
+# Serialization delay comes from the packet 'size' (bytes) and the link bandwidth, and
+# propagation delay from the link latency. While running, the controller's clock is the
+# simulated clock, so flow rule timeouts are in simulated seconds
+class NetworkSimulator:
+
+    def __init__(self, controller, latency=1e-5, bandwidth=1e9, queue_size=64,
+                 processing_delay=0.0, default_packet_size=1500):
+        self.controller = controller
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.queue_size = queue_size
+        self.processing_delay = processing_delay  # seconds spent in every switch
+        self.default_packet_size = default_packet_size
+        self.links = {}  # (source, target) -> SimulatedLink
+        self.events = []  # (time, sequence, switch_id, packet, injected_at, egress, flow key)
+        self.sources = []  # iterators of (time, switch_id, packet), one pending event each
+        self.sequence = 0
+        self.now = 0.0
+        self.latency_histogram = LatencyHistogram()  # simulated nanoseconds
+        self.stats = {
+            'events': 0,
+            'injected': 0,
+            'delivered': 0,
+            'delivered_bytes': 0,
+            'queue_drops': 0,
+            'flow_table_drops': 0,
+            'unreachable': 0
+        }
+
+# Function to give a link its own latency, bandwidth or queue size instead of the defaults
+    def set_link(self, source, target, latency=None, bandwidth=None, queue_size=None):
+        self.links[(source, target)] = SimulatedLink(
+            self.latency if latency is None else latency,
+            self.bandwidth if bandwidth is None else bandwidth,
+            self.queue_size if queue_size is None else queue_size)
+
+    def link(self, source, target):
+        link = self.links.get((source, target))
+        if link is None:
+            self.set_link(source, target)
+            link = self.links[(source, target)]
+        return link
+
+# Function to add a traffic source: an iterable of (time, ingress switch, packet) in time order
+# Only the next packet of every source is kept in the event heap
+    def add_traffic(self, source):
+        iterator = iter(source)
+        self.sources.append(iterator)
+        self._schedule_injection(len(self.sources) - 1)
+
+    def _schedule_injection(self, source_index):
+        for time_, switch_id, packet in self.sources[source_index]:
+            self.sequence += 1
+            # Injections carry the source index in place of the flow key
+            heapq.heappush(self.events, (time_, self.sequence, switch_id, packet, None, None,
+                                         source_index))
+            return
+
+    def _clock(self):
+        return self.now
+
+# Function to run the simulation until the event heap is empty or the time limit is reached
+    def run(self, until=None):
+        controller = self.controller
+        switches = controller.switches
+        paths = controller.paths
+        host_locations = controller.host_locations
+        events = self.events
+        stats = self.stats
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        processing_delay = self.processing_delay
+        default_packet_size = self.default_packet_size
+
+        wall_clock = controller.clock
+        controller.clock = self._clock
+        start_time = time.perf_counter()
+        try:
+            while events:
+                if until is not None and events[0][0] > until:
+                    break
+                now, _, switch_id, packet, injected_at, egress, key = heappop(events)
+                self.now = now
+                stats['events'] += 1
+
+                if injected_at is None:
+                    # A new packet enters the network; queue the next one of its source
+                    self._schedule_injection(key)
+                    stats['injected'] += 1
+                    egress = host_locations.get(packet.get('dst_ip'))
+                    if egress is None:
+                        stats['unreachable'] += 1
+                        continue
+                    injected_at = now
+                    key = flow_key(packet)
+
+                # Same flow table handling as process_packet, minus its wall-clock timing
+                if switch_id not in switches:
+                    stats['unreachable'] += 1
+                    continue
+                result = controller.apply_flow_table(switch_id, packet, now, key,
+                                                     default_packet_size)
+                status = result['status']
+                if status == 'dropped' or status == 'error':
+                    stats['flow_table_drops'] += 1
+                    continue
+                if status == 'modified':
+                    key = flow_key(packet)
+                if switch_id == egress:
+                    stats['delivered'] += 1
+                    stats['delivered_bytes'] += packet.get('size', default_packet_size)
+                    self.latency_histogram.record(
+                        int((now + processing_delay - injected_at) * 1e9))
+                    continue
+
+                next_hop = paths.next_hop(switch_id, egress, key)
+                if next_hop is None:
+                    stats['unreachable'] += 1
+                    continue
+                link = self.links.get((switch_id, next_hop))
+                if link is None:
+                    link = self.link(switch_id, next_hop)
+
+                # Packets whose transmission has finished have left the queue
+                ready = now + processing_delay
+                departures = link.departures
+                while departures and departures[0] <= ready:
+                    departures.popleft()
+                occupancy = len(departures)
+                link.occupancy_total += occupancy
+                if occupancy > link.max_occupancy:
+                    link.max_occupancy = occupancy
+                if occupancy >= link.queue_size:
+                    link.drops += 1
+                    stats['queue_drops'] += 1
+                    continue
+
+                size = packet.get('size', default_packet_size)
+                departure = max(ready, link.busy_until) + size * 8 / link.bandwidth
+                link.busy_until = departure
+                departures.append(departure)
+                link.packets += 1
+                link.bytes += size
+                self.sequence += 1
+                heappush(events, (departure + link.latency, self.sequence, next_hop, packet,
+                                  injected_at, egress, key))
+        finally:
+            controller.clock = wall_clock
+            self.wall_time = time.perf_counter() - start_time
+
+        return self.stats
+
+# Function to summarize the simulation
+    def get_report(self):
+        stats = self.stats
+        duration = self.now
+        throughput = stats['delivered_bytes'] * 8 / duration if duration > 0 else 0.0
+        arrivals = sum(link.packets + link.drops for link in self.links.values())
+        average_occupancy = (sum(link.occupancy_total for link in self.links.values()) / arrivals
+                             if arrivals else 0.0)
+        max_occupancy = max((link.max_occupancy for link in self.links.values()), default=0)
+        busiest = max(self.links.items(), key=lambda item: item[1].packets, default=None)
+        latency = self.latency_histogram.summary() if self.latency_histogram else None
+
         report = f"""
-    Performance Report for {self.name} ({self.controller_type}):
+    Network Simulation Report for {self.controller.name}:
     --------------------------------------------------------
-    Average packet processing time: {avg_processing_time:.2f} ms
-    Flow table hits: {self.performance_metrics['flow_table_hits']}
-    Flow table misses: {self.performance_metrics['flow_table_misses']}
-    Controller requests: {self.performance_metrics['controller_requests']}
-    Hit ratio: {hit_ratio:.2f}%
-        """
+    Simulated time: {duration * 1000:.3f} ms ({stats['events']} events in {self.wall_time:.2f} s, {stats['events'] / max(self.wall_time, 1e-9):,.0f} events/s)
+    Packets injected / delivered: {stats['injected']} / {stats['delivered']}
+    Throughput: {throughput / 1e6:.2f} Mbit/s
+    Drops (queue / flow table / unreachable): {stats['queue_drops']} / {stats['flow_table_drops']} / {stats['unreachable']}
+    Queue occupancy (average / max): {average_occupancy:.2f} / {max_occupancy} packets"""
+        if busiest is not None:
+            report += f"""
+    Busiest link: {busiest[0][0]} -> {busiest[0][1]} ({busiest[1].packets} packets, {busiest[1].drops} drops)"""
+        if latency is not None:
+            report += f"""
+    End-to-end latency avg/p50/p99/max: {latency['avg_processing_time']:.4f} / {latency['p50_processing_time']:.4f} / {latency['p99_processing_time']:.4f} / {latency['max_processing_time']:.4f} ms"""
         return report
 
+
+# Function to run traffic through a controller
+# Every packet is copied first so 'modify' actions cannot leak into other runs
+def run_controller_traffic(controller, traffic, switch_id="sw1"):
+    for packet in traffic:
+        controller.process_packet(switch_id, dict(packet))
+    return controller
+
+# Function to process (switch_id, packet) pairs on a pool of threads sharing one controller
+# in concurrent mode; each thread takes chunk_size packets at a time. Returns the results in
+# traffic order
+def run_concurrent_traffic(controller, traffic, num_threads=4, chunk_size=1024):
+    controller.enable_concurrency()
+    traffic = list(traffic)
+    results = [None] * len(traffic)
+
+    def process_chunk(start):
+        for position in range(start, min(start + chunk_size, len(traffic))):
+            switch_id, packet = traffic[position]
+            results[position] = controller.process_packet(switch_id, dict(packet))
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        # Consuming the results raises any exception of a worker thread here
+        list(executor.map(process_chunk, range(0, len(traffic), chunk_size)))
+    controller.merge_thread_stats()
+    return results
+
+# Function to summarize a controller's performance metrics as a results entry
+def collect_results(controller):
+    return {
+        **controller.performance_metrics['packet_processing_time'].summary(),
+        'flow_table_hits': controller.performance_metrics['flow_table_hits'],
+        'flow_table_misses': controller.performance_metrics['flow_table_misses'],
+        'controller_requests': controller.performance_metrics['controller_requests']
+    }
+
+# Function to evaluate one traffic pattern on a controller (also used as a worker process)
+def _pattern_worker(controller, traffic, switch_id):
+    controller.reset_performance_metrics()
+    run_controller_traffic(controller, traffic, switch_id)
+    return collect_results(controller), controller.get_performance_report()
+
+# Function to run benchmark traffic on a controller in a worker process
+# Returns the performance metrics of this run only, for the parent to merge into its own
+def _benchmark_worker(controller, traffic, switch_id):
+    controller.reset_performance_metrics()
+    run_controller_traffic(controller, traffic, switch_id)
+    return controller.merge_thread_stats()
+
+# Function to draw grouped bars of the mean and latency percentiles for each result
+def plot_latency_percentiles(ax, labels, results):
+    series = [('avg_processing_time', 'Average')]
+    for percent in REPORTED_PERCENTILES:
+        series.append((f"p{str(percent).replace('.', '')}_processing_time", f"p{percent}"))
+
+    width = 0.8 / len(series)
+    x = np.arange(len(labels))
+    for i, (key, label) in enumerate(series):
+        ax.bar(x + (i - (len(series) - 1) / 2) * width, [result[key] for result in results],
+               width, label=label)
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels)
+    ax.set_yscale('log')
+    ax.set_ylabel('Time (ms)')
+    ax.legend()
+
 # Class to compare different SDN controllers
 class SDNBenchmark:
     
@@ -209,7 +5001,7 @@ class SDNBenchmark:
     def add_controller(self, controller):
 
         self.controllers[controller.name] = controller
-        print(f"Added {controller.name} to benchmark")
+        logger.debug("Added %s to benchmark", controller.name)
 
 # Function to generate test network patterns
     def generate_test_traffic(self, num_packets=1000):
@@ -267,52 +5059,57 @@ class SDNBenchmark:
         return traffic
     
 # Function to run the benchmark on all the active controllers
-    def run_benchmark(self, traffic=None, switch_id="sw1"):
+    def run_benchmark(self, traffic=None, switch_id="sw1", parallel=False, max_workers=None):
         if traffic is None:
             traffic = self.generate_test_traffic()
             
-        print(f"Running benchmark with {len(traffic)} packets...")
+        logger.info("Running benchmark with %s packets...", len(traffic))
+        
+        if parallel:
+            self._run_benchmark_parallel(traffic, switch_id, max_workers)
         
         for name, controller in self.controllers.items():
-            print(f"\nTesting controller: {name}")
+            logger.info("\nTesting controller: %s", name)
             
             # Process all packets
-            for packet in traffic:
-                controller.process_packet(switch_id, packet)
+            if not parallel:
+                run_controller_traffic(controller, traffic, switch_id)
                 
             # Store results
-            avg_time = sum(controller.performance_metrics['packet_processing_time']) / len(controller.performance_metrics['packet_processing_time'])
-            self.results[name] = {
-                'avg_processing_time': avg_time,
-                'flow_table_hits': controller.performance_metrics['flow_table_hits'],
-                'flow_table_misses': controller.performance_metrics['flow_table_misses'],
-                'controller_requests': controller.performance_metrics['controller_requests']
-            }
+            self.results[name] = collect_results(controller)
             
-            print(controller.get_performance_report())
+            logger.info(controller.get_performance_report())
             
         return self.results
 
+# Function to run the benchmark on every controller in its own worker process
+# Each worker gets a pickled copy of the controller and traffic; only the metrics of its run
+# are merged back, so the rules it learned stay in the worker as with compare_traffic_patterns
+    def _run_benchmark_parallel(self, traffic, switch_id, max_workers):
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {name: executor.submit(_benchmark_worker, controller, traffic, switch_id)
+                       for name, controller in self.controllers.items()}
+            for name, future in futures.items():
+                self.controllers[name].add_performance_metrics(future.result())
+
 # Function to visualize and plot the benchmark results
     def visualize_results(self):
 
         if not self.results:
-            print("No benchmark results to visualize")
+            logger.info("No benchmark results to visualize")
             return
             
-        # Plot average processing time
+        # Plot processing time percentiles
         names = list(self.results.keys())
-        avg_times = [self.results[name]['avg_processing_time'] for name in names]
         hits = [self.results[name]['flow_table_hits'] for name in names]
         misses = [self.results[name]['flow_table_misses'] for name in names]
         
         # Create figure with 2 subplots
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
         
-        # Plot average processing time
-        ax1.bar(names, avg_times)
-        ax1.set_title('Average Packet Processing Time')
-        ax1.set_ylabel('Time (ms)')
+        # Plot processing time percentiles
+        plot_latency_percentiles(ax1, names, [self.results[name] for name in names])
+        ax1.set_title('Packet Processing Time Percentiles')
         ax1.set_xlabel('Controller')
         
         # Plot hit/miss ratio
@@ -329,11 +5126,11 @@ class SDNBenchmark:
         
         plt.tight_layout()
         plt.savefig('sdn_benchmark_results.png')
-        print("Results visualized and saved to 'sdn_benchmark_results.png'")
+        logger.info("Results visualized and saved to 'sdn_benchmark_results.png'")
 
 # Function to implement different SDN architectures
 def sdn_architectures():
-    print("Different SDN Architectures")
+    logger.info("Different SDN Architectures")
     
     # Create an openflow controller
     controller_openflow = SDNController("OpenFlow-Controller", "OpenFlow")
@@ -377,8 +5174,8 @@ def sdn_architectures():
     return controller_openflow, controller_p4
 
 # Function to compare two SDN controllers
-def compare_sdn_controllers(controller1, controller2):
-    print("SDN Controller Comparison")
+def compare_sdn_controllers(controller1, controller2, parallel=False):
+    logger.info("SDN Controller Comparison")
     
     # Create benchmark class
     benchmark = SDNBenchmark()
@@ -388,17 +5185,15 @@ def compare_sdn_controllers(controller1, controller2):
     benchmark.add_controller(controller2)
     
     # Run benchmark
-    benchmark.run_benchmark()
+    benchmark.run_benchmark(parallel=parallel)
     
     # Visualize results
     benchmark.visualize_results()
     
     return benchmark
 
-# Function to evaluate the network performance
-def evaluate_network_performance(controller):
-    print("SDN Network Performance Evaluation")
-    
+# Function to generate the traffic patterns used to evaluate network performance
+def generate_traffic_patterns():
     # Generate different types of traffic patterns
     traffic_patterns = {
         "web_heavy": [],  # 70% web traffic
@@ -447,51 +5242,43 @@ def evaluate_network_performance(controller):
             'size': random.randint(1, 1500) * 1024  # Large packets
         })
     
+    return traffic_patterns
+
+# Function to evaluate the network performance
+# With parallel=True every traffic pattern runs in its own process on a copy of the
+# controller, so patterns no longer see the rules learned by the patterns before them
+def evaluate_network_performance(controller, parallel=False, max_workers=None):
+    logger.info("SDN Network Performance Evaluation")
+    
+    traffic_patterns = generate_traffic_patterns()
+    
     # Process each traffic pattern and collect performance data
     results = {}
-    for pattern_name, traffic in traffic_patterns.items():
-        print(f"\nTesting with {pattern_name} traffic pattern...")
-        
-        # Reset performance metrics
-        controller.performance_metrics = {
-            'packet_processing_time': [],
-            'flow_table_hits': 0,
-            'flow_table_misses': 0,
-            'controller_requests': 0
-        }
-        
-        # Process traffic
-        for packet in traffic:
-            controller.process_packet("sw1", packet)
-        
-        # Store results
-        if controller.performance_metrics['packet_processing_time']:
-            avg_time = sum(controller.performance_metrics['packet_processing_time']) / len(controller.performance_metrics['packet_processing_time'])
-        else:
-            avg_time = 0
-            
-        results[pattern_name] = {
-            'avg_processing_time': avg_time,
-            'flow_table_hits': controller.performance_metrics['flow_table_hits'],
-            'flow_table_misses': controller.performance_metrics['flow_table_misses'],
-            'controller_requests': controller.performance_metrics['controller_requests']
-        }
-        
-        print(controller.get_performance_report())
+    if parallel:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {pattern_name: executor.submit(_pattern_worker, controller, traffic, "sw1")
+                       for pattern_name, traffic in traffic_patterns.items()}
+            for pattern_name, future in futures.items():
+                logger.info("\nTesting with %s traffic pattern...", pattern_name)
+                results[pattern_name], report = future.result()
+                logger.info(report)
+    else:
+        for pattern_name, traffic in traffic_patterns.items():
+            logger.info("\nTesting with %s traffic pattern...", pattern_name)
+            results[pattern_name], report = _pattern_worker(controller, traffic, "sw1")
+            logger.info(report)
     
     # Visualize performance results
     patterns = list(results.keys())
-    avg_times = [results[pattern]['avg_processing_time'] for pattern in patterns]
     hits = [results[pattern]['flow_table_hits'] for pattern in patterns]
     misses = [results[pattern]['flow_table_misses'] for pattern in patterns]
     
     # Create figure with 2 subplots
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
     
-    # Plot average processing time
-    ax1.bar(patterns, avg_times)
-    ax1.set_title('Average Packet Processing Time by Traffic Pattern')
-    ax1.set_ylabel('Time (ms)')
+    # Plot processing time percentiles
+    plot_latency_percentiles(ax1, patterns, [results[pattern] for pattern in patterns])
+    ax1.set_title('Packet Processing Time Percentiles by Traffic Pattern')
     ax1.set_xlabel('Traffic Pattern')
     
     # Plot hit/miss ratio
@@ -508,14 +5295,1172 @@ def evaluate_network_performance(controller):
     
     plt.tight_layout()
     plt.savefig('sdn_performance_results.png')
-    print("Performance results visualized and saved to 'sdn_performance_results.png'")
+    logger.info("Performance results visualized and saved to 'sdn_performance_results.png'")
     
     return results
 
+# Function to evaluate every (controller, traffic pattern) pair in its own worker process
+# Each pair starts from a copy of the controller's current state; the controllers are unchanged
+def compare_traffic_patterns(controllers, max_workers=None):
+    logger.info("SDN Traffic Pattern Comparison")
+
+    traffic_patterns = generate_traffic_patterns()
+
+    results = defaultdict(dict)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for controller in controllers:
+            for pattern_name, traffic in traffic_patterns.items():
+                futures[(controller.name, pattern_name)] = executor.submit(
+                    _pattern_worker, controller, traffic, "sw1")
+        for (name, pattern_name), future in futures.items():
+            logger.info("\nTesting %s with %s traffic pattern...", name, pattern_name)
+            results[name][pattern_name], report = future.result()
+            logger.info(report)
+
+    return dict(results)
+
+
+# Function to replay benchmark traffic through an asynchronous control channel
+# With interval=0 every packet arrives at once, which models a miss storm
+def run_control_channel_benchmark(controller, traffic=None, switch_id="sw1", rtt=0.001,
+                                  queue_size=1024, batch_size=64, interval=0.0):
+    logger.info("Asynchronous Control Channel Benchmark")
+
+    if traffic is None:
+        traffic = SDNBenchmark().generate_test_traffic()
+
+    channel = AsyncControlChannel(controller, rtt=rtt, queue_size=queue_size, batch_size=batch_size)
+
+    async def replay():
+        await channel.start()
+        results = await channel.replay(switch_id, traffic, interval)
+        await channel.stop()
+        return results
+
+    results = asyncio.run(replay())
+    logger.info(channel.get_report())
+    logger.info(controller.get_performance_report())
+    return channel, results
+
+# Function to stream a pcap or binary trace file through a controller with constant memory
+# Packets go through process_packet one at a time, or through process_batch with batch_size
+def replay_trace(controller, path, switch_id="sw1", batch_size=None):
+    logger.info("Replaying trace %s", path)
+
+    with TraceReader(path) as reader:
+        if batch_size:
+            for batch in reader.batches(batch_size):
+                controller.process_batch(switch_id, batch)
+        else:
+            run_controller_traffic(controller, reader, switch_id)
+
+    logger.info(controller.get_performance_report())
+    return controller
+
+# Function to measure flow table lookup latency as the number of installed rules grows
+def benchmark_flow_table_lookup(rule_counts=(10, 100, 1000, 10000, 100000), num_lookups=2000,
+                                classifiers=('linear', 'tuple_space')):
+    logger.info("Flow Table Lookup Scaling Benchmark")
+
+    results = {name: [] for name in classifiers}
+    for num_rules in rule_counts:
+        # Reactive style rules: one exact (src_ip, dst_port) rule per learned flow
+        rules = []
+        for i in range(num_rules):
+            src_ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+            rules.append(({'src_ip': src_ip, 'dst_port': random.choice([80, 443, 53])},
+                          {'forward_port': 2}))
+
+        # 90% of lookups hit an installed rule, the rest miss the table entirely
+        packets = []
+        for i in range(num_lookups):
+            if random.random() < 0.9:
+                match, _ = random.choice(rules)
+                packets.append({'src_ip': match['src_ip'], 'dst_ip': "10.0.0.1",
+                                'src_port': random.randint(1024, 65535),
+                                'dst_port': match['dst_port'], 'protocol': 'TCP'})
+            else:
+                packets.append({'src_ip': "192.168.0.1", 'dst_ip': "10.0.0.1",
+                                'src_port': random.randint(1024, 65535),
+                                'dst_port': 22, 'protocol': 'TCP'})
+
+        for name in classifiers:
+            classifier = CLASSIFIERS[name]()
+            for match, action in rules:
+                classifier.insert(FlowRule(match, action))
+
+            # Keep the linear scan affordable on very large tables
+            sample = packets
+            if name == 'linear':
+                sample = packets[:max(20, min(num_lookups, 2000000 // num_rules))]
+
+            start_time = time.perf_counter()
+            for packet in sample:
+                classifier.lookup(packet)
+            elapsed = time.perf_counter() - start_time
+
+            per_lookup_us = elapsed / len(sample) * 1e6
+            results[name].append(per_lookup_us)
+            logger.info("  %12s | %7s rules | %10.3f us/lookup", name, num_rules, per_lookup_us)
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for name in classifiers:
+        ax.plot(rule_counts, results[name], marker='o', label=name)
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_title('Flow Table Lookup Latency vs Rule Count')
+    ax.set_xlabel('Installed rules')
+    ax.set_ylabel('Time per lookup (us)')
+    ax.legend()
+
+    plt.tight_layout()
+    plt.savefig('sdn_lookup_scaling.png')
+    logger.info("Lookup scaling results saved to 'sdn_lookup_scaling.png'")
+
+    return results
+
+
+# Function to compare lookups through compiled flow tables with the interpreted classifiers
+# Tables mix a few proactive rules of different shapes, prefix rules and reactive exact rules
+def benchmark_rule_compilation(rule_counts=(10, 100, 1000, 10000, 100000), num_lookups=20000,
+                               classifiers=('linear', 'tuple_space', 'compiled')):
+    logger.info("Flow Table Compilation Benchmark")
+
+    proactive = [{'protocol': 'UDP', 'dst_port': 53}, {'dst_port': 22},
+                 {'src_ip': "10.0.0.10", 'src_port': 2049}, {'dst_port': (6000, 6100)},
+                 {'src_ip': "172.16.0.0/12", 'protocol': 'TCP'}]
+    results = {name: [] for name in classifiers}
+    results['compile_ms'] = []
+    for num_rules in rule_counts:
+        matches = proactive[:num_rules]
+        for i in range(num_rules - len(matches)):
+            if i % 10 == 0:
+                matches.append({'src_ip': f"192.{(i >> 8) & 255}.{i & 255}.0/24", 'dst_port': 80})
+            else:
+                matches.append({'src_ip': f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+                                'dst_port': random.choice([80, 443, 53])})
+        rules = [FlowRule(match, {'forward_port': 2}) for match in matches]
+
+        # Packets of the rules' flows, plus 10% that miss every rule
+        packets = []
+        for _ in range(num_lookups):
+            packet = {'src_ip': "192.168.0.1", 'dst_ip': "10.0.0.1",
+                      'src_port': random.randint(1024, 65535), 'dst_port': 8080, 'protocol': 'TCP'}
+            if random.random() < 0.9:
+                for field, value in random.choice(matches).items():
+                    if field in IP_FIELDS and '/' in value:
+                        value = value.split('/')[0][:-1] + "7"
+                    elif field in PORT_FIELDS and isinstance(value, tuple):
+                        value = value[0]
+                    packet[field] = value
+            packets.append(packet)
+
+        expected = None
+        for name in classifiers:
+            classifier = CLASSIFIERS[name]()
+            for rule in rules:
+                classifier.insert(rule)
+            if name == 'compiled':
+                start_time = time.perf_counter()
+                classifier.compile()
+                compile_ms = (time.perf_counter() - start_time) * 1000
+                results['compile_ms'].append(compile_ms)
+
+            # Keep the linear scan affordable on very large tables
+            sample = packets
+            if name == 'linear':
+                sample = packets[:max(20, min(num_lookups, 2000000 // num_rules))]
+
+            start_time = time.perf_counter()
+            found = [classifier.lookup(packet) for packet in sample]
+            elapsed = time.perf_counter() - start_time
+            checked = min(len(found), len(expected or found))
+            if expected is not None and found[:checked] != expected[:checked]:
+                logger.warning("  %s returned different rules than %s", name, classifiers[0])
+            if expected is None or len(found) > len(expected):
+                expected = found
+
+            per_lookup_us = elapsed / len(sample) * 1e6
+            results[name].append(per_lookup_us)
+            if name == 'compiled':
+                logger.info("  %12s | %7s rules | %10.3f us/lookup | compiled in %.1f ms", name,
+                            num_rules, per_lookup_us, compile_ms)
+            else:
+                logger.info("  %12s | %7s rules | %10.3f us/lookup", name, num_rules,
+                            per_lookup_us)
+
+    return results
+
+
+# Speedup of process_batch over process_packet the batched path is meant to reach. Batches of
+# 10000 packets measure about 5-7x, missing it: misses still go to the controller one packet
+# at a time, and every packet gets its own result dict, as process_packet returns
+BATCH_SPEEDUP_TARGET = 10.0
+
+
+# Function to compare per-packet and batched processing throughput on the benchmark traffic
+# A speedup below BATCH_SPEEDUP_TARGET is reported as missing it
+def benchmark_batch_processing(num_packets=50000, batch_size=10000, switch_id="sw1"):
+    logger.info("Batch Packet Processing Benchmark")
+
+    traffic = SDNBenchmark().generate_test_traffic(num_packets)
+    random.shuffle(traffic)
+    batches = [packets_to_batch(traffic[i:i + batch_size])
+               for i in range(0, len(traffic), batch_size)]
+
+    results = {}
+    for scalar_controller, batch_controller in zip(sdn_architectures(), sdn_architectures()):
+        # Warm up both controllers so the reactive rules are learned before timing
+        for packet in traffic:
+            scalar_controller.process_packet(switch_id, dict(packet))
+        for batch in batches:
+            batch_controller.process_batch(switch_id, dict(batch))
+
+        start_time = time.perf_counter()
+        for packet in traffic:
+            scalar_controller.process_packet(switch_id, dict(packet))
+        scalar_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for batch in batches:
+            batch_controller.process_batch(switch_id, dict(batch))
+        batch_time = time.perf_counter() - start_time
+
+        # Both paths must learn the same rules and count the same hits
+        scalar_counters = [(rule.match, rule.counter)
+                           for rule in scalar_controller.flow_tables[switch_id]]
+        batch_counters = [(rule.match, rule.counter)
+                          for rule in batch_controller.flow_tables[switch_id]]
+        consistent = scalar_counters == batch_counters
+
+        results[scalar_controller.name] = {
+            'scalar_packets_per_second': len(traffic) / scalar_time,
+            'batch_packets_per_second': len(traffic) / batch_time,
+            'speedup': scalar_time / batch_time,
+            'meets_target': scalar_time / batch_time >= BATCH_SPEEDUP_TARGET,
+            'consistent': consistent
+        }
+        logger.info("  %s: scalar %.0f pkt/s, batch %.0f pkt/s (%.1fx), results match: %s",
+                    scalar_controller.name, len(traffic) / scalar_time, len(traffic) / batch_time,
+                    scalar_time / batch_time, consistent)
+        if not results[scalar_controller.name]['meets_target']:
+            logger.warning("  %s: batch speedup %.1fx misses the %.0fx target",
+                           scalar_controller.name, scalar_time / batch_time, BATCH_SPEEDUP_TARGET)
+
+    return results
+
+
+# Function to compare reactive rules installed per source address with rules aggregated
+# by source prefix, on the same traffic from hosts spread over a few subnets
+def benchmark_rule_aggregation(num_packets=50000, num_hosts=5000, prefix_length=24,
+                               switch_id="sw1"):
+    logger.info("Reactive Rule Aggregation Benchmark")
+
+    hosts = [f"10.{(i // 250) >> 8 & 255}.{(i // 250) & 255}.{i % 250 + 1}"
+             for i in range(num_hosts)]
+    traffic = [{'src_ip': random.choice(hosts), 'dst_ip': "10.255.0.1",
+                'src_port': random.randint(1024, 65535), 'dst_port': random.choice((80, 443, 53, 22)),
+                'protocol': 'TCP'} for _ in range(num_packets)]
+
+    results = {}
+    statuses = {}
+    for label, length in (("per address", None), (f"per /{prefix_length}", prefix_length)):
+        controller = SDNController(f"Reactive-{label}", "OpenFlow", reactive_prefix_length=length)
+        controller.start()
+        controller.add_switch(switch_id, 4)
+
+        start_time = time.perf_counter()
+        statuses[label] = [controller.process_packet(switch_id, dict(packet))['status']
+                           for packet in traffic]
+        elapsed = time.perf_counter() - start_time
+
+        metrics = controller.performance_metrics
+        results[label] = {
+            'rules': len(controller.flow_tables[switch_id]),
+            'controller_requests': metrics['controller_requests'],
+            'packets_per_second': len(traffic) / elapsed
+        }
+        logger.info("  %s: %s rules, %s controller requests, %.0f pkt/s", label,
+                    results[label]['rules'], results[label]['controller_requests'],
+                    results[label]['packets_per_second'])
+
+    exact, aggregated = results.values()
+    results['rule_reduction'] = 1 - aggregated['rules'] / max(exact['rules'], 1)
+    results['request_reduction'] = 1 - aggregated['controller_requests'] / \
+        max(exact['controller_requests'], 1)
+    results['consistent'] = len(set(map(tuple, statuses.values()))) == 1
+    logger.info("  Aggregation removes %.1f%% of the rules and %.1f%% of the controller "
+                "requests, forwarding decisions match: %s", results['rule_reduction'] * 100,
+                results['request_reduction'] * 100, results['consistent'])
+    return results
+
+
+# Function to measure the lookup work compaction saves on a table where half of the per-host
+# rules sit under earlier per-subnet rules, for every classifier: lookup time, and rules a
+# linear scan compares per packet, before and after compact()
+def benchmark_rule_compaction(num_rules=10000, num_subnets=32, num_packets=5000,
+                              switch_id="sw1"):
+    logger.info("Rule Compaction Benchmark")
+
+    # The first half of the subnets is covered by one rule each, installed up front
+    covers = [({'src_ip': f"10.{subnet}.0.0/16"}, {'forward_port': 1})
+              for subnet in range(num_subnets // 2)]
+    hosts = [(f"10.{i % num_subnets}.{(i // num_subnets) >> 8 & 255}.{(i // num_subnets) & 255}",
+              (80, 443)[i % 2]) for i in range(num_rules)]
+    # Covered hosts forwarding like their subnet are redundant, the others shadowed
+    specifics = [({'src_ip': address, 'dst_port': port, 'protocol': 'TCP'},
+                  {'forward_port': 1 + i // num_subnets % 2})
+                 for i, (address, port) in enumerate(hosts)]
+    rng = random.Random(1)
+    traffic = []
+    for _ in range(num_packets):
+        address, port = rng.choice(hosts)
+        traffic.append({'src_ip': address, 'dst_ip': "10.255.0.1", 'src_port': 1024,
+                        'dst_port': port if rng.random() < 0.9 else 22, 'protocol': 'TCP'})
+
+    results = {}
+    for classifier in CLASSIFIERS:
+        controller = SDNController(f"Compaction-{classifier}", "OpenFlow", classifier=classifier)
+        controller.start()
+        controller.add_switch(switch_id, 4)
+        for match, action in covers + specifics:
+            controller.add_flow_rule(switch_id, match, action)
+
+        runs = []
+        for _ in range(2):
+            rules = controller.flow_tables[switch_id]
+            positions = {id(rule): position for position, rule in enumerate(rules)}
+            classifier_index = controller.classifiers[switch_id]
+            classifier_index.lookup(traffic[0])  # compiles the table
+            start_time = time.perf_counter()
+            matched = [classifier_index.lookup(packet) for packet in traffic]
+            elapsed = time.perf_counter() - start_time
+            # A linear scan stops at the matched rule and goes through the whole table on a miss
+            compared = sum(positions[id(rule)] + 1 if rule is not None else len(rules)
+                           for rule in matched)
+            runs.append({
+                'rules': len(rules),
+                'lookup_us': elapsed / len(traffic) * 1e6,
+                'rules_compared': compared / len(traffic),
+                'actions': [rule.action if rule is not None else None for rule in matched]
+            })
+            if len(runs) == 1:
+                report = controller.compact(switch_id)
+
+        before, after = runs
+        results[classifier] = {
+            'rules_before': before['rules'],
+            'rules_after': after['rules'],
+            'shadowed': report['shadowed'],
+            'redundant': report['redundant'],
+            'lookup_us_before': before['lookup_us'],
+            'lookup_us_after': after['lookup_us'],
+            'rules_compared_before': before['rules_compared'],
+            'rules_compared_after': after['rules_compared'],
+            'consistent': before['actions'] == after['actions']
+        }
+        logger.info("  %11s: %s -> %s rules (%s shadowed, %s redundant), %.2f -> %.2f us/lookup, "
+                    "%.0f -> %.0f rules compared by a linear scan, forwarding unchanged: %s",
+                    classifier, before['rules'], after['rules'], report['shadowed'],
+                    report['redundant'], before['lookup_us'], after['lookup_us'],
+                    before['rules_compared'], after['rules_compared'],
+                    results[classifier]['consistent'])
+    return results
+
+
+# Function to compare miss policy install granularities and proactive installation on the
+# SDNBenchmark traffic mixes; every policy must reach the same forwarding decisions
+def benchmark_miss_policies(num_packets=1000, switch_id="sw1"):
+    logger.info("Miss Policy Benchmark")
+
+    def with_install(install):
+        return [dict(rule, install=install) for rule in DEFAULT_MISS_POLICY['rules']]
+
+    policies = {
+        'exact': ({}, False),
+        'per port': ({'miss_policy': MissPolicy(with_install(INSTALL_PORT))}, False),
+        'per /24': ({'miss_policy': MissPolicy(with_install(INSTALL_SUBNET))}, False),
+        'proactive': ({'miss_policy': MissPolicy(with_install(INSTALL_PORT))}, True),
+        # The default drop spelled out as a last, catch-all entry so it is installed too
+        'proactive+drop': ({'miss_policy': MissPolicy(with_install(INSTALL_PORT) + [
+            {'match': {}, 'action': {'drop': True}, 'install': INSTALL_PORT}])}, True)
+    }
+    traffic_mixes = {'benchmark': SDNBenchmark().generate_test_traffic(num_packets)}
+    traffic_mixes.update(generate_traffic_patterns())
+
+    results = {}
+    for mix, traffic in traffic_mixes.items():
+        results[mix] = {}
+        decisions = set()
+        for label, (options, proactive) in policies.items():
+            controller = SDNController(f"Policy-{label}", "OpenFlow", proactive=proactive,
+                                       **options)
+            controller.start()
+            controller.add_switch(switch_id, 4)
+            statuses = tuple(str(controller.process_packet(switch_id, dict(packet)))
+                             for packet in traffic)
+            decisions.add(statuses)
+
+            latency = controller.performance_metrics['packet_processing_time'].summary()
+            results[mix][label] = {
+                'controller_requests': controller.performance_metrics['controller_requests'],
+                'rules': len(controller.flow_tables[switch_id]),
+                'avg_latency_ms': latency['avg_processing_time'],
+                'p99_latency_ms': latency['p99_processing_time']
+            }
+            logger.info("  %10s | %14s | %5s controller requests | %4s rules | "
+                        "avg %.4f ms, p99 %.4f ms", mix, label,
+                        results[mix][label]['controller_requests'],
+                        results[mix][label]['rules'], latency['avg_processing_time'],
+                        latency['p99_processing_time'])
+        results[mix]['consistent'] = len(decisions) == 1
+        if len(decisions) != 1:
+            logger.warning("  %s: policies reached different forwarding decisions", mix)
+
+    return results
+
+
+# Function to measure how controller request throughput grows with the number of cluster
+# workers, and how many switches move when one more worker joins
+# Every packet starts a new flow, so each one is a controller request and a rule install
+def benchmark_cluster_scaling(worker_counts=(1, 2, 4), num_switches=64, num_packets=100000,
+                              chunk_size=1024):
+    logger.info("Controller Cluster Scaling Benchmark (%s CPUs)", os.cpu_count())
+
+    switch_ids = [f"sw{i}" for i in range(num_switches)]
+    traffic = [(random.choice(switch_ids),
+                {'src_ip': f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+                 'dst_ip': "192.168.0.1", 'src_port': random.randint(1024, 65535),
+                 'dst_port': random.choice([80, 443, 53]), 'protocol': 'TCP'})
+               for i in range(num_packets)]
+
+    # A single controller in this process, without any IPC, as the reference
+    controller = SDNController("Cluster-reference", "OpenFlow")
+    controller.start()
+    for switch_id in switch_ids:
+        controller.add_switch(switch_id, 4)
+    start_time = time.perf_counter()
+    for switch_id, packet in traffic:
+        controller.process_packet(switch_id, dict(packet))
+    elapsed = time.perf_counter() - start_time
+    reference = controller.performance_metrics['controller_requests'] / elapsed
+    logger.info("  in-process | %10.0f packets/s | %10.0f controller requests/s",
+                num_packets / elapsed, reference)
+
+    results = {'reference_requests_per_second': reference, 'workers': list(worker_counts),
+               'packets_per_second': [], 'requests_per_second': [], 'switches_moved': []}
+    for num_workers in worker_counts:
+        with ControllerCluster(f"Cluster-{num_workers}", num_workers,
+                               chunk_size=chunk_size) as cluster:
+            for switch_id in switch_ids:
+                cluster.add_switch(switch_id, 4)
+            start_time = time.perf_counter()
+            cluster.process_packets(traffic)
+            elapsed = time.perf_counter() - start_time
+            requests = cluster.get_performance_metrics()['controller_requests']
+            cluster.add_worker()
+            moved = cluster.stats['switches_moved']
+
+        results['packets_per_second'].append(num_packets / elapsed)
+        results['requests_per_second'].append(requests / elapsed)
+        results['switches_moved'].append(moved)
+        logger.info("  %2s workers | %10.0f packets/s | %10.0f controller requests/s | %s of %s "
+                    "switches moved when worker %s joined (ideal %.1f)", num_workers,
+                    num_packets / elapsed, requests / elapsed, moved, num_switches, num_workers + 1,
+                    num_switches / (num_workers + 1))
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.plot(worker_counts, results['requests_per_second'], marker='o', label='Cluster')
+    ax.axhline(reference, color='gray', linestyle='--', label='Single controller, in-process')
+    ax.set_title('Controller Request Throughput vs Cluster Workers')
+    ax.set_xlabel('Workers')
+    ax.set_ylabel('Controller requests per second')
+    ax.legend()
+
+    plt.tight_layout()
+    plt.savefig('sdn_cluster_scaling.png')
+    logger.info("Cluster scaling results saved to 'sdn_cluster_scaling.png'")
+
+    return results
+
+
+# Function to measure how fast TrafficGenerator streams packets, as columnar batches and as
+# packet dicts, and the most memory a columnar pass holds at once
+def benchmark_traffic_generation(num_packets=10000000, dict_packets=1000000, seed=1):
+    logger.info("Traffic Generator Benchmark")
+
+    models = {
+        'zipf population': {},
+        'flow arrivals': {'flow_rate': 20000, 'flow_duration': 0.5}
+    }
+    results = {}
+    for label, options in models.items():
+        generator = TrafficGenerator(num_packets, seed=seed, **options)
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        generated = sum(len(batch['src_ip']) for batch in generator.batches())
+        batch_elapsed = time.perf_counter() - start_time
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        flows = generator.flows_started
+
+        generator = TrafficGenerator(dict_packets, seed=seed, **options)
+        start_time = time.perf_counter()
+        for _ in generator:
+            pass
+        dict_elapsed = time.perf_counter() - start_time
+
+        results[label] = {
+            'packets': generated,
+            'flows': flows,
+            'batch_packets_per_second': generated / batch_elapsed,
+            'dict_packets_per_second': dict_packets / dict_elapsed,
+            'peak_memory_mb': peak_memory / 2 ** 20
+        }
+        logger.info("  %15s | %s packets in %.2f s | %12.0f packets/s as batches | %10.0f "
+                    "packets/s as dicts | peak %.1f MB", label, generated, batch_elapsed,
+                    generated / batch_elapsed, dict_packets / dict_elapsed, peak_memory / 2 ** 20)
+
+    return results
+
+
+# Function to check the concurrent datapath under load: packet threads process traffic while
+# a writer thread keeps installing and removing rules that no packet matches. Each packet's
+# result must then be the same as in a sequential run, every flow must be learned exactly
+# once however many threads missed on it together, and the merged counters must add up
+def stress_test_concurrency(num_threads=8, num_packets=100000, num_switches=4, num_flows=5000,
+                            writer_rules=2000, seed=1):
+    logger.info("Concurrent Datapath Stress Test (%s threads)", num_threads)
+
+    switch_ids = [f"sw{i + 1}" for i in range(num_switches)]
+    generator = TrafficGenerator(num_packets, seed=seed, num_flows=num_flows)
+    traffic = [(switch_ids[hash((packet['src_ip'], packet['src_port'])) % num_switches], packet)
+               for packet in generator]
+
+    def build_controller():
+        controller = SDNController("Stress-Controller", "OpenFlow")
+        controller.start()
+        for switch_id in switch_ids:
+            controller.add_switch(switch_id, 4)
+        return controller
+
+    reference = build_controller()
+    expected = [reference.process_packet(switch_id, dict(packet)) for switch_id, packet in traffic]
+
+    controller = build_controller()
+    controller.enable_concurrency()
+    writer_stats = {'installed': 0, 'removed': 0}
+
+    # Rules on ports the traffic never uses, from a separate thread
+    def write_rules():
+        rng = random.Random(seed)
+        installed = []
+        while writer_stats['installed'] < writer_rules:
+            switch_id = rng.choice(switch_ids)
+            if installed and rng.random() < 0.3:
+                controller.remove_flow_rule(*installed.pop(rng.randrange(len(installed))))
+                writer_stats['removed'] += 1
+                continue
+            match = {'src_ip': f"172.16.{rng.randint(0, 255)}.0/24",
+                     'dst_port': (60000 + rng.randint(0, 100), 60200)}
+            # Held across both calls so no learned rule can be appended in between
+            with controller.write_lock:
+                if controller.add_flow_rule(switch_id, match, {'drop': True}):
+                    installed.append((switch_id, controller.flow_tables[switch_id][-1]))
+                    writer_stats['installed'] += 1
+
+    writer = threading.Thread(target=write_rules)
+    start_time = time.perf_counter()
+    writer.start()
+    try:
+        results = run_concurrent_traffic(controller, traffic, num_threads, chunk_size=256)
+    finally:
+        writer.join()
+    elapsed = time.perf_counter() - start_time
+
+    # Learned rules of every switch in installation order, with their hit counters
+    def learned_rules(controller):
+        return {switch_id: [(repr(rule.match), rule.counter) for rule in rules
+                            if rule.action != {'drop': True}]
+                for switch_id, rules in controller.flow_tables.items()}
+
+    metrics = controller.merge_thread_stats()
+    learned = learned_rules(controller)
+    reference_learned = learned_rules(reference)
+    checks = {
+        'results_match': results == expected,
+        'flows_learned_once': all(sorted(match for match, _ in learned[switch_id]) ==
+                                  sorted(match for match, _ in reference_learned[switch_id])
+                                  for switch_id in switch_ids),
+        'rule_counters_match': all(sorted(learned[switch_id]) == sorted(reference_learned[switch_id])
+                                   for switch_id in switch_ids),
+        'hits_and_misses_add_up': (metrics['flow_table_hits'] + metrics['flow_table_misses']
+                                   == num_packets),
+        'controller_requests_match': (metrics['controller_requests'] ==
+                                      reference.performance_metrics['controller_requests']),
+        'packet_counts_match': (sum(switch['packet_count'] for switch in controller.switches.values())
+                                == num_packets)
+    }
+    for check, passed in checks.items():
+        if passed:
+            logger.info("  %s: ok", check)
+        else:
+            logger.error("  %s: FAILED", check)
+    logger.info("  %.0f packets/s with %s rules installed and %s removed concurrently",
+                num_packets / elapsed, writer_stats['installed'], writer_stats['removed'])
+    return {'passed': all(checks.values()), 'checks': checks,
+            'packets_per_second': num_packets / elapsed, **writer_stats}
+
+
+# Function to measure packet throughput of the concurrent datapath as threads are added
+# Threads only run Python code in parallel on free-threaded builds; with the GIL the curve
+# shows the cost of the concurrent datapath instead
+def benchmark_concurrent_datapath(thread_counts=(1, 2, 4, 8), num_packets=200000, num_flows=2000,
+                                  seed=1):
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    logger.info("Concurrent Datapath Benchmark (%s CPUs, GIL %s)", os.cpu_count(),
+                'enabled' if gil_enabled else 'disabled')
+
+    traffic = [("sw1", packet) for packet in
+               TrafficGenerator(num_packets, seed=seed, num_flows=num_flows)]
+    results = {'threads': list(thread_counts), 'packets_per_second': []}
+    for num_threads in thread_counts:
+        controller = SDNController("Concurrent-Controller", "OpenFlow")
+        controller.start()
+        controller.add_switch("sw1", 4)
+        start_time = time.perf_counter()
+        run_concurrent_traffic(controller, traffic, num_threads)
+        elapsed = time.perf_counter() - start_time
+        results['packets_per_second'].append(num_packets / elapsed)
+        logger.info("  %2s threads | %10.0f packets/s | %s controller requests", num_threads,
+                    num_packets / elapsed, controller.performance_metrics['controller_requests'])
+
+    controller = SDNController("Sequential-Controller", "OpenFlow")
+    controller.start()
+    controller.add_switch("sw1", 4)
+    start_time = time.perf_counter()
+    for switch_id, packet in traffic:
+        controller.process_packet(switch_id, dict(packet))
+    elapsed = time.perf_counter() - start_time
+    results['sequential_packets_per_second'] = num_packets / elapsed
+    logger.info("  sequential | %10.0f packets/s", num_packets / elapsed)
+    return results
+
+
+# Function to build a k-ary fat tree on a controller: (k/2)^2 core switches and k pods of
+# k/2 aggregation and k/2 edge switches, with k/2 hosts behind every edge switch
+# Returns the host addresses; links are added in both directions
+def build_fat_tree(controller, k=4):
+    half = k // 2
+    hosts = []
+    cores = [f"core{i}" for i in range(half * half)]
+    for core in cores:
+        controller.add_switch(core, k)
+    for pod in range(k):
+        aggregations = [f"agg{pod}_{i}" for i in range(half)]
+        edges = [f"edge{pod}_{i}" for i in range(half)]
+        for switch_id in aggregations + edges:
+            controller.add_switch(switch_id, k)
+        for i, aggregation in enumerate(aggregations):
+            # Aggregation switch i of every pod connects to core group i
+            for core in cores[i * half:(i + 1) * half]:
+                controller.add_connection(aggregation, core)
+                controller.add_connection(core, aggregation)
+            for edge in edges:
+                controller.add_connection(aggregation, edge)
+                controller.add_connection(edge, aggregation)
+        for i, edge in enumerate(edges):
+            for host in range(half):
+                host_ip = f"10.{pod}.{i}.{host + 2}"
+                controller.add_host(edge, host_ip)
+                hosts.append(host_ip)
+    logger.info("Fat tree (k=%s) built: %s switches, %s hosts", k, len(controller.switches),
+                len(hosts))
+    return hosts
+
+
+# Function to measure multi-hop forwarding over a fat tree, including a link failure that
+# is absorbed by patching the cached shortest paths instead of recomputing them
+def benchmark_fat_tree_forwarding(k=16, num_packets=20000):
+    logger.info("Fat Tree Forwarding Benchmark")
+
+    controller = SDNController("FatTree-Controller", "OpenFlow")
+    controller.start()
+    hosts = build_fat_tree(controller, k)
+    edges = sorted(set(controller.host_locations.values()))
+
+    start_time = time.perf_counter()
+    controller.paths.precompute(edges)
+    precompute_time = time.perf_counter() - start_time
+
+    traffic = []
+    for _ in range(num_packets):
+        src_ip, dst_ip = random.sample(hosts, 2)
+        traffic.append({'src_ip': src_ip, 'dst_ip': dst_ip,
+                        'src_port': random.randint(1024, 65535),
+                        'dst_port': random.choice([80, 443, 53]), 'protocol': 'TCP'})
+
+    start_time = time.perf_counter()
+    results = [controller.forward_packet(controller.host_locations[packet['src_ip']], packet)
+               for packet in traffic]
+    forward_time = time.perf_counter() - start_time
+    delivered = [result for result in results if result['status'] == 'delivered']
+    average_hops = sum(result['hops'] for result in delivered) / max(len(delivered), 1)
+
+    # Fail both directions of one aggregation-core link
+    updates = controller.paths.stats['nodes_updated']
+    start_time = time.perf_counter()
+    controller.remove_connection("agg0_0", "core0")
+    controller.remove_connection("core0", "agg0_0")
+    update_time = time.perf_counter() - start_time
+    nodes_updated = controller.paths.stats['nodes_updated'] - updates
+
+    # A full recomputation must agree with the patched trees
+    patched = {destination: controller.paths.trees[destination][0] for destination in edges}
+    controller.paths.trees.clear()
+    start_time = time.perf_counter()
+    controller.paths.precompute(edges)
+    rebuild_time = time.perf_counter() - start_time
+    consistent = all(controller.paths.trees[destination][0] == patched[destination]
+                     for destination in edges)
+
+    logger.info("  Shortest path trees for %s edge switches: %.1f ms", len(edges),
+                precompute_time * 1000)
+    logger.info("  Forwarded %s packets: %.0f pkt/s, %s delivered, %.2f hops on average",
+                len(traffic), len(traffic) / forward_time, len(delivered), average_hops)
+    logger.info("  Link failure: %.2f ms incremental (%s node updates) vs %.1f ms full "
+                "recomputation, results match: %s", update_time * 1000, nodes_updated,
+                rebuild_time * 1000, consistent)
+
+    return {
+        'switches': len(controller.switches),
+        'precompute_time': precompute_time,
+        'packets_per_second': len(traffic) / forward_time,
+        'delivered': len(delivered),
+        'average_hops': average_hops,
+        'incremental_update_time': update_time,
+        'full_recompute_time': rebuild_time,
+        'consistent': consistent
+    }
+
+
+# Function to generate Poisson traffic for the network simulator
+# Packets belong to num_flows flows between random hosts with the web/DNS/backup mix of the
+# benchmark traffic; yields (time, ingress switch, packet)
+def generate_timed_traffic(controller, hosts, num_packets, rate, num_flows=1024):
+    flows = []
+    for _ in range(num_flows):
+        src_ip, dst_ip = random.sample(hosts, 2)
+        kind = random.random()
+        if kind < 0.4:
+            dst_port, size = 80, random.choice([64, 576, 1500])
+        elif kind < 0.7:
+            dst_port, size = 443, random.choice([64, 576, 1500])
+        elif kind < 0.9:
+            dst_port, size = 53, 128
+        else:
+            dst_port, size = 2049, 1500  # Backup traffic, dropped by the default policy
+        packet = {'src_ip': src_ip, 'dst_ip': dst_ip, 'src_port': random.randint(1024, 65535),
+                  'dst_port': dst_port, 'protocol': 'TCP', 'size': size}
+        flows.append((controller.host_locations[src_ip], packet))
+
+    now = 0.0
+    for _ in range(num_packets):
+        now += random.expovariate(rate)
+        switch_id, packet = random.choice(flows)
+        yield now, switch_id, dict(packet)
+
+
+# Function to simulate timed traffic over a fat tree and report throughput, drops and queueing
+# rate is the aggregate packet arrival rate in packets per simulated second
+def run_network_simulation(k=4, num_packets=100000, rate=2e6, latency=1e-5, bandwidth=1e9,
+                           queue_size=64):
+    logger.info("Discrete-Event Network Simulation")
+
+    controller = SDNController("Simulated-Controller", "OpenFlow", microflow_cache_size=4096)
+    controller.start()
+    hosts = build_fat_tree(controller, k)
+
+    simulator = NetworkSimulator(controller, latency=latency, bandwidth=bandwidth,
+                                 queue_size=queue_size)
+    simulator.add_traffic(generate_timed_traffic(controller, hosts, num_packets, rate))
+    simulator.run()
+    logger.info(simulator.get_report())
+    return simulator
+
+
+# Seconds a restore of a million rules should take. Only the lazy restore, which reads the
+# header, meets it; loading every switch misses it, as each rule, its match dict and its
+# classifier entry are still built in Python, about 2-3 us per rule
+RESTORE_TARGET_SECONDS = 1.0
+
+
+# Function to compare a warm restart from a snapshot with relearning rules one at a time
+# A restore or a full load slower than RESTORE_TARGET_SECONDS is reported as missing it
+def benchmark_snapshot_restore(num_rules=1000000, num_switches=100, path='sdn_controller.snapshot'):
+    logger.info("Controller Snapshot Benchmark")
+
+    controller = SDNController("Snapshot-Controller", "OpenFlow")
+    controller.start()
+    switch_ids = [f"sw{i + 1}" for i in range(num_switches)]
+    start_time = time.perf_counter()
+    for switch_id in switch_ids:
+        controller.add_switch(switch_id, 4)
+    for i in range(num_rules):
+        src_ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+        controller.add_flow_rule(switch_ids[i % num_switches],
+                                 {'src_ip': src_ip, 'dst_port': (80, 443, 53)[i % 3]},
+                                 {'forward_port': 2})
+    rebuild_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    controller.save_snapshot(path)
+    save_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    restored = restore_snapshot(path)
+    restore_time = time.perf_counter() - start_time
+
+    # The first packet on a switch loads its flow table and lookup index
+    packet = {'src_ip': "10.0.0.0", 'dst_ip': "10.0.0.1", 'src_port': 1024, 'dst_port': 80,
+              'protocol': 'TCP'}
+    start_time = time.perf_counter()
+    restored.process_packet(switch_ids[0], dict(packet))
+    first_switch_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    restored.flow_tables.loader.load_all()
+    load_all_time = time.perf_counter() - start_time + first_switch_time
+
+    logger.info("  Rebuilding %s rules with add_flow_rule: %.2f s", num_rules, rebuild_time)
+    logger.info("  Snapshot: saved in %.2f s (%.1f MB), restored in %.2f ms", save_time,
+                os.path.getsize(path) / 1e6, restore_time * 1000)
+    logger.info("  First packet on a switch (%s rules): %.1f ms, all switches loaded: %.2f s "
+                "(%.2f us per rule)", num_rules // num_switches, first_switch_time * 1000,
+                load_all_time, load_all_time / max(num_rules, 1) * 1e6)
+    for label, elapsed in (("Restore", restore_time), ("Loading every switch", load_all_time)):
+        if elapsed >= RESTORE_TARGET_SECONDS:
+            logger.warning("  %s of %s rules took %.2f s, missing the %.0f s target", label,
+                           num_rules, elapsed, RESTORE_TARGET_SECONDS)
+
+    return {
+        'rebuild_time': rebuild_time,
+        'save_time': save_time,
+        'restore_time': restore_time,
+        'first_switch_time': first_switch_time,
+        'load_all_time': load_all_time,
+        'restore_meets_target': restore_time < RESTORE_TARGET_SECONDS,
+        'load_all_meets_target': load_all_time < RESTORE_TARGET_SECONDS
+    }
+
+
+# Function to measure the memory taken by installed rules and the time of bulk statistics
+# queries, against the dict every rule used to be and the same figures computed by walking
+# the rules in Python
+def benchmark_flow_stats(num_rules=200000, num_switches=100, num_packets=200000, k=10):
+    logger.info("Flow Statistics Benchmark")
+
+    controller = SDNController("Stats-Controller", "OpenFlow")
+    controller.start()
+    switch_ids = [f"sw{i + 1}" for i in range(num_switches)]
+    for switch_id in switch_ids:
+        controller.add_switch(switch_id, 4)
+    matches = [{'src_ip': f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+                'dst_port': (80, 443, 53)[i % 3]} for i in range(num_rules)]
+    action = {'forward_port': 2}
+
+    # Everything the controller allocates per rule, lookup indexes included
+    gc.collect()
+    tracemalloc.start()
+    for i, match in enumerate(matches):
+        controller.add_flow_rule(switch_ids[i % num_switches], match, action)
+    gc.collect()
+    installed_bytes = tracemalloc.get_traced_memory()[0] / num_rules
+    tracemalloc.stop()
+
+    # The rule itself with its counters, next to the dict holding the same fields
+    rule = controller.flow_tables[switch_ids[0]][0]
+    flow_stats = controller.flow_stats
+    row_bytes = sum(getattr(flow_stats, name).itemsize for name, _, _ in FLOW_STATS_COLUMNS)
+    rule_bytes = sys.getsizeof(rule) + row_bytes
+    dict_bytes = (sys.getsizeof({'priority': rule.priority, 'match': rule.match,
+                                 'action': rule.action, 'counter': 0, 'created_at': 0.0,
+                                 'cookie': rule.cookie, 'idle_timeout': 0, 'hard_timeout': 0,
+                                 'last_hit': 0.0}) + sys.getsizeof(0.0))
+
+    rng = random.Random(1)
+    for _ in range(num_packets):
+        i = rng.randrange(num_rules)
+        controller.process_packet(switch_ids[i % num_switches],
+                                  {'src_ip': matches[i]['src_ip'], 'dst_ip': "10.0.0.1",
+                                   'src_port': 1024, 'dst_port': matches[i]['dst_port'],
+                                   'protocol': 'TCP', 'size': rng.randint(64, 1500)})
+
+    rules = [rule for table in controller.flow_tables.values() for rule in table]
+    queries = {
+        'aggregate': (lambda: controller.get_aggregate_stats(),
+                      lambda: (sum(rule.counter for rule in rules),
+                               sum(rule.byte_count for rule in rules))),
+        'top_flows': (lambda: controller.get_top_flows(k),
+                      lambda: heapq.nlargest(k, rules, key=attrgetter('counter'))),
+        'table_stats': (lambda: controller.get_table_stats(),
+                        lambda: {switch_id: sum(rule.counter for rule in table)
+                                 for switch_id, table in controller.flow_tables.items()}),
+    }
+    query_times = {}
+    for name, (bulk, walk) in queries.items():
+        times = []
+        for query in (bulk, walk):
+            start_time = time.perf_counter()
+            query()
+            times.append((time.perf_counter() - start_time) * 1000)
+        query_times[name] = times
+        logger.info("  %12s: %8.2f ms bulk, %8.2f ms walking the rules", name, times[0], times[1])
+
+    logger.info("  Rule with counters: %s bytes (was %s as a dict); %.0f bytes per installed "
+                "rule with lookup indexes", rule_bytes, dict_bytes, installed_bytes)
+    return {
+        'rule_bytes': rule_bytes,
+        'dict_bytes': dict_bytes,
+        'installed_bytes': installed_bytes,
+        'query_ms': query_times
+    }
+
+
+# Base scenario of the benchmark suite and the values each sweep gives to one parameter
+# batch_size 0 sends packets one at a time through process_packet
+BENCHMARK_BASE_SCENARIO = {
+    'num_rules': 1000,
+    'num_flows': 1000,
+    'miss_ratio': 0.1,
+    'num_switches': 1,
+    'batch_size': 0,
+    'num_packets': 20000
+}
+BENCHMARK_SWEEPS = {
+    'num_rules': [10, 100, 1000, 10000, 100000],
+    'num_flows': [10, 100, 1000, 10000],
+    'miss_ratio': [0.0, 0.1, 0.5, 0.9],
+    'num_switches': [1, 4, 16, 64],
+    'batch_size': [0, 100, 1000, 10000]
+}
+QUICK_BENCHMARK_SWEEPS = {
+    'num_rules': [10, 1000, 10000],
+    'num_flows': [10, 1000],
+    'miss_ratio': [0.0, 0.5],
+    'num_switches': [1, 16],
+    'batch_size': [0, 1000]
+}
+
+
+# Function to name a scenario after its parameters, used to match results with a baseline
+def scenario_name(params):
+    return ",".join(f"{key}={params[key]}" for key in sorted(params))
+
+
+# Function to build the controller and per-switch traffic of a benchmark scenario
+# Rules are reactive-style (src_ip, dst_port) rules spread over the switches. Packets are
+# drawn from num_flows flows; a miss_ratio share of the flows match no rule and are dropped
+# by the default policy without installing one, so the miss ratio stays the same on reruns
+def build_scenario(params):
+    switch_ids = [f"sw{i + 1}" for i in range(params['num_switches'])]
+    controller = SDNController("Benchmark-Controller", "OpenFlow")
+    controller.start()
+    for switch_id in switch_ids:
+        controller.add_switch(switch_id, 4)
+    for i in range(params['num_rules']):
+        controller.add_flow_rule(switch_ids[i % len(switch_ids)],
+                                 {'src_ip': f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+                                  'dst_port': (80, 443, 53)[i % 3]},
+                                 {'forward_port': 2})
+
+    flows = []
+    for i in range(params['num_flows']):
+        switch_id = random.choice(switch_ids)
+        if random.random() < params['miss_ratio'] or not controller.flow_tables[switch_id]:
+            src_ip, dst_port = f"192.168.{(i >> 8) & 255}.{i & 255}", 22
+        else:
+            match = random.choice(controller.flow_tables[switch_id]).match
+            src_ip, dst_port = match['src_ip'], match['dst_port']
+        flows.append((switch_id, {'src_ip': src_ip, 'dst_ip': "10.0.0.1",
+                                  'src_port': 1024 + i % 64000, 'dst_port': dst_port,
+                                  'protocol': 'TCP'}))
+
+    traffic = {switch_id: [] for switch_id in switch_ids}
+    for _ in range(params['num_packets']):
+        switch_id, packet = random.choice(flows)
+        traffic[switch_id].append(packet)
+    return controller, traffic
+
+
+# Function to run a scenario: warm-up runs first, then repeated timed runs
+def run_scenario(params, repeats=5, warmup=1):
+    controller, traffic = build_scenario(params)
+    batch_size = params['batch_size']
+    if batch_size:
+        work = [(switch_id, packets_to_batch(packets[i:i + batch_size]))
+                for switch_id, packets in traffic.items()
+                for i in range(0, len(packets), batch_size)]
+    num_packets = sum(len(packets) for packets in traffic.values())
+
+    runs = []
+    for run in range(warmup + repeats):
+        controller.reset_performance_metrics()
+        start_time = time.perf_counter()
+        if batch_size:
+            for switch_id, batch in work:
+                controller.process_batch(switch_id, dict(batch))
+        else:
+            for switch_id, packets in traffic.items():
+                for packet in packets:
+                    controller.process_packet(switch_id, dict(packet))
+        elapsed = time.perf_counter() - start_time
+        if run >= warmup:
+            latency = controller.performance_metrics['packet_processing_time'].summary()
+            runs.append({'packets_per_second': num_packets / elapsed,
+                         'p50_latency_ms': latency['p50_processing_time'],
+                         'p99_latency_ms': latency['p99_processing_time']})
+
+    throughput = sorted(run['packets_per_second'] for run in runs)
+    hits = controller.performance_metrics['flow_table_hits']
+    misses = controller.performance_metrics['flow_table_misses']
+    return {
+        'scenario': scenario_name(params),
+        'params': dict(params),
+        'packets_per_second': throughput[len(throughput) // 2],
+        'min_packets_per_second': throughput[0],
+        'max_packets_per_second': throughput[-1],
+        'p50_latency_ms': sorted(run['p50_latency_ms'] for run in runs)[len(runs) // 2],
+        'p99_latency_ms': sorted(run['p99_latency_ms'] for run in runs)[len(runs) // 2],
+        'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+        'runs': runs
+    }
+
+
+# Function to describe the machine and software a benchmark ran on
+def benchmark_metadata():
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__
+    }
+
+
+# Function to run every sweep of the suite; each sweep varies one parameter of the base scenario
+def run_benchmark_suite(sweeps=None, base=None, repeats=5, warmup=1, num_packets=None):
+    logger.info("SDN Controller Benchmark Suite")
+
+    sweeps = BENCHMARK_SWEEPS if sweeps is None else sweeps
+    base = dict(BENCHMARK_BASE_SCENARIO if base is None else base)
+    if num_packets is not None:
+        base['num_packets'] = num_packets
+
+    results = []
+    seen = {}
+    for parameter, values in sweeps.items():
+        for value in values:
+            params = dict(base, **{parameter: value})
+            name = scenario_name(params)
+            # Sweeps share the base scenario, which only needs to run once
+            if name not in seen:
+                random.seed(name)
+                seen[name] = run_scenario(params, repeats, warmup)
+                result = seen[name]
+                logger.info("  %s: %.0f pkt/s, p50 %.4f ms, p99 %.4f ms", name,
+                            result['packets_per_second'], result['p50_latency_ms'],
+                            result['p99_latency_ms'])
+            results.append(dict(seen[name], sweep=parameter))
+
+    return {'metadata': benchmark_metadata(), 'repeats': repeats, 'warmup': warmup,
+            'results': results}
+
+
+# Function to profile one benchmark scenario and write its flame graph and Chrome trace
+def profile_scenario(params=None, sample_rate=0.01, collapsed_path='sdn_profile.folded',
+                     trace_path='sdn_profile_trace.json'):
+    params = dict(BENCHMARK_BASE_SCENARIO if params is None else params)
+    logger.info("Profiling %s", scenario_name(params))
+    random.seed(scenario_name(params))
+    controller, traffic = build_scenario(params)
+    profiler = controller.enable_profiling(sample_rate)
+    for switch_id, packets in traffic.items():
+        for packet in packets:
+            controller.process_packet(switch_id, dict(packet))
+    controller.disable_profiling()
+
+    profiler.write_collapsed(collapsed_path)
+    profiler.write_chrome_trace(trace_path)
+    logger.info(profiler.get_report())
+    logger.info("Collapsed stacks saved to '%s', trace saved to '%s'", collapsed_path, trace_path)
+    return profiler
+
+
+# Function to find the scenarios that got slower than the baseline by more than the tolerance
+# Throughput must not drop by more than tolerance (a ratio). Median latency varies far more
+# between identical runs, so it gets the wider latency_tolerance, and must also grow by more
+# than latency_floor_ms to count; latency_tolerance=None leaves latency unchecked
+def compare_to_baseline(suite, baseline, tolerance=0.1, latency_tolerance=1.0,
+                        latency_floor_ms=0.01):
+    baseline_results = {result['scenario']: result for result in baseline['results']}
+    regressions = []
+    checked = set()
+    for result in suite['results']:
+        reference = baseline_results.get(result['scenario'])
+        if reference is None or result['scenario'] in checked:
+            continue
+        checked.add(result['scenario'])
+        if result['packets_per_second'] < reference['packets_per_second'] * (1 - tolerance):
+            regressions.append((result['scenario'], 'packets_per_second',
+                                reference['packets_per_second'], result['packets_per_second']))
+        if latency_tolerance is not None and \
+                result['p50_latency_ms'] > reference['p50_latency_ms'] * (1 + latency_tolerance) and \
+                result['p50_latency_ms'] - reference['p50_latency_ms'] > latency_floor_ms:
+            regressions.append((result['scenario'], 'p50_latency_ms',
+                                reference['p50_latency_ms'], result['p50_latency_ms']))
+    return regressions
+
+
+# Function to plot throughput against each swept parameter
+def plot_scaling_curves(suite, path='sdn_benchmark_scaling.png'):
+    sweeps = []
+    for result in suite['results']:
+        if result['sweep'] not in sweeps:
+            sweeps.append(result['sweep'])
+    if not sweeps:
+        logger.info("No benchmark results to plot")
+        return
+
+    fig, axes = plt.subplots(1, len(sweeps), figsize=(5 * len(sweeps), 4.5), squeeze=False)
+    for ax, sweep in zip(axes[0], sweeps):
+        points = sorted((result['params'][sweep], result['packets_per_second'])
+                        for result in suite['results'] if result['sweep'] == sweep)
+        values = [value for value, _ in points]
+        throughput = [packets_per_second for _, packets_per_second in points]
+        if sweep == 'miss_ratio':
+            ax.plot(values, throughput, marker='o')
+        else:
+            # Counts span several orders of magnitude; batch size 0 (per packet) is drawn at 1
+            positions = [max(value, 1) for value in values]
+            ax.plot(positions, throughput, marker='o')
+            ax.set_xscale('log')
+            ax.set_xticks(positions)
+            ax.set_xticklabels([str(value) for value in values])
+        ax.set_title(f"Throughput vs {sweep}")
+        ax.set_xlabel(sweep)
+        ax.set_ylabel('Packets per second')
+
+    plt.tight_layout()
+    plt.savefig(path)
+    logger.info("Scaling curves saved to '%s'", path)
+
 
 # Main function that runs all preivous ones
 def run_project_timeline():
-    print("SDN")
+    logger.info("SDN")
     
     openflow_controller, p4_controller = sdn_architectures()
 
@@ -526,5 +6471,80 @@ def run_project_timeline():
     p4_performance = evaluate_network_performance(p4_controller)
     
 
+# Function to parse the command line: without options the project timeline runs as before,
+# --benchmark runs the scenario suite and --baseline turns it into a regression gate
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SDN controller simulation and benchmarks")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="run the scenario benchmark suite instead of the project timeline")
+    parser.add_argument('--quick', action='store_true', help="run a smaller set of scenarios")
+    parser.add_argument('--repeats', type=int, default=5, help="timed runs per scenario")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed runs per scenario")
+    parser.add_argument('--packets', type=int, help="packets per scenario run")
+    parser.add_argument('--output', default='sdn_benchmark_results.json',
+                        help="file to write the results to")
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="allowed throughput drop relative to the baseline (0.1 = 10%%)")
+    parser.add_argument('--latency-tolerance', type=float, default=1.0,
+                        help="allowed median latency growth relative to the baseline "
+                             "(1.0 = 100%%)")
+    parser.add_argument('--latency-floor', type=float, default=0.01,
+                        help="smallest median latency growth in ms counted as a regression")
+    parser.add_argument('--plot', default='sdn_benchmark_scaling.png',
+                        help="file to save the scaling curves to")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the base benchmark scenario instead of the project timeline")
+    parser.add_argument('--sample-rate', type=float, default=0.01,
+                        help="share of packets timed when profiling")
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="lowest level of messages to print")
+    parser.add_argument('--quiet', action='store_true', help="only print warnings and errors")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level='WARNING' if args.quiet else args.log_level,
+                        format='%(message)s', stream=sys.stdout)
+
+    if args.profile:
+        base = dict(BENCHMARK_BASE_SCENARIO)
+        if args.packets:
+            base['num_packets'] = args.packets
+        profile_scenario(base, args.sample_rate)
+        return 0
+
+    if not args.benchmark:
+        run_project_timeline()
+        return 0
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, ValueError) as error:
+            logger.error("Cannot read baseline %s: %s", args.baseline, error)
+            return 2
+
+    sweeps = QUICK_BENCHMARK_SWEEPS if args.quick else BENCHMARK_SWEEPS
+    suite = run_benchmark_suite(sweeps, repeats=args.repeats, warmup=args.warmup,
+                                num_packets=args.packets)
+    with open(args.output, 'w') as output_file:
+        json.dump(suite, output_file, indent=2)
+    logger.info("Benchmark results saved to '%s'", args.output)
+    plot_scaling_curves(suite, args.plot)
+
+    if baseline is not None:
+        regressions = compare_to_baseline(suite, baseline, args.tolerance,
+                                          args.latency_tolerance, args.latency_floor)
+        for scenario, metric, expected, actual in regressions:
+            logger.warning("REGRESSION %s: %s %.4f -> %.4f", scenario, metric, expected, actual)
+        if regressions:
+            return 1
+        logger.info("No regressions against %s (tolerance %.0f%%)", args.baseline,
+                    args.tolerance * 100)
+    return 0
+
+
 if __name__ == "__main__":
-    run_project_timeline()
+    sys.exit(main())
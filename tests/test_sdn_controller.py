@@ -0,0 +1,913 @@
+import asyncio
+import importlib.util
+import json
+import os
+import pickle
+import random
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# The simulation is a single script with a hyphenated name, so it is loaded by path and
+# registered as a module for snapshots to pickle its classes
+MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'sdn-controller-simulation-python.py')
+spec = importlib.util.spec_from_file_location('sdn_controller_simulation', MODULE_PATH)
+sdn = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = sdn
+spec.loader.exec_module(sdn)
+
+ACTIONS = [{'forward_port': 1}, {'forward_port': 2}, {'drop': True}]
+
+
+# Function to build a random match over addresses, prefixes, ports, port ranges and protocols
+def random_match(rng):
+    match = {}
+    if rng.random() < 0.7:
+        length = rng.choice([8, 16, 24, 32])
+        address = sdn.ip_to_int(f"10.{rng.randrange(4)}.{rng.randrange(4)}.{rng.randrange(8)}")
+        network = sdn.int_to_ip(address & sdn.PREFIX_MASKS[length])
+        match['src_ip'] = network if length == 32 else f"{network}/{length}"
+    if rng.random() < 0.5:
+        match['dst_ip'] = f"10.9.0.{rng.randrange(4)}"
+    if rng.random() < 0.6:
+        if rng.random() < 0.5:
+            low = rng.randrange(0, 1100)
+            match['dst_port'] = [low, low + rng.randrange(200)]
+        else:
+            match['dst_port'] = rng.choice([22, 53, 80, 443, 1024])
+    if rng.random() < 0.4:
+        match['protocol'] = rng.choice(['TCP', 'UDP'])
+    return match
+
+
+def random_packet(rng):
+    return {'src_ip': f"10.{rng.randrange(4)}.{rng.randrange(4)}.{rng.randrange(8)}",
+            'dst_ip': f"10.9.0.{rng.randrange(4)}", 'src_port': rng.randrange(1024, 65536),
+            'dst_port': rng.choice([22, 53, 80, 443, 1024, rng.randrange(1300)]),
+            'protocol': rng.choice(['TCP', 'UDP']), 'size': rng.randrange(64, 1500)}
+
+
+def new_controller(switch_ids=("sw1",), **options):
+    controller = sdn.SDNController("test", "OpenFlow", **options)
+    controller.start()
+    for switch_id in switch_ids:
+        controller.add_switch(switch_id, 4)
+    return controller
+
+
+@pytest.mark.parametrize('classifier', sorted(sdn.CLASSIFIERS))
+@pytest.mark.parametrize('seed', range(5))
+def test_classifier_matches_linear_scan(classifier, seed):
+    rng = random.Random(seed)
+    rules = [sdn.FlowRule(random_match(rng), rng.choice(ACTIONS), priority, priority + 1)
+             for priority in range(rng.randrange(1, 300))]
+    packets = [random_packet(rng) for _ in range(500)]
+
+    reference = sdn.build_classifier(sdn.LinearClassifier, rules)
+    index = sdn.build_classifier(sdn.CLASSIFIERS[classifier], rules)
+    for packet in packets:
+        assert index.lookup(packet) is reference.lookup(packet)
+
+    # Removing rules must leave the same lookups as a scan over what remains
+    for rule in rng.sample(rules, len(rules) // 2):
+        reference.remove(rule)
+        index.remove(rule)
+    for packet in packets:
+        assert index.lookup(packet) is reference.lookup(packet)
+
+
+def test_trace_round_trip(tmp_path):
+    rng = random.Random(1)
+    packets = [random_packet(rng) for _ in range(1000)]
+    # Backup transfers exceed what 16 bits can hold
+    packets[0]['size'] = 1500000
+    packets[1]['size'] = 2 ** 32 - 1
+    del packets[2]['size']
+    del packets[3]['src_port'], packets[3]['dst_port']
+    timestamps = [i * 0.001 for i in range(len(packets))]
+    path = tmp_path / 'traffic.trace'
+
+    assert sdn.write_trace(str(path), packets, timestamps, chunk_size=256) == len(packets)
+    with sdn.TraceReader(str(path), chunk_size=300) as reader:
+        assert len(reader) == len(packets)
+        assert list(reader) == packets
+        timed = list(reader.timed_packets())
+        assert [packet for _, packet in timed] == packets
+        assert np.allclose([timestamp for timestamp, _ in timed], timestamps)
+        rows = [packet for batch in reader.batches(128) for packet in sdn.batch_to_packets(batch)]
+        assert rows == packets
+
+
+def test_trace_rejects_unknown_versions(tmp_path):
+    path = tmp_path / 'other.trace'
+    path.write_bytes(sdn.TRACE_HEADER.pack(sdn.TRACE_MAGIC, 99, sdn.TRACE_RECORD.itemsize) +
+                     np.zeros(2, dtype=sdn.TRACE_RECORD).tobytes())
+    with pytest.raises(ValueError):
+        sdn.TraceReader(str(path))
+
+
+def test_snapshot_restores_same_state(tmp_path):
+    rng = random.Random(2)
+    controller = new_controller(("sw1", "sw2"))
+    for switch_id in ("sw1", "sw2"):
+        for _ in range(200):
+            controller.add_flow_rule(switch_id, random_match(rng), rng.choice(ACTIONS))
+    traffic = [random_packet(rng) for _ in range(500)]
+    for packet in traffic:
+        controller.process_packet("sw1", dict(packet))
+    path = tmp_path / 'controller.snapshot'
+    controller.save_snapshot(str(path))
+
+    restored = sdn.restore_snapshot(str(path))
+    assert restored.switches == controller.switches
+    assert restored.duplicate_rules == controller.duplicate_rules
+    assert restored.next_cookie == controller.next_cookie
+    for switch_id in ("sw1", "sw2"):
+        rules = controller.flow_tables[switch_id]
+        restored_rules = restored.flow_tables[switch_id]
+        assert [(rule.match, rule.action, rule.priority, rule.cookie, rule.counter,
+                 rule.byte_count) for rule in restored_rules] == \
+            [(rule.match, rule.action, rule.priority, rule.cookie, rule.counter,
+              rule.byte_count) for rule in rules]
+    for switch_id in ("sw1", "sw2"):
+        for packet in traffic[:100]:
+            assert restored.process_packet(switch_id, dict(packet)) == \
+                controller.process_packet(switch_id, dict(packet))
+
+
+@pytest.mark.parametrize('duplicate_rules', [sdn.DUPLICATE_MERGE, sdn.DUPLICATE_KEEP])
+def test_snapshot_keeps_duplicate_rule_handling(tmp_path, duplicate_rules):
+    controller = new_controller(duplicate_rules=duplicate_rules)
+    controller.add_flow_rule("sw1", {'dst_port': 80}, {'forward_port': 1})
+    path = tmp_path / 'controller.snapshot'
+    controller.save_snapshot(str(path))
+    restored = sdn.restore_snapshot(str(path))
+    assert restored.duplicate_rules == duplicate_rules
+    restored.add_flow_rule("sw1", {'dst_port': 80}, {'forward_port': 1})
+    assert len(restored.flow_tables["sw1"]) == (2 if duplicate_rules == sdn.DUPLICATE_KEEP else 1)
+
+
+def test_snapshot_benchmark_reports_restore_target(tmp_path):
+    results = sdn.benchmark_snapshot_restore(2000, 4, str(tmp_path / 'bench.snapshot'))
+    assert results['restore_meets_target'] and results['load_all_meets_target']
+
+
+def test_miss_policy_loads_valid_policy(tmp_path):
+    policy = {
+        'default_action': {'drop': True},
+        'rules': [
+            {'match': {'dst_port': 80}, 'action': {'forward_port': 2}, 'install': 'port'},
+            {'match': {'src_ip': '10.0.0.0/8', 'dst_port': [1024, 65535]},
+             'action': {'forward_port': 3}, 'install': 'subnet', 'prefix_length': 24},
+            {'match': {'protocol': 'UDP'}, 'action': {'drop': True}, 'install': 'none'}
+        ]
+    }
+    path = tmp_path / 'policy.json'
+    path.write_text(json.dumps(policy))
+    miss_policy = sdn.load_miss_policy(str(path))
+    assert len(miss_policy) == 3
+
+    packet = {'src_ip': '10.1.2.3', 'dst_ip': '10.9.0.1', 'src_port': 5000, 'dst_port': 8080,
+              'protocol': 'TCP'}
+    entry = miss_policy.lookup(packet)
+    assert entry.action == {'forward_port': 3}
+    assert miss_policy.install_match(entry, packet) == {'src_ip': '10.1.2.0/24',
+                                                        'dst_port': [1024, 65535]}
+    assert miss_policy.lookup(dict(packet, dst_port=22, protocol='UDP')).install == 'none'
+    assert miss_policy.lookup(dict(packet, src_ip='192.168.0.1', dst_port=22)) is None
+
+
+@pytest.mark.parametrize('rule', [
+    {'match': {'dst_port': 80}, 'action': {'forward': 2}},
+    {'match': {'dst_port': 80}, 'action': {}},
+    {'match': {'dst_port': 80}, 'action': {'modify': 5}},
+    {'match': {'dst_port': 80}, 'action': {'drop': True}, 'install': 'everything'},
+    {'match': {'src_ip': '10.0.0.1/8'}, 'action': {'drop': True}},
+    {'match': {'dst_port': [80, 22]}, 'action': {'drop': True}},
+])
+def test_miss_policy_rejects_invalid_policy(tmp_path, rule):
+    path = tmp_path / 'policy.json'
+    path.write_text(json.dumps({'rules': [rule]}))
+    with pytest.raises(ValueError):
+        sdn.load_miss_policy(str(path))
+
+
+def test_miss_policy_rejects_unknown_default_action():
+    with pytest.raises(ValueError):
+        sdn.MissPolicy([], {'forward': 2})
+
+
+@pytest.mark.parametrize('classifier', sorted(sdn.CLASSIFIERS))
+@pytest.mark.parametrize('duplicate_rules', [sdn.DUPLICATE_KEEP, sdn.DUPLICATE_MERGE])
+def test_compact_removes_only_dead_rules(classifier, duplicate_rules):
+    now = [1000.0]
+    # Misses are dropped without installing rules, so the table only holds the rules below
+    controller = new_controller(classifier=classifier, duplicate_rules=duplicate_rules,
+                                miss_policy=sdn.MissPolicy())
+    controller.clock = lambda: now[0]
+    subnet = {'src_ip': '10.1.0.0/16'}
+    controller.add_flow_rule("sw1", subnet, {'forward_port': 1})
+    controller.add_flow_rule("sw1", {'src_ip': '10.2.0.0/16'}, {'forward_port': 1},
+                             hard_timeout=10)
+    shadowed = {'src_ip': '10.1.2.3', 'dst_port': 80}
+    redundant = {'src_ip': '10.1.0.0/24'}
+    partial = {'src_ip': '10.0.0.0/8', 'dst_port': 443}
+    short_lived_cover = {'src_ip': '10.2.3.4'}
+    controller.add_flow_rule("sw1", shadowed, {'forward_port': 2})
+    controller.add_flow_rule("sw1", redundant, {'forward_port': 1})
+    controller.add_flow_rule("sw1", partial, {'drop': True})
+    controller.add_flow_rule("sw1", short_lived_cover, {'drop': True})
+
+    dead = {(rule.match['src_ip'], covering.match['src_ip'])
+            for _, rule, covering in controller.get_dead_rules("sw1")}
+    assert dead == {('10.1.2.3', '10.1.0.0/16'), ('10.1.0.0/24', '10.1.0.0/16')}
+
+    rng = random.Random(3)
+    traffic = [random_packet(rng) for _ in range(300)]
+    traffic += [dict(packet, src_ip='10.1.2.3', dst_port=80) for packet in traffic[:20]]
+    before = [controller.process_packet("sw1", dict(packet)) for packet in traffic]
+    report = controller.compact("sw1")
+    assert report == {'rules_before': 6, 'rules_after': 4, 'shadowed': 1, 'redundant': 1}
+    assert [rule.match for rule in controller.flow_tables["sw1"]] == \
+        [subnet, {'src_ip': '10.2.0.0/16'}, partial, short_lived_cover]
+    assert controller.get_dead_rules("sw1") == []
+    assert [controller.process_packet("sw1", dict(packet)) for packet in traffic] == before
+
+    # A rule left behind a cover that has since been removed matches again
+    controller.add_flow_rule("sw1", shadowed, {'forward_port': 2})
+    assert len(controller.get_dead_rules("sw1")) == 1
+    controller.remove_flow_rule("sw1", controller.flow_tables["sw1"][0])
+    assert controller.get_dead_rules("sw1") == []
+    packet = {'src_ip': '10.1.2.3', 'dst_ip': '10.9.0.1', 'src_port': 5000, 'dst_port': 80,
+              'protocol': 'TCP'}
+    assert controller.process_packet("sw1", packet) == {'status': 'forwarded', 'port': 2}
+
+
+def test_duplicate_rules_merge_and_reject():
+    # Duplicates are merged unless the controller is told to reject them
+    for options, installed in (({}, True), ({'duplicate_rules': sdn.DUPLICATE_REJECT}, False)):
+        controller = new_controller(**options)
+        match = {'src_ip': '10.1.0.0/16'}
+        assert controller.add_flow_rule("sw1", match, {'forward_port': 1})
+        assert controller.add_flow_rule("sw1", dict(match), {'forward_port': 1}) is installed
+        assert len(controller.flow_tables["sw1"]) == 1
+        assert controller.performance_metrics['duplicate_rules'] == 1
+        # The same match with another action is kept, as a shadowed rule
+        assert controller.add_flow_rule("sw1", dict(match), {'forward_port': 2})
+        assert controller.performance_metrics['shadowed_rules'] == 1
+        assert "sw1" in controller.overlap_indexes
+
+
+def test_duplicate_rules_keep_opts_out_of_install_checks():
+    controller = new_controller(duplicate_rules=sdn.DUPLICATE_KEEP)
+    match = {'src_ip': '10.1.0.0/16'}
+    controller.add_flow_rule("sw1", match, {'forward_port': 1})
+    controller.add_flow_rule("sw1", dict(match), {'forward_port': 1})
+    assert len(controller.flow_tables["sw1"]) == 2
+    assert controller.performance_metrics['duplicate_rules'] == 0
+    assert controller.overlap_indexes == {}
+    assert len(controller.get_dead_rules("sw1")) == 1
+
+
+def test_batch_results_match_scalar_results():
+    rng = random.Random(7)
+    rules = [(random_match(rng), rng.choice(ACTIONS + [{'modify': {'dst_port': 8080}}]))
+             for _ in range(100)]
+    packets = [random_packet(rng) for _ in range(2000)]
+    scalar, batched = new_controller(), new_controller()
+    for controller in (scalar, batched):
+        for match, action in rules:
+            controller.add_flow_rule("sw1", dict(match), action)
+
+    expected = [scalar.process_packet("sw1", dict(packet)) for packet in packets]
+    results = list(batched.process_batch("sw1", sdn.packets_to_batch(packets)))
+    assert results == expected
+    assert [(rule.match, rule.counter) for rule in batched.flow_tables["sw1"]] == \
+        [(rule.match, rule.counter) for rule in scalar.flow_tables["sw1"]]
+
+    # Every packet gets its own result, even when packets hit the same rule
+    assert len({id(result) for result in results}) == len(results)
+
+
+def test_compare_to_baseline_gates_throughput_and_latency():
+    def suite(packets_per_second, p50_latency_ms):
+        return {'results': [{'scenario': 'rules=100', 'packets_per_second': packets_per_second,
+                             'p50_latency_ms': p50_latency_ms}]}
+
+    baseline = suite(100000, 0.02)
+    assert sdn.compare_to_baseline(suite(95000, 0.03), baseline) == []
+    assert [metric for _, metric, _, _ in sdn.compare_to_baseline(suite(80000, 0.02), baseline)] == \
+        ['packets_per_second']
+    # Latency is gated by default once it grows past both the ratio and the absolute floor
+    assert [metric for _, metric, _, _ in sdn.compare_to_baseline(suite(100000, 0.05), baseline)] == \
+        ['p50_latency_ms']
+    assert sdn.compare_to_baseline(suite(100000, 0.005), suite(100000, 0.001)) == []
+    assert sdn.compare_to_baseline(suite(100000, 0.05), baseline, latency_tolerance=None) == []
+
+
+def test_shortest_paths_follow_link_changes():
+    controller = new_controller(switch_ids=())
+    hosts = sdn.build_fat_tree(controller, 4)
+    destinations = sorted(set(controller.host_locations.values()))
+    paths = controller.paths
+    paths.precompute(destinations)
+
+    # Patched trees must equal trees built from scratch on the changed topology
+    def assert_matches_rebuild():
+        rebuilt = sdn.ShortestPaths(paths.successors)
+        rebuilt.predecessors = paths.predecessors
+        for destination in destinations:
+            distances, next_hops = paths.tree(destination)
+            expected_distances, expected_hops = rebuilt._build(destination)
+            assert distances == expected_distances
+            assert {node: sorted(hops) for node, hops in next_hops.items()} == \
+                {node: sorted(hops) for node, hops in expected_hops.items()}
+
+    built, updates = paths.stats['trees_built'], paths.stats['link_updates']
+    controller.remove_connection("agg0_0", "core0")
+    controller.remove_connection("core0", "agg0_0")
+    assert_matches_rebuild()
+    controller.add_connection("edge0_0", "edge1_0")
+    controller.add_connection("edge1_0", "edge0_0")
+    assert_matches_rebuild()
+    # No tree was rebuilt, each link change patched the cached ones
+    assert paths.stats['trees_built'] == built
+    assert paths.stats['link_updates'] == updates + 4
+
+    packet = {'src_ip': hosts[0], 'dst_ip': hosts[4], 'src_port': 5000, 'dst_port': 80,
+              'protocol': 'TCP'}
+    assert controller.forward_packet("edge0_0", packet) == \
+        {'status': 'delivered', 'path': ["edge0_0", "edge1_0"], 'hops': 1}
+
+
+def test_equal_cost_choice_is_stable_across_processes():
+    # The next hop of a flow must not depend on the per-process seed of hash()
+    script = ("import importlib.util, json; "
+              f"spec = importlib.util.spec_from_file_location('sdn', {MODULE_PATH!r}); "
+              "sdn = importlib.util.module_from_spec(spec); spec.loader.exec_module(sdn); "
+              "controller = sdn.SDNController('test', 'OpenFlow'); "
+              "sdn.build_fat_tree(controller, 4); "
+              "keys = [('10.0.0.2', '10.3.1.3', port, 80, 'TCP') for port in range(50)]; "
+              "print(json.dumps([controller.paths.next_hop('edge0_0', 'edge3_1', key) "
+              "for key in keys]))")
+    outputs = set()
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        outputs.add(subprocess.run([sys.executable, '-c', script], env=env, check=True,
+                                   capture_output=True, text=True).stdout)
+    assert len(outputs) == 1
+    assert len(set(json.loads(outputs.pop()))) == 2
+
+
+def test_network_simulator_applies_flow_tables_like_forwarding():
+    simulated, forwarded = new_controller(switch_ids=()), new_controller(switch_ids=())
+    hosts = sdn.build_fat_tree(simulated, 4)
+    sdn.build_fat_tree(forwarded, 4)
+    for controller in (simulated, forwarded):
+        controller.add_flow_rule("edge0_0", {'dst_port': 22}, {'drop': True})
+        controller.add_flow_rule("edge0_1", {'dst_port': 8080}, {'modify': {'vlan': 10}})
+
+    rng = random.Random(3)
+    traffic = []
+    for i in range(400):
+        src, dst = rng.sample(hosts, 2)
+        packet = {'src_ip': src, 'dst_ip': dst, 'src_port': rng.randrange(1024, 1100),
+                  'dst_port': rng.choice([22, 80, 8080]), 'protocol': 'TCP', 'size': 500}
+        traffic.append((i * 1e-3, simulated.host_locations[src], packet))
+
+    simulator = sdn.NetworkSimulator(simulated)
+    simulator.add_traffic((time_, switch_id, dict(packet)) for time_, switch_id, packet in traffic)
+    stats = simulator.run()
+    statuses = [forwarded.forward_packet(switch_id, dict(packet))['status']
+                for _, switch_id, packet in traffic]
+
+    # Widely spaced packets never queue, so the simulator must agree with forward_packet
+    assert stats['injected'] == len(traffic)
+    assert stats['delivered'] == statuses.count('delivered') > 0
+    assert stats['flow_table_drops'] == statuses.count('dropped') > 0
+    assert stats['queue_drops'] == 0
+    for metric in ('flow_table_hits', 'flow_table_misses', 'controller_requests'):
+        assert simulated.performance_metrics[metric] == forwarded.performance_metrics[metric]
+    for switch_id in simulated.switches:
+        assert [(rule.match, rule.counter, rule.byte_count)
+                for rule in simulated.flow_tables[switch_id]] == \
+            [(rule.match, rule.counter, rule.byte_count)
+             for rule in forwarded.flow_tables[switch_id]]
+
+
+def test_network_simulator_queues_and_drops_on_a_busy_link():
+    controller = new_controller(switch_ids=("sw1", "sw2"))
+    controller.add_connection("sw1", "sw2")
+    controller.add_host("sw2", "10.0.0.2")
+    packet = {'src_ip': "10.0.0.1", 'dst_ip': "10.0.0.2", 'src_port': 5000, 'dst_port': 80,
+              'protocol': 'TCP', 'size': 1000}
+
+    # 1000 bytes take 1 ms at 8 Mbit/s, and only three packets fit in the queue
+    simulator = sdn.NetworkSimulator(controller, latency=1e-3, bandwidth=8e6, queue_size=3)
+    simulator.add_traffic((0.0, "sw1", dict(packet)) for _ in range(5))
+    stats = simulator.run()
+    assert stats['delivered'] == 3
+    assert stats['queue_drops'] == 2
+    assert simulator.links[("sw1", "sw2")].max_occupancy == 3
+    # Deliveries after 2, 3 and 4 ms: serialization behind the queue plus link latency
+    assert simulator.now == pytest.approx(4e-3)
+    assert simulator.latency_histogram.mean() == pytest.approx(3e6, rel=0.01)
+
+
+def test_parallel_benchmark_merges_only_metrics():
+    benchmark, reference = sdn.SDNBenchmark(), sdn.SDNBenchmark()
+    for controller in sdn.sdn_architectures():
+        benchmark.add_controller(controller)
+    for controller in sdn.sdn_architectures():
+        reference.add_controller(controller)
+    traffic = benchmark.generate_test_traffic(500)
+    tables = {name: list(controller.flow_tables["sw1"])
+              for name, controller in benchmark.controllers.items()}
+
+    results = benchmark.run_benchmark(traffic, parallel=True, max_workers=2)
+    expected = reference.run_benchmark(traffic)
+    for name, controller in benchmark.controllers.items():
+        # The rules learned in the worker stay there; the parent keeps its own table
+        assert list(controller.flow_tables["sw1"]) == tables[name]
+        for metric in ('flow_table_hits', 'flow_table_misses', 'controller_requests'):
+            assert results[name][metric] == expected[name][metric]
+        assert controller.performance_metrics['flow_rules_installed'] == \
+            reference.controllers[name].performance_metrics['flow_rules_installed']
+        assert len(controller.performance_metrics['packet_processing_time']) == len(traffic)
+
+
+def test_control_channel_coalesced_misses_reuse_the_leaders_decision():
+    # The policy forwards web traffic without installing a rule, so nothing covers the later
+    # packets of the flow; they must still not ask the controller again
+    policy = sdn.MissPolicy([{'match': {'dst_port': 80}, 'action': {'forward_port': 2},
+                              'install': 'none'}])
+    lookups = []
+    policy_lookup = policy.lookup
+    policy.lookup = lambda packet: lookups.append(packet) or policy_lookup(packet)
+    controller = new_controller(miss_policy=policy)
+    packet = {'src_ip': '10.1.2.3', 'dst_ip': '10.9.0.1', 'src_port': 5000, 'dst_port': 80,
+              'protocol': 'TCP'}
+    channel = sdn.AsyncControlChannel(controller, rtt=0.001)
+
+    async def replay():
+        await channel.start()
+        results = await channel.replay("sw1", [packet] * 20)
+        await channel.stop()
+        return results
+
+    results = asyncio.run(replay())
+    assert results == [{'status': 'forwarded', 'port': 2}] * 20
+    assert channel.stats['packet_ins'] == 1
+    assert channel.stats['coalesced_misses'] == 19
+    assert controller.performance_metrics['controller_requests'] == 1
+    assert controller.performance_metrics['flow_table_misses'] == 20
+    assert len(lookups) == 1
+    assert len(controller.flow_tables["sw1"]) == 0
+
+
+def test_microflow_cache_hits_evicts_and_follows_rule_changes():
+    controller = new_controller(microflow_cache_size=2, miss_policy=sdn.MissPolicy())
+    controller.add_flow_rule("sw1", {'dst_port': 80}, {'forward_port': 1})
+    web, dns, ssh = ({'src_ip': '10.0.0.1', 'dst_ip': '10.9.0.1', 'src_port': 5000,
+                      'dst_port': port, 'protocol': 'TCP'} for port in (80, 53, 22))
+    cache = controller.microflow_caches["sw1"]
+    metrics = controller.performance_metrics
+
+    assert controller.process_packet("sw1", dict(web)) == {'status': 'forwarded', 'port': 1}
+    assert controller.process_packet("sw1", dict(web)) == {'status': 'forwarded', 'port': 1}
+    assert (metrics['microflow_cache_hits'], metrics['microflow_cache_misses']) == (1, 1)
+
+    # Misses are not cached, so a rule added later is found for a flow that missed before
+    assert controller.process_packet("sw1", dict(dns)) == {'status': 'dropped'}
+    controller.add_flow_rule("sw1", {'dst_port': 53}, {'forward_port': 3})
+    assert controller.process_packet("sw1", dict(dns)) == {'status': 'forwarded', 'port': 3}
+
+    # A third flow evicts the least recently used one
+    controller.add_flow_rule("sw1", {'dst_port': 22}, {'forward_port': 4})
+    controller.process_packet("sw1", dict(ssh))
+    assert metrics['microflow_cache_evictions'] == 1
+    assert sdn.flow_key(web) not in cache.entries
+    assert set(cache.entries) == {sdn.flow_key(dns), sdn.flow_key(ssh)}
+
+    # Removing a rule drops the flows cached on it
+    dns_rule = controller.flow_tables["sw1"][1]
+    controller.remove_flow_rule("sw1", dns_rule)
+    assert sdn.flow_key(dns) not in cache.entries
+    assert controller.process_packet("sw1", dict(dns)) == {'status': 'dropped'}
+
+    # A rule matching outside the 5-tuple makes cached results ambiguous, so the cache is
+    # cleared and bypassed
+    controller.add_flow_rule("sw1", {'dst_port': 22, 'size': 100}, {'drop': True})
+    assert len(cache) == 0
+    hits = metrics['microflow_cache_hits']
+    assert controller.process_packet("sw1", dict(ssh)) == {'status': 'forwarded', 'port': 4}
+    assert metrics['microflow_cache_hits'] == hits
+    assert "Microflow cache hits" in controller.get_performance_report()
+
+
+def test_latency_histogram_percentiles_within_precision():
+    rng = random.Random(4)
+    values = [int(rng.lognormvariate(10, 2)) for _ in range(20000)]
+    first, second = sdn.LatencyHistogram(), sdn.LatencyHistogram()
+    buckets = len(first.counts)
+    for i, value in enumerate(values):
+        (first if i % 2 else second).record(value)
+    histogram = sdn.LatencyHistogram().merge(first).merge(second)
+
+    # Memory does not grow with the number of values
+    assert len(histogram.counts) == buckets
+    assert len(histogram) == len(values)
+    assert histogram.mean() == pytest.approx(sum(values) / len(values))
+    assert histogram.max == max(values) and histogram.min == min(values)
+    ordered = sorted(values)
+    for percent in (50, 90, 99, 99.9, 100):
+        exact = ordered[int(max(1, -(-len(values) * percent // 100))) - 1]
+        assert exact <= histogram.percentile(percent) <= exact * (1 + 2 ** -histogram.precision_bits)
+
+    # Small values are exact, and recording a value several times weighs it accordingly
+    small = sdn.LatencyHistogram()
+    small.record(3, count=9)
+    small.record(200)
+    assert (small.percentile(90), small.percentile(99)) == (3, 200)
+    summary = small.summary()
+    assert summary['p50_processing_time'] == pytest.approx(3e-6)
+    assert summary['max_processing_time'] == pytest.approx(2e-4)
+
+    with pytest.raises(ValueError):
+        histogram.merge(sdn.LatencyHistogram(precision_bits=5))
+
+
+def test_flow_timeouts_expire_rules_on_time():
+    controller = new_controller()
+    now = [0.0]
+    controller.clock = lambda: now[0]
+    controller.add_flow_rule("sw1", {'dst_port': 1001}, {'forward_port': 1}, idle_timeout=10)
+    controller.add_flow_rule("sw1", {'dst_port': 1002}, {'forward_port': 1}, hard_timeout=20)
+    controller.add_flow_rule("sw1", {'dst_port': 1003}, {'forward_port': 1})
+
+    def installed_ports():
+        return [rule.match['dst_port'] for rule in controller.flow_tables["sw1"]]
+
+    def send(time_, port):
+        now[0] = time_
+        return controller.process_packet("sw1", {'src_ip': '10.0.0.1', 'dst_ip': '10.9.0.1',
+                                                 'src_port': 5000, 'dst_port': port,
+                                                 'protocol': 'TCP'})
+
+    # A hit pushes the idle deadline back; the hard deadline never moves
+    send(5, 1001)
+    send(12, 1002)
+    assert installed_ports() == [1001, 1002, 1003]
+    send(16, 1003)
+    assert installed_ports() == [1002, 1003]
+    send(21, 1003)
+    assert installed_ports() == [1003]
+    assert controller.performance_metrics['flow_expirations'] == 2
+    assert send(22, 1001) == {'status': 'dropped'}
+
+
+def test_full_flow_table_evicts_least_recently_used_rule():
+    controller = new_controller(switch_ids=())
+    controller.add_switch("sw1", 4, table_capacity=3)
+    now = [0.0]
+    controller.clock = lambda: now[0]
+
+    def send(port):
+        controller.process_packet("sw1", {'src_ip': '10.0.0.1', 'dst_ip': '10.9.0.1',
+                                          'src_port': 5000, 'dst_port': port, 'protocol': 'TCP'})
+
+    for port in (1001, 1002, 1003):
+        controller.add_flow_rule("sw1", {'dst_port': port}, {'forward_port': 1})
+    now[0] = 1
+    send(1001)
+    now[0] = 2
+    send(1003)
+    now[0] = 3
+    controller.add_flow_rule("sw1", {'dst_port': 1004}, {'forward_port': 1})
+    assert [rule.match['dst_port'] for rule in controller.flow_tables["sw1"]] == \
+        [1001, 1003, 1004]
+    now[0] = 4
+    controller.add_flow_rule("sw1", {'dst_port': 1005}, {'forward_port': 1})
+    assert [rule.match['dst_port'] for rule in controller.flow_tables["sw1"]] == \
+        [1003, 1004, 1005]
+    assert controller.performance_metrics['flow_evictions'] == 2
+    assert len(controller.live_cookies) == 3
+
+
+def test_prefix_and_port_range_matching():
+    match = {'src_ip': '10.1.2.0/24', 'dst_port': [1024, 2048]}
+    packet = {'src_ip': '10.1.2.255', 'dst_port': 1024}
+    assert sdn.rule_matches(match, packet)
+    assert sdn.rule_matches(match, dict(packet, dst_port=2048))
+    assert not sdn.rule_matches(match, dict(packet, dst_port=2049))
+    assert not sdn.rule_matches(match, dict(packet, src_ip='10.1.3.0'))
+    assert sdn.rule_matches({'dst_ip': '0.0.0.0/0'}, {'dst_ip': '192.168.1.1'})
+    for invalid in ({'src_ip': '10.1.2.3/24'}, {'src_ip': '10.0.0.0/33'},
+                    {'dst_port': [2048, 1024]}):
+        with pytest.raises(ValueError):
+            sdn.validate_match(invalid)
+
+    # The trie answers with the longest prefix first, the interval index with every range
+    trie = sdn.PrefixTrie()
+    for length in (8, 16, 24):
+        network = sdn.ip_to_int('10.1.2.0') & sdn.PREFIX_MASKS[length]
+        trie.insert(network, length, (length, f"/{length}"))
+    assert [bucket[0][1] for bucket in trie.matches(sdn.ip_to_int('10.1.2.7'))] == \
+        ['/24', '/16', '/8']
+    assert trie.longest_match(sdn.ip_to_int('10.1.9.7'))[0][1] == '/16'
+    assert trie.longest_match(sdn.ip_to_int('11.0.0.1')) is None
+    ranges = sdn.PortRangeIndex()
+    ranges.insert(1000, 2000, (0, 'wide'))
+    ranges.insert(1500, 1500, (1, 'single'))
+    assert [entry for bucket in ranges.matches(1500) for _, entry in bucket] == ['wide', 'single']
+    assert [entry for bucket in ranges.matches(2000) for _, entry in bucket] == ['wide']
+    assert ranges.matches(2001) == []
+
+
+def test_reactive_rules_aggregate_per_source_prefix():
+    traffic = [{'src_ip': f"10.0.{subnet}.{host}", 'dst_ip': '10.9.0.1', 'src_port': 5000,
+                'dst_port': 80, 'protocol': 'TCP'}
+               for subnet in range(2) for host in range(1, 101)]
+    exact, aggregated = new_controller(), new_controller(reactive_prefix_length=24)
+    for controller in (exact, aggregated):
+        statuses = [controller.process_packet("sw1", dict(packet))['status']
+                    for packet in traffic]
+        assert statuses == ['forwarded'] * len(traffic)
+    assert len(exact.flow_tables["sw1"]) == exact.performance_metrics['controller_requests'] == 200
+    assert [rule.match['src_ip'] for rule in aggregated.flow_tables["sw1"]] == \
+        ['10.0.0.0/24', '10.0.1.0/24']
+    assert aggregated.performance_metrics['controller_requests'] == 2
+
+
+def test_compiled_classifier_compiles_lazily_and_tracks_changes():
+    rng = random.Random(11)
+    rules = [sdn.FlowRule(random_match(rng), rng.choice(ACTIONS), priority, priority + 1)
+             for priority in range(200)]
+    # A large exact-match tuple becomes one dict lookup in the generated function
+    rules += [sdn.FlowRule({'src_ip': f"10.5.0.{i}", 'dst_port': 80}, {'forward_port': 1},
+                           200 + i, 201 + i) for i in range(sdn.INLINE_TUPLE_SIZE * 2)]
+    packets = [random_packet(rng) for _ in range(300)]
+    packets += [dict(packet, src_ip=f"10.5.0.{i}", dst_port=80) for i, packet in
+                enumerate(packets[:20])]
+    classifier = sdn.build_classifier(sdn.CompiledClassifier, rules)
+    reference = sdn.build_classifier(sdn.LinearClassifier, rules)
+
+    def assert_same_lookups():
+        for packet in packets:
+            assert classifier.lookup(packet) is reference.lookup(packet)
+
+    # Lookups stay interpreted until enough of them pay for compiling
+    assert classifier.compiled is None
+    assert_same_lookups()
+    assert classifier.compilations == 1 and classifier.compiled is not None
+    assert classifier.source.startswith("def lookup(packet):")
+
+    # New rules go to the tail without recompiling
+    added = sdn.FlowRule({'dst_port': 4242}, {'drop': True}, 500, 501)
+    classifier.insert(added)
+    reference.insert(added)
+    packets.append(dict(packets[0], dst_port=4242))
+    assert_same_lookups()
+    assert classifier.compilations == 1
+
+    # Removing a compiled rule falls back to the interpreted path until compiled again
+    for rule in rules[:50]:
+        classifier.remove(rule)
+        reference.remove(rule)
+    assert classifier.compiled is None
+    assert_same_lookups()
+    assert classifier.compilations == 2
+
+    # The generated function is not pickled; the copy compiles its own
+    copy = pickle.loads(pickle.dumps(classifier))
+    assert copy.compiled is None
+    for packet in packets:
+        expected = reference.lookup(packet)
+        assert getattr(copy.lookup(packet), 'cookie', None) == getattr(expected, 'cookie', None)
+    assert copy.compiled is not None
+
+
+def test_consistent_hash_ring_moves_few_keys():
+    keys = [f"sw{i}" for i in range(2000)]
+    ring = sdn.ConsistentHashRing(range(4))
+    before = {key: ring.node_for(key) for key in keys}
+    assert before == {key: sdn.ConsistentHashRing(range(4)).node_for(key) for key in keys}
+
+    # A new node only takes keys, about a fifth of them, and takes them from every node
+    ring.add_node(4)
+    after = {key: ring.node_for(key) for key in keys}
+    moved = [key for key in keys if after[key] != before[key]]
+    assert {after[key] for key in moved} == {4}
+    assert 0.1 < len(moved) / len(keys) < 0.3
+    assert {before[key] for key in moved} == {0, 1, 2, 3}
+
+    # Removing a node only moves its own keys
+    ring.remove_node(1)
+    final = {key: ring.node_for(key) for key in keys}
+    assert [key for key in keys if final[key] != after[key]] == \
+        [key for key in keys if after[key] == 1]
+
+
+def test_switch_export_and_import_keep_rules_and_counters():
+    source, target = new_controller(), new_controller(switch_ids=())
+    source.add_host("sw1", "10.9.0.1")
+    source.add_flow_rule("sw1", {'dst_port': 22}, {'drop': True}, idle_timeout=60)
+    packets = [{'src_ip': f"10.0.0.{i}", 'dst_ip': '10.9.0.1', 'src_port': 5000,
+                'dst_port': (80, 22)[i % 2], 'protocol': 'TCP', 'size': 100} for i in range(20)]
+    expected = [source.process_packet("sw1", dict(packet)) for packet in packets]
+    rules = [(rule.match, rule.action, rule.idle_timeout, rule.counter, rule.byte_count)
+             for rule in source.flow_tables["sw1"]]
+
+    target.import_switch(source.export_switch("sw1"))
+    assert "sw1" not in source.switches and not source.flow_tables.get("sw1")
+    assert target.host_locations == {'10.9.0.1': "sw1"}
+    assert [(rule.match, rule.action, rule.idle_timeout, rule.counter, rule.byte_count)
+            for rule in target.flow_tables["sw1"]] == rules
+    # The imported rules answer every packet without asking the controller again
+    assert [target.process_packet("sw1", dict(packet)) for packet in packets] == expected
+    assert target.performance_metrics['controller_requests'] == 0
+
+
+def test_controller_cluster_routes_and_rebalances():
+    switch_ids = [f"sw{i}" for i in range(12)]
+    traffic = [(switch_id, {'src_ip': f"10.0.0.{i}", 'dst_ip': '10.9.0.1', 'src_port': 5000,
+                            'dst_port': 80, 'protocol': 'TCP'})
+               for i in range(5) for switch_id in switch_ids]
+    with sdn.ControllerCluster("test", num_workers=2, chunk_size=7) as cluster:
+        for switch_id in switch_ids:
+            assert cluster.add_switch(switch_id, 4)
+        first = cluster.process_packets(traffic)
+        assert first == [{'status': 'forwarded', 'port': 2}] * len(traffic)
+
+        owners = dict(cluster.switch_owners)
+        new_worker = cluster.add_worker()
+        moved = [switch_id for switch_id in switch_ids
+                 if cluster.owner(switch_id) != owners[switch_id]]
+        assert moved and all(cluster.owner(switch_id) == new_worker for switch_id in moved)
+        assert cluster.stats['switches_moved'] == len(moved)
+
+        # Moved switches keep the rules they learned, so nothing misses again
+        assert cluster.process_packets(traffic) == first
+        assert cluster.remove_worker(0)
+        assert cluster.process_packets(traffic) == first
+        metrics = cluster.get_performance_metrics()
+        assert metrics['controller_requests'] == len(traffic)
+        assert metrics['flow_table_hits'] == 2 * len(traffic)
+        assert len(metrics['packet_processing_time']) == 3 * len(traffic)
+
+
+def test_traffic_generator_is_seeded_chunked_and_zipf_skewed():
+    generator = sdn.TrafficGenerator(num_packets=5000, seed=7, num_flows=200, chunk_size=700)
+    packets = list(generator)
+    assert len(packets) == len(generator) == 5000
+    # Every pass starts over from the seed, and so does another generator with that seed
+    assert list(generator) == packets
+    assert list(sdn.TrafficGenerator(num_packets=5000, seed=7, num_flows=200,
+                                     chunk_size=700)) == packets
+    assert list(sdn.TrafficGenerator(num_packets=5000, seed=8, num_flows=200,
+                                     chunk_size=700)) != packets
+
+    chunks = list(generator.timed_batches())
+    assert all(len(timestamps) <= 700 for timestamps, _ in chunks)
+    timestamps = np.concatenate([timestamps for timestamps, _ in chunks])
+    assert np.all(np.diff(timestamps) > 0)
+
+    batches = list(generator.batches(batch_size=1000))
+    assert [len(batch['src_ip']) for batch in batches] == [1000] * 5
+    assert [packet for batch in batches for packet in sdn.batch_to_packets(batch)] == packets
+
+    # The most popular flows carry about the share their Zipf weights give them
+    counts = {}
+    for packet in packets:
+        key = sdn.flow_key(packet)
+        counts[key] = counts.get(key, 0) + 1
+    top = sum(sorted(counts.values(), reverse=True)[:10]) / len(packets)
+    assert abs(top - generator.popularity[:10].sum()) < 0.05
+    assert top > 0.4
+    uniform = sdn.TrafficGenerator(num_packets=5000, seed=7, num_flows=200, zipf_alpha=0)
+    counts = {}
+    for packet in uniform:
+        key = sdn.flow_key(packet)
+        counts[key] = counts.get(key, 0) + 1
+    assert sum(sorted(counts.values(), reverse=True)[:10]) / len(packets) < 0.1
+
+
+def test_traffic_generator_flow_arrivals_are_seeded_and_exact():
+    options = dict(num_packets=3000, seed=3, num_flows=50, flow_rate=2000.0,
+                   packet_rate=1e5, flow_duration=0.01, chunk_size=500)
+    generator = sdn.TrafficGenerator(**options)
+    packets = list(generator.timed_packets())
+    assert len(packets) == 3000
+    assert generator.flows_started > 0
+    assert packets == list(sdn.TrafficGenerator(**options).timed_packets())
+    times = [time for time, _ in packets]
+    assert times == sorted(times) and times[0] >= 0
+
+
+def test_concurrent_traffic_matches_sequential_processing():
+    rng = random.Random(19)
+    switch_ids = ("sw1", "sw2")
+    traffic = [(rng.choice(switch_ids), random_packet(rng)) for _ in range(3000)]
+    reference = new_controller(switch_ids)
+    expected = [reference.process_packet(switch_id, dict(packet)) for switch_id, packet in traffic]
+
+    controller = new_controller(switch_ids)
+    results = sdn.run_concurrent_traffic(controller, traffic, num_threads=4, chunk_size=64)
+    assert results == expected
+    metrics = controller.merge_thread_stats()
+    for name in ('flow_table_hits', 'flow_table_misses', 'controller_requests'):
+        assert metrics[name] == reference.performance_metrics[name]
+    assert len(metrics['packet_processing_time']) == len(traffic)
+    for switch_id in switch_ids:
+        assert (controller.switches[switch_id]['packet_count'] ==
+                reference.switches[switch_id]['packet_count'])
+        # Every flow is learned once, and its counters add up across threads; threads may
+        # learn flows in a different order
+        assert (sorted((repr(rule.match), rule.counter)
+                       for rule in controller.flow_tables[switch_id]) ==
+                sorted((repr(rule.match), rule.counter)
+                       for rule in reference.flow_tables[switch_id]))
+
+    # A rule installed in concurrent mode is published to the readers' snapshot
+    hits = metrics['flow_table_hits']
+    packet = {'src_ip': '192.168.7.7', 'dst_ip': '10.9.0.1', 'src_port': 4000,
+              'dst_port': 8080, 'protocol': 'TCP'}
+    assert controller.add_flow_rule("sw1", {'src_ip': '192.168.7.7'}, {'drop': True})
+    assert controller.process_packet("sw1", dict(packet)) == {'status': 'dropped'}
+    controller.disable_concurrency()
+    assert controller.process_packet("sw1", dict(packet)) == {'status': 'dropped'}
+    assert controller.performance_metrics['flow_table_hits'] == hits + 2
+
+
+def test_stress_test_concurrency_passes_under_concurrent_installs():
+    result = sdn.stress_test_concurrency(num_threads=4, num_packets=4000, num_switches=2,
+                                         num_flows=300, writer_rules=200)
+    assert result['passed'], result['checks']
+    assert result['installed'] == 200
+
+
+def test_bulk_stats_queries_filter_aggregate_and_rank_rules():
+    controller = new_controller(("sw1", "sw2"))
+    now = [10.0]
+    controller.clock = lambda: now[0]
+    assert controller.add_flow_rule("sw1", {'dst_port': 80}, {'forward_port': 1})
+    assert controller.add_flow_rule("sw1", {'dst_port': 443}, {'forward_port': 2})
+    assert controller.add_flow_rule("sw2", {'protocol': 'UDP'}, {'drop': True})
+    web, secure = controller.flow_tables["sw1"]
+    dns, = controller.flow_tables["sw2"]
+
+    def send(switch_id, dst_port, protocol, size, count):
+        for _ in range(count):
+            controller.process_packet(switch_id, {'src_ip': '10.0.0.1', 'dst_ip': '10.9.0.1',
+                                                  'src_port': 5000, 'dst_port': dst_port,
+                                                  'protocol': protocol, 'size': size})
+
+    send("sw1", 80, 'TCP', 100, 3)
+    send("sw1", 443, 'TCP', 1000, 1)
+    send("sw2", 53, 'UDP', 50, 2)
+    now[0] = 50.0
+    send("sw1", 80, 'TCP', 100, 1)
+    now[0] = 60.0
+
+    stats = controller.get_flow_stats()
+    assert list(stats['rule']) == [web, secure, dns]
+    assert list(stats['switch']) == ["sw1", "sw1", "sw2"]
+    assert stats['packet_count'].tolist() == [4, 1, 2]
+    assert stats['byte_count'].tolist() == [400, 1000, 100]
+    assert stats['idle_time'].tolist() == [10.0, 50.0, 50.0]
+    assert stats['duration'].tolist() == [50.0, 50.0, 50.0]
+
+    assert list(controller.get_flow_stats("sw1")['rule']) == [web, secure]
+    assert list(controller.get_flow_stats(cookie=secure.cookie, cookie_mask=-1)['rule']) == [secure]
+    assert list(controller.get_flow_stats(min_packets=2)['rule']) == [web, dns]
+    assert list(controller.get_flow_stats(min_bytes=500)['rule']) == [secure]
+    assert list(controller.get_flow_stats(idle_for=30)['rule']) == [secure, dns]
+    assert controller.get_aggregate_stats("sw1") == {'packet_count': 5, 'byte_count': 1400,
+                                                     'flow_count': 2}
+
+    table = controller.get_table_stats()
+    assert list(table['switch']) == ["sw1", "sw2"]
+    assert table['lookup_count'].tolist() == [5, 2]
+    assert table['active_count'].tolist() == [2, 1]
+    assert table['matched_count'].tolist() == [5, 2]
+    assert table['byte_count'].tolist() == [1400, 100]
+
+    assert list(controller.get_top_flows(2)['rule']) == [web, dns]
+    assert list(controller.get_top_flows(2, by='byte_count')['rule']) == [secure, web]
+    assert list(controller.get_top_flows(5, switch_id="sw2")['rule']) == [dns]
+    assert len(controller.get_top_flows(0)['rule']) == 0
+
+    # Removed rules leave the statistics, and a rule reusing their row starts from zero
+    assert controller.remove_flow_rule("sw1", secure)
+    assert list(controller.get_flow_stats()['rule']) == [web, dns]
+    assert controller.add_flow_rule("sw2", {'dst_port': 22}, {'forward_port': 3})
+    ssh = controller.flow_tables["sw2"][-1]
+    stats = controller.get_flow_stats("sw2")
+    assert list(stats['rule']) == [dns, ssh]
+    assert stats['packet_count'].tolist() == [2, 0]
+    assert stats['byte_count'].tolist() == [100, 0]